@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+AIRP v2.0 - Bank Reconciliation Benchmark
+Runs the ai-recon matching stages on large synthetic statements (1k to 1M lines)
+with the LLM replaced by a local stub, and records throughput, per-stage
+latency, peak memory and match precision/recall in a JSON file
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+RECON_APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services", "ai-recon", "app")
+OUTPUT_FILE = "reconciliation-benchmark-results.json"
+DEFAULT_SIZES = "1000,10000,100000"
+
+# Share of bank lines per noise category (the rest are clean: same amount, date and wording)
+NOISE_RATES = {
+    "date_shift": 0.15,  # GL entry booked 1-5 days away from the bank date
+    "reworded": 0.15,    # GL entry 1-5 days off and describing the payment in different words
+    "split": 0.03,       # One bank payment booked as 2-4 GL entries
+    "missing_gl": 0.05,  # Bank line with no GL entry at all
+}
+# Unrelated GL entries (no bank line), relative to the number of bank lines
+GL_ONLY_RATE = 0.05
+# Share of bank lines carrying an invoice reference that also appears on the GL entry
+REFERENCE_RATE = 0.10
+
+# (counterparty, bank purpose words, GL wordings of the same payment)
+COUNTERPARTIES = [
+    ("DUBAI PROPERTIES", "office rent", ["Office rent payment - Dubai Properties", "Monthly lease for head office"]),
+    ("DEWA", "electricity bill", ["Electricity bill payment to DEWA", "Utilities - power and water"]),
+    ("PAYROLL", "salary transfer", ["Monthly salary payment to employees", "Staff wages"]),
+    ("GOOGLE", "workspace subscription", ["Google Workspace subscription", "G Suite annual licence"]),
+    ("META", "facebook ads", ["Facebook ads campaign - Meta", "Social media advertising"]),
+    ("OFFICE DEPOT", "office supplies", ["Office supplies purchase", "Stationery and consumables"]),
+    ("EMIRATES", "flight tickets", ["Flight tickets - Emirates", "Business travel airfare"]),
+    ("AXA", "insurance premium", ["Insurance premium - AXA", "Medical cover instalment"]),
+    ("ETISALAT", "telecom bill", ["Telecom bill - Etisalat", "Mobile and internet charges"]),
+    ("AMAZON WEB SERVICES", "cloud hosting", ["AWS cloud hosting", "Server infrastructure costs"]),
+    ("ENOC", "fuel card", ["Fuel card top-up - ENOC", "Vehicle fuel expenses"]),
+    ("AL FUTTAIM", "vehicle service", ["Vehicle service - Al Futtaim", "Fleet maintenance"]),
+]
+BANK_PREFIXES = ["TRF", "POS", "DD", "CHQ", "IBFT", "SO"]
+# Tenant the statements belong to, with aliases learned from earlier confirmed matches
+BENCHMARK_TENANT_ID = "benchmark-tenant"
+# Unmatched line IDs kept in the results file (the counts are always complete)
+UNMATCHED_SAMPLE_SIZE = 20
+
+
+# ============================================
+# SYNTHETIC STATEMENTS
+# ============================================
+
+def generate_statement(size: int, seed: int) -> Tuple[List[Dict], List[Dict], Dict[Tuple[str, str], str]]:
+    """
+    Generate `size` bank lines, their GL entries and the ground truth.
+
+    Returns (bank lines, GL entries, {(bank ID, GL ID): noise category}).
+    The same size and seed always produce the same statement.
+    """
+    rng = random.Random(f"{seed}:{size}")
+    start = date(2025, 1, 1)
+    bank_txns, gl_txns = [], []
+    truth: Dict[Tuple[str, str], str] = {}
+    categories = list(NOISE_RATES) + ["clean"]
+    weights = list(NOISE_RATES.values()) + [1.0 - sum(NOISE_RATES.values())]
+
+    def gl_entry(amount: float, entry_date: date, description: str) -> Dict:
+        gl_id = f"JE-{len(gl_txns) + 1:07d}"
+        gl_txns.append({
+            "entry_id": gl_id,
+            "entry_date": entry_date.isoformat(),
+            "description": description,
+            "amount": amount,
+            "account_code": "5000",
+            "account_name": "Expenses",
+        })
+        return gl_id
+
+    for i in range(size):
+        category = rng.choices(categories, weights)[0]
+        counterparty, purpose, wordings = rng.choice(COUNTERPARTIES)
+        amount = -round(rng.uniform(10, 50000), 2)
+        bank_date = start + timedelta(days=rng.randrange(365))
+        bank_id = f"BNK-{i + 1:07d}"
+
+        reference = None
+        gl_description = f"{wordings[0]} {purpose}"
+        if rng.random() < REFERENCE_RATE:
+            reference = f"INV-{seed % 10000:04d}-{i + 1:07d}"
+            gl_description += f" {reference}"
+
+        bank_txns.append({
+            "transaction_id": bank_id,
+            "transaction_date": bank_date.isoformat(),
+            "description": f"{rng.choice(BANK_PREFIXES)} {counterparty} {purpose.upper()} {rng.randrange(10**6):06d}",
+            "amount": amount,
+            "transaction_type": "debit",
+            "reference_number": reference,
+        })
+
+        if category == "missing_gl":
+            continue
+        if category == "split":
+            parts = rng.randint(2, 4)
+            cuts = sorted(rng.sample(range(1, int(round(-amount * 100))), parts - 1))
+            bounds = [0] + cuts + [int(round(-amount * 100))]
+            for lo, hi in zip(bounds, bounds[1:]):
+                part_date = bank_date + timedelta(days=rng.randint(-3, 3))
+                gl_id = gl_entry(-(hi - lo) / 100, part_date, f"{wordings[0]} part payment")
+                truth[(bank_id, gl_id)] = category
+            continue
+
+        gl_date = bank_date
+        if category in ("date_shift", "reworded"):
+            gl_date += timedelta(days=rng.choice([-1, 1]) * rng.randint(1, 5))
+        if category == "reworded":
+            gl_description = rng.choice(wordings[1:])
+            if reference:
+                gl_description += f" {reference}"
+        truth[(bank_id, gl_entry(amount, gl_date, gl_description))] = category
+
+    for _ in range(int(size * GL_ONLY_RATE)):
+        _, _, wordings = rng.choice(COUNTERPARTIES)
+        gl_entry(-round(rng.uniform(10, 50000), 2), start + timedelta(days=rng.randrange(365)), rng.choice(wordings))
+
+    rng.shuffle(gl_txns)
+    return bank_txns, gl_txns, truth
+
+
+# ============================================
+# LLM STUB
+# ============================================
+
+class StubMessage:
+    def __init__(self, text: str):
+        self.content = [type("TextBlock", (), {"text": text})()]
+
+
+class StubAIClient:
+    """
+    Stands in for anthropic.AsyncAnthropic in the AI stage.
+
+    Answers from the ground truth: a bank line is matched when one of its true
+    GL entries is among the prompt's candidates, so AI-stage recall measures
+    candidate retrieval rather than model quality. `latency_ms` simulates the
+    round trip of each call.
+    """
+
+    ID_PATTERN = re.compile(r"^- ID: ([^,\n]+)", re.MULTILINE)
+
+    def __init__(self, truth: Dict[Tuple[str, str], str], latency_ms: float = 0.0):
+        self.gl_ids_by_bank: Dict[str, Set[str]] = defaultdict(set)
+        for bank_id, gl_id in truth:
+            self.gl_ids_by_bank[bank_id].add(gl_id)
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.prompt_chars = 0
+        self.messages = self
+
+    def answer(self, bank_id: str, candidate_ids: List[str]) -> Dict:
+        for gl_id in candidate_ids:
+            if gl_id in self.gl_ids_by_bank.get(bank_id, ()):
+                return {"bank_id": bank_id, "matched_gl_id": gl_id, "confidence": 0.9, "reasoning": "Stub match"}
+        return {"bank_id": bank_id, "matched_gl_id": None, "confidence": 0.0, "reasoning": "No confident match found"}
+
+    async def create(self, messages: List[Dict], **kwargs) -> StubMessage:
+        self.calls += 1
+        prompt = messages[0]["content"]
+        self.prompt_chars += len(prompt)
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+        bank_part, _, candidate_part = prompt.partition("Candidate GL Entries:")
+        candidate_ids = self.ID_PATTERN.findall(candidate_part)
+        if "Bank Transactions:" in bank_part:
+            answers = [self.answer(bank_id, candidate_ids) for bank_id in self.ID_PATTERN.findall(bank_part)]
+            return StubMessage(json.dumps(answers))
+        bank_id = re.search(r"^- ID: (.+)$", bank_part, re.MULTILINE).group(1).strip()
+        return StubMessage(json.dumps(self.answer(bank_id, candidate_ids)))
+
+
+# ============================================
+# BENCHMARK
+# ============================================
+
+def seed_aliases(alias_store, tenant_id: str) -> int:
+    """
+    Teach the alias store one alternative GL wording per bank description.
+
+    Mirrors a tenant whose earlier AI and manual matches have been confirmed,
+    so the "reworded" lines exercise the alias-substituted fuzzy stage.
+    Returns the number of aliases learned.
+    """
+    learned = 0
+    for counterparty, purpose, wordings in COUNTERPARTIES:
+        for prefix in BANK_PREFIXES:
+            if alias_store.learn(tenant_id, f"{prefix} {counterparty} {purpose.upper()}", wordings[1], "manual"):
+                learned += 1
+    return learned
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process (None where the resource module is unavailable)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def score_matches(
+    truth: Dict[Tuple[str, str], str],
+    matches: list,
+    group_matches: list,
+) -> Dict:
+    """Pair-level precision/recall, overall and per noise category"""
+    predicted = {(m.bank_transaction_id, m.gl_transaction_id) for m in matches}
+    for group in group_matches:
+        predicted.update((b, g) for b in group.bank_transaction_ids for g in group.gl_transaction_ids)
+
+    correct = predicted & truth.keys()
+    truth_by_category = Counter(truth.values())
+    found_by_category = Counter(truth[pair] for pair in correct)
+
+    return {
+        "predicted_pairs": len(predicted),
+        "true_pairs": len(truth),
+        "correct_pairs": len(correct),
+        "precision": len(correct) / len(predicted) if predicted else 1.0,
+        "recall": len(correct) / len(truth) if truth else 1.0,
+        "recall_by_noise": {
+            category: found_by_category[category] / count
+            for category, count in sorted(truth_by_category.items())
+        },
+    }
+
+
+def run_scenario(size: int, seed: int, options: Dict, ai_latency_ms: float, aliases: bool) -> Dict:
+    """Generate one statement and reconcile it (runs in a fresh worker process)"""
+    os.environ["RECON_STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="recon-bench-"), "store.sqlite3")
+    os.environ["AI_MAX_REQUESTS_PER_MINUTE"] = "0"
+    sys.path.insert(0, RECON_APP_DIR)
+    import logging
+    logging.disable(logging.WARNING)
+    import ai_matching
+    import main as recon
+
+    bank_dicts, gl_dicts, truth = generate_statement(size, seed)
+    bank_txns = [recon.BankTransaction(**txn) for txn in bank_dicts]
+    gl_txns = [recon.GLTransaction(**txn) for txn in gl_dicts]
+    del bank_dicts, gl_dicts
+
+    stub = StubAIClient(truth, ai_latency_ms)
+    ai_matching.ai_client = stub
+    learned_aliases = seed_aliases(recon.alias_store, BENCHMARK_TENANT_ID) if aliases else 0
+
+    start_time = time.perf_counter()
+    matches, group_matches, unmatched_bank, unmatched_gl, stage_timings, _ = asyncio.run(
+        recon.reconcile_transactions(
+            bank_txns, gl_txns, tenant_id=BENCHMARK_TENANT_ID if aliases else None, **options
+        )
+    )
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "bank_lines": len(bank_txns),
+        "gl_entries": len(gl_txns),
+        "elapsed_seconds": elapsed,
+        "lines_per_second": len(bank_txns) / elapsed if elapsed else None,
+        "stage_timings_ms": stage_timings,
+        "peak_rss_mb": peak_rss_mb(),
+        "match_types": dict(Counter(m.match_type for m in matches) + Counter(g.match_type for g in group_matches)),
+        "learned_aliases": learned_aliases,
+        "unmatched_bank": len(unmatched_bank),
+        "unmatched_gl": len(unmatched_gl),
+        "unmatched_bank_sample": unmatched_bank[:UNMATCHED_SAMPLE_SIZE],
+        "unmatched_gl_sample": unmatched_gl[:UNMATCHED_SAMPLE_SIZE],
+        "ai_calls": stub.calls,
+        "ai_prompt_tokens_est": stub.prompt_chars // 4,
+        "accuracy": score_matches(truth, matches, group_matches),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes: List[int], seed: int, options: Dict, ai_latency_ms: float, aliases: bool, output_file: str):
+    print("=" * 80)
+    print("AIRP v2.0 - Bank Reconciliation Benchmark")
+    print("=" * 80)
+    print(f"Started at: {datetime.now().isoformat()}")
+    print(f"Sizes: {', '.join(f'{size:,}' for size in sizes)} bank lines (seed {seed})")
+    print(f"Options: {options}, stub AI latency {ai_latency_ms:.0f}ms, learned aliases {'on' if aliases else 'off'}")
+    print("=" * 80)
+
+    results = []
+    for size in sizes:
+        print(f"\nReconciling {size:,} bank lines...")
+        # A fresh process per size keeps peak memory readings independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_scenario, size, seed, options, ai_latency_ms, aliases).result()
+        results.append({"size": size, **result})
+
+        accuracy = result["accuracy"]
+        stages = ", ".join(f"{stage} {ms:.0f}ms" for stage, ms in result["stage_timings_ms"].items())
+        peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"  Time:        {result['elapsed_seconds']:.2f}s ({result['lines_per_second']:,.0f} lines/s)")
+        print(f"  Stages:      {stages}")
+        print(f"  Peak memory: {peak}")
+        print(f"  AI calls:    {result['ai_calls']:,}")
+        print(f"  Unmatched:   {result['unmatched_bank']:,} bank, {result['unmatched_gl']:,} GL")
+        print(f"  Precision:   {accuracy['precision']:.2%}   Recall: {accuracy['recall']:.2%}")
+        print("  Recall by noise: " + ", ".join(f"{k} {v:.1%}" for k, v in accuracy["recall_by_noise"].items()))
+
+    with open(output_file, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "seed": seed,
+            "options": options,
+            "ai_latency_ms": ai_latency_ms,
+            "aliases": aliases,
+            "noise_rates": NOISE_RATES,
+            "results": results,
+        }, f, indent=2)
+
+    print("\n" + "=" * 80)
+    print(f"Detailed results saved to: {output_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ai-recon matching on synthetic statements")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated bank line counts (e.g. 1000,1000000)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--assignment", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--ai-mode", choices=["single", "batched"], default="batched")
+    parser.add_argument("--ai-latency-ms", type=float, default=0.0, help="Simulated latency per stub AI call")
+    parser.add_argument("--fuzzy-date-window-days", type=int, default=None)
+    parser.add_argument("--split-matching", action="store_true", help="Enable the split matching stage")
+    parser.add_argument("--no-aliases", action="store_true", help="Reconcile without learned description aliases")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    run_benchmark(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        seed=args.seed,
+        options={
+            "assignment": args.assignment,
+            "ai_mode": args.ai_mode,
+            "fuzzy_date_window_days": args.fuzzy_date_window_days,
+            "split_matching": args.split_matching,
+        },
+        ai_latency_ms=args.ai_latency_ms,
+        aliases=not args.no_aliases,
+        output_file=args.output,
+    )
@@ -0,0 +1,18 @@
+-- =====================================================
+-- Migration 005: AI feedback retraining
+-- =====================================================
+-- Description: Index ai_training_feedback by model and feedback date so the
+--              ai-auto-accounting retraining job can read new feedback
+--              since its watermark without scanning the table, and allow
+--              feedback without a tenant (older /feedback clients)
+-- Date: 2026-10-18
+-- =====================================================
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_ai_feedback_model_date
+    ON ai_training_feedback(model_name, feedback_date);
+
+ALTER TABLE ai_training_feedback ALTER COLUMN tenant_id DROP NOT NULL;
+
+COMMIT;
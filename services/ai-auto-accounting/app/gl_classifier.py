@@ -0,0 +1,461 @@
+"""
+AIRP v2.0 - Local GL Classifier
+Hashed character n-gram features + linear model for the no-LLM fast path
+
+Lines are featurized as "TYPE | counterparty | description" with a
+HashingVectorizer (stateless, so incremental training never needs a
+vocabulary refit) and classified by a logistic-loss SGDClassifier. A
+prediction is only accepted when its probability clears accept_threshold,
+which is calibrated on one half of a holdout set to the lowest confidence at
+which the accepted predictions still reach the target precision; the other
+half measures the reported metrics, so they are not biased by calibration.
+
+Models are stored as numbered artifacts (gl_classifier_v<N>.joblib) in a
+model directory, with a CURRENT file naming the version the service loads
+at startup. Artifacts only hold scikit-learn objects and plain metadata,
+so they load whichever way this module is imported. Train with:
+
+    python -m app.gl_classifier train --data examples.jsonl --model-dir /models
+    python -m app.gl_classifier train --from-feedback --model-dir /models
+
+--from-feedback reads the service's feedback store (FEEDBACK_SQLITE_PATH or
+the POSTGRES_* settings) and stamps the model with the newest feedback
+date, so the service's incremental retraining continues from there.
+
+The service also retrains from its feedback store: partial_fit() updates a
+copy of the current model with feedback newer than the model's
+feedback_watermark, and the copy is only promoted if it beats the current
+model on the evaluation half of the holdout split. Several service workers
+share one model directory; only the holder of its retraining lock saves and
+promotes versions.
+"""
+import argparse
+import copy
+import fcntl
+import json
+import logging
+import os
+import re
+import sys
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import joblib
+import numpy as np
+from scipy.special import expit
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = 1
+N_FEATURES = 2 ** 18
+NGRAM_RANGE = (3, 5)
+# Share of examples held out for calibration and evaluation (chosen by a stable hash of the line);
+# the first CALIBRATION_PERCENT of those hash buckets calibrate, the rest evaluate
+HOLDOUT_PERCENT = 20
+CALIBRATION_PERCENT = 10
+DEFAULT_TARGET_PRECISION = 0.95
+MIN_TRAINING_EXAMPLES = 20
+# Threshold of a model that must never be trusted (no calibration data reached the target precision)
+NEVER_ACCEPT = 1.01
+
+
+class TrainingExample(NamedTuple):
+    """One labelled invoice line"""
+    description: str
+    account_code: str
+    vendor_or_customer: Optional[str] = None
+    transaction_type: str = "AP"
+
+
+# (description, vendor or customer, transaction type) of a line to classify
+LineFeatures = Tuple[str, Optional[str], str]
+
+
+def feature_text(description: str, vendor_or_customer: Optional[str], transaction_type: str) -> str:
+    return f"{transaction_type.upper()} | {vendor_or_customer or ''} | {description}"
+
+
+def holdout_bucket(example: TrainingExample) -> int:
+    """Stable hash bucket (0-99) of a line: the same line always lands in the same split across retrains"""
+    text = feature_text(example.description, example.vendor_or_customer, example.transaction_type)
+    return zlib.crc32(text.lower().encode()) % 100
+
+
+def is_holdout(example: TrainingExample) -> bool:
+    return holdout_bucket(example) < HOLDOUT_PERCENT
+
+
+def split_holdout(examples: List[TrainingExample]) -> Tuple[List[TrainingExample], List[TrainingExample]]:
+    """(training examples, holdout examples)"""
+    train, holdout = [], []
+    for example in examples:
+        (holdout if is_holdout(example) else train).append(example)
+    return train, holdout
+
+
+def split_calibration(
+    holdout: List[TrainingExample],
+) -> Tuple[List[TrainingExample], List[TrainingExample]]:
+    """(calibration examples, evaluation examples) of a holdout split"""
+    calibration, evaluation = [], []
+    for example in holdout:
+        (calibration if holdout_bucket(example) < CALIBRATION_PERCENT else evaluation).append(example)
+    return calibration, evaluation
+
+
+def make_vectorizer() -> HashingVectorizer:
+    return HashingVectorizer(
+        analyzer="char_wb",
+        ngram_range=NGRAM_RANGE,
+        n_features=N_FEATURES,
+        alternate_sign=False,
+    )
+
+
+class LocalGLClassifier:
+    """Linear classifier over hashed n-grams, with a calibrated acceptance threshold"""
+
+    def __init__(
+        self,
+        model: SGDClassifier,
+        accept_threshold: float = NEVER_ACCEPT,
+        version: Optional[int] = None,
+        metrics: Optional[Dict[str, float]] = None,
+        trained_at: Optional[str] = None,
+        feedback_watermark: Optional[str] = None,
+    ):
+        self.model = model
+        self.accept_threshold = accept_threshold
+        self.version = version
+        self.metrics = metrics or {}
+        self.trained_at = trained_at or datetime.utcnow().isoformat()
+        # Timestamp of the newest stored feedback this model has been trained on
+        self.feedback_watermark = feedback_watermark
+        self.vectorizer = make_vectorizer()
+        # Contiguous (features x classes) weights: sklearn's predict_proba copies the transposed
+        # coefficient matrix on every call, which dominates single-line latency
+        self._weights = np.ascontiguousarray(model.coef_.T)
+
+    @classmethod
+    def train(
+        cls,
+        examples: List[TrainingExample],
+        target_precision: float = DEFAULT_TARGET_PRECISION,
+    ) -> "LocalGLClassifier":
+        """
+        Fit on the training split, calibrate the acceptance threshold on the
+        calibration half of the holdout and measure metrics on the other half
+        """
+        train, holdout = split_holdout(examples)
+        if len(train) < MIN_TRAINING_EXAMPLES:
+            raise ValueError(f"Need at least {MIN_TRAINING_EXAMPLES} training examples, got {len(train)}")
+        if len({example.account_code for example in train}) < 2:
+            raise ValueError("Need examples of at least 2 account codes")
+
+        model = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=50, tol=1e-4, random_state=0)
+        model.fit(cls._features(train), [example.account_code for example in train])
+        classifier = cls(model)
+        calibration, evaluation = split_calibration(holdout)
+        classifier.calibrate(calibration, target_precision, evaluation)
+        classifier.metrics["training_examples"] = len(train)
+        return classifier
+
+    @staticmethod
+    def _features(examples: Iterable[TrainingExample]):
+        return make_vectorizer().transform(
+            feature_text(example.description, example.vendor_or_customer, example.transaction_type)
+            for example in examples
+        )
+
+    @property
+    def classes(self) -> List[str]:
+        return [str(code) for code in self.model.classes_]
+
+    def predict_proba(self, features) -> np.ndarray:
+        """Same probabilities as SGDClassifier.predict_proba (one-vs-rest logistic, normalized)"""
+        probabilities = expit(np.asarray(features @ self._weights) + self.model.intercept_)
+        if probabilities.shape[1] == 1:
+            return np.hstack([1 - probabilities, probabilities])
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, lines: List[LineFeatures]) -> List[Tuple[str, float]]:
+        """(account code, probability) of the most likely account for every line"""
+        if not lines:
+            return []
+        features = self.vectorizer.transform(feature_text(*line) for line in lines)
+        probabilities = self.predict_proba(features)
+        best = probabilities.argmax(axis=1)
+        classes = self.model.classes_
+        return [(str(classes[b]), float(probabilities[row, b])) for row, b in enumerate(best)]
+
+    def evaluate(self, examples: List[TrainingExample]) -> Dict[str, float]:
+        """
+        Holdout metrics: accuracy over all examples, coverage (share accepted
+        at the current threshold) and precision of the accepted predictions
+        """
+        if not examples:
+            return {"examples": 0, "accuracy": 0.0, "coverage": 0.0, "accepted_precision": 0.0}
+        predictions = self.predict([
+            (example.description, example.vendor_or_customer, example.transaction_type) for example in examples
+        ])
+        correct = np.array([code == example.account_code for (code, _), example in zip(predictions, examples)])
+        accepted = np.array([confidence >= self.accept_threshold for _, confidence in predictions])
+        return {
+            "examples": len(examples),
+            "accuracy": float(correct.mean()),
+            "coverage": float(accepted.mean()),
+            "accepted_precision": float(correct[accepted].mean()) if accepted.any() else 0.0,
+        }
+
+    def calibrate(
+        self,
+        holdout: List[TrainingExample],
+        target_precision: float = DEFAULT_TARGET_PRECISION,
+        evaluation: Optional[List[TrainingExample]] = None,
+    ) -> None:
+        """
+        Set accept_threshold to the lowest holdout confidence whose accepted
+        predictions (confidence >= threshold) still reach target_precision
+
+        metrics are measured on the evaluation examples when given (on the
+        calibration examples otherwise, which overstates precision).
+        """
+        self.accept_threshold = NEVER_ACCEPT
+        if holdout:
+            predictions = self.predict([
+                (example.description, example.vendor_or_customer, example.transaction_type) for example in holdout
+            ])
+            confidences = np.array([confidence for _, confidence in predictions])
+            correct = np.array([code == example.account_code for (code, _), example in zip(predictions, holdout)])
+            order = np.argsort(-confidences, kind="stable")
+            precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+            reaching = np.flatnonzero(precision >= target_precision)
+            if len(reaching):
+                self.accept_threshold = float(confidences[order][reaching[-1]])
+        self.metrics = {
+            **self.evaluate(holdout if evaluation is None else evaluation),
+            "calibration_examples": len(holdout),
+            "target_precision": target_precision,
+        }
+
+    def partial_fit(self, examples: List[TrainingExample]) -> "LocalGLClassifier":
+        """
+        Copy of this model updated with new examples (one SGD pass).
+
+        Raises ValueError when the examples use an account code the model
+        has never seen; that needs a full train().
+        """
+        unseen = {example.account_code for example in examples} - set(self.classes)
+        if unseen:
+            raise ValueError(f"Unseen account codes need a full retrain: {sorted(unseen)}")
+        model = copy.deepcopy(self.model)
+        if examples:
+            model.partial_fit(self._features(examples), [example.account_code for example in examples])
+        return LocalGLClassifier(
+            model,
+            self.accept_threshold,
+            metrics=dict(self.metrics),
+            feedback_watermark=self.feedback_watermark,
+        )
+
+    def to_artifact(self) -> dict:
+        return {
+            "format": ARTIFACT_FORMAT,
+            "version": self.version,
+            "trained_at": self.trained_at,
+            "n_features": N_FEATURES,
+            "ngram_range": NGRAM_RANGE,
+            "accept_threshold": self.accept_threshold,
+            "metrics": self.metrics,
+            "feedback_watermark": self.feedback_watermark,
+            "model": self.model,
+        }
+
+    @classmethod
+    def from_artifact(cls, artifact: dict) -> "LocalGLClassifier":
+        if (
+            artifact.get("format") != ARTIFACT_FORMAT
+            or artifact.get("n_features") != N_FEATURES
+            or tuple(artifact.get("ngram_range", ())) != NGRAM_RANGE
+        ):
+            raise ValueError("Model artifact was built with incompatible features")
+        return cls(
+            artifact["model"],
+            artifact["accept_threshold"],
+            artifact["version"],
+            artifact["metrics"],
+            artifact["trained_at"],
+            artifact.get("feedback_watermark"),
+        )
+
+
+class ModelRegistry:
+    """Numbered model artifacts in a directory plus a CURRENT pointer to the promoted version"""
+
+    CURRENT_FILE = "CURRENT"
+    LOCK_FILE = "RETRAIN.lock"
+    ARTIFACT_PATTERN = re.compile(r"^gl_classifier_v(\d+)\.joblib$")
+
+    def __init__(self, model_dir: str):
+        self.model_dir = model_dir
+        self._lock_file = None
+
+    def try_lock(self) -> bool:
+        """
+        Take the directory's retraining lock without waiting; True when this registry holds it
+
+        The lock is held until release() or until the process exits (the OS
+        drops it then, so another worker can take over).
+        """
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self.model_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.model_dir, self.LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def path(self, version: int) -> str:
+        return os.path.join(self.model_dir, f"gl_classifier_v{version}.joblib")
+
+    def versions(self) -> List[int]:
+        if not os.path.isdir(self.model_dir):
+            return []
+        return sorted(
+            int(match.group(1))
+            for match in map(self.ARTIFACT_PATTERN.match, os.listdir(self.model_dir))
+            if match
+        )
+
+    def save(self, classifier: LocalGLClassifier) -> int:
+        """Store a new version (does not promote it); returns the version number"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        classifier.version = max(self.versions(), default=0) + 1
+        temp_path = self.path(classifier.version) + ".tmp"
+        joblib.dump(classifier.to_artifact(), temp_path)
+        os.replace(temp_path, self.path(classifier.version))
+        return classifier.version
+
+    def promote(self, version: int) -> None:
+        if not os.path.exists(self.path(version)):
+            raise FileNotFoundError(self.path(version))
+        temp_path = os.path.join(self.model_dir, self.CURRENT_FILE + ".tmp")
+        with open(temp_path, "w") as f:
+            f.write(f"{version}\n")
+        os.replace(temp_path, os.path.join(self.model_dir, self.CURRENT_FILE))
+
+    def current_version(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.model_dir, self.CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self, version: int) -> LocalGLClassifier:
+        return LocalGLClassifier.from_artifact(joblib.load(self.path(version)))
+
+    def load_current(self) -> Optional[LocalGLClassifier]:
+        version = self.current_version()
+        return self.load(version) if version is not None else None
+
+
+def load_examples(path: str) -> List[TrainingExample]:
+    """
+    Labelled lines from a JSONL file (e.g. exported feedback), one object per line:
+    {"description": ..., "account_code": ..., "vendor_name": ..., "transaction_type": "AP"}
+    ("actual_account" and "customer_name" are accepted as well)
+    """
+    examples = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            account_code = record.get("account_code") or record.get("actual_account")
+            if not record.get("description") or not account_code:
+                logger.warning(f"{path}:{line_number}: skipping example without description or account code")
+                continue
+            examples.append(TrainingExample(
+                description=record["description"],
+                account_code=str(account_code),
+                vendor_or_customer=record.get("vendor_name") or record.get("customer_name"),
+                transaction_type=record.get("transaction_type") or "AP",
+            ))
+    return examples
+
+
+def load_feedback_examples(limit: Optional[int]) -> Tuple[List[TrainingExample], Optional[str]]:
+    """
+    Trainable lines among the most recent feedback rows (RETRAIN_FEEDBACK_WINDOW when limit is None),
+    and the newest feedback date to use as the model's watermark
+    """
+    # Imported here: the service module imports this one
+    try:
+        from app.main import RETRAIN_FEEDBACK_WINDOW, feedback_store
+    except ImportError:  # Running from inside app/ (python gl_classifier.py)
+        from main import RETRAIN_FEEDBACK_WINDOW, feedback_store
+
+    # Read the watermark first, so feedback arriving meanwhile is still picked up by retraining
+    watermark = feedback_store.newest_feedback_date()
+    return feedback_store.recent_examples(limit or RETRAIN_FEEDBACK_WINDOW), watermark
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Train the local GL classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="Train a new model version from labelled lines")
+    source = train_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--data", help="JSONL file of labelled invoice lines")
+    source.add_argument("--from-feedback", action="store_true", help="Train on the service's classification feedback")
+    train_parser.add_argument(
+        "--feedback-limit", type=int, help="Most recent feedback rows to read (default RETRAIN_FEEDBACK_WINDOW)"
+    )
+    train_parser.add_argument("--model-dir", default=os.getenv("GL_MODEL_DIR", "/models"))
+    train_parser.add_argument("--target-precision", type=float, default=DEFAULT_TARGET_PRECISION)
+    train_parser.add_argument("--no-promote", action="store_true", help="Store the version without making it current")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    watermark = None
+    if args.from_feedback:
+        examples, watermark = load_feedback_examples(args.feedback_limit)
+    else:
+        examples = load_examples(args.data)
+    try:
+        classifier = LocalGLClassifier.train(examples, args.target_precision)
+    except ValueError as e:
+        print(f"Training failed: {e}", file=sys.stderr)
+        return 1
+    classifier.feedback_watermark = watermark
+
+    registry = ModelRegistry(args.model_dir)
+    version = registry.save(classifier)
+    if not args.no_promote:
+        registry.promote(version)
+
+    metrics = classifier.metrics
+    print(f"Model v{version} saved to {registry.path(version)}{'' if args.no_promote else ' (current)'}")
+    print(
+        f"  Examples:           {len(examples)} ({metrics['training_examples']} train, "
+        f"{metrics['calibration_examples']} calibration, {metrics['examples']} evaluation)"
+    )
+    print(f"  Holdout accuracy:   {metrics['accuracy']:.1%}")
+    print(f"  Accept threshold:   {classifier.accept_threshold:.3f} (target precision {args.target_precision:.0%})")
+    print(f"  Coverage at target: {metrics['coverage']:.1%} (precision {metrics['accepted_precision']:.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
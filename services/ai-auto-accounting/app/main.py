@@ -3,18 +3,35 @@ AIRP v2.0 - AI Auto-Accounting Service
 Hybrid LLM + XGBoost for intelligent GL code classification
 """
 import os
+import re
+import json
+import time
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional
-from datetime import datetime
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
 
 from fastapi import FastAPI, HTTPException, status
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import anthropic
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import httpx
+import redis.asyncio as redis
+from psycopg2.pool import ThreadedConnectionPool
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from fastapi.responses import Response
 
+try:
+    from app.gl_classifier import LocalGLClassifier, ModelRegistry, TrainingExample, split_calibration, split_holdout
+except ImportError:  # Running from inside app/ (python main.py)
+    from gl_classifier import LocalGLClassifier, ModelRegistry, TrainingExample, split_calibration, split_holdout
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,24 +63,101 @@ classification_duration = Histogram(
     "Classification duration",
     ["method"],
 )
+cache_lookups = Counter(
+    "airp_ai_accounting_classification_cache_total",
+    "Classification cache lookups",
+    ["tier", "result"],
+)
+batch_prompt_lines = Histogram(
+    "airp_ai_accounting_batch_prompt_lines",
+    "Invoice lines classified per batched LLM prompt",
+    buckets=(1, 2, 5, 10, 20, 40, 80),
+)
 feedback_counter = Counter(
     "airp_ai_accounting_feedback_total",
     "User feedback received",
     ["feedback_type"],
 )
 
+model_promotions = Counter(
+    "airp_ai_accounting_model_promotions_total",
+    "Local classifier versions promoted by feedback retraining",
+)
+retrain_runs = Counter(
+    "airp_ai_accounting_retrain_runs_total",
+    "Feedback retraining rounds",
+    ["outcome"],
+)
+local_model_version = Gauge(
+    "airp_ai_accounting_local_model_version",
+    "Version of the local classifier in use (0 = none)",
+)
+local_model_holdout = Gauge(
+    "airp_ai_accounting_local_model_holdout",
+    "Holdout metrics of the local classifier in use",
+    ["metric"],
+)
+
 # Initialize AI client
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 AI_PROVIDER = os.getenv("AI_PROVIDER", "anthropic")
 
 if AI_PROVIDER == "anthropic" and ANTHROPIC_API_KEY:
-    ai_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+    # Async client so a slow LLM call never blocks other requests on the worker
+    ai_client = anthropic.AsyncAnthropic(
+        api_key=ANTHROPIC_API_KEY,
+        http_client=httpx.AsyncClient(timeout=60.0),
+        max_retries=2,
+    )
     logger.info("Initialized Anthropic Claude client")
 else:
     ai_client = None
     logger.warning("No AI client initialized - running in demo mode")
 
+# Maximum concurrent LLM calls across all requests on this worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# Batched classification (/classify-batch): invoice lines per prompt and approximate input token budget
+LLM_BATCH_MAX_LINES = int(os.getenv("LLM_BATCH_MAX_LINES", "40"))
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "4000"))
+
+# Classification cache: in-process LRU (entries, TTL) in front of Redis (empty REDIS_HOST disables Redis)
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000"))
+CLASSIFICATION_CACHE_TTL_SECONDS = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", "300"))
+REDIS_HOST = os.getenv("REDIS_HOST", "")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+REDIS_TTL = int(os.getenv("REDIS_TTL", "3600"))
+
+# Local classifier artifacts (python -m app.gl_classifier train); the CURRENT version is loaded at startup
+GL_MODEL_DIR = os.getenv("GL_MODEL_DIR", "/models")
+local_classifier: Optional[LocalGLClassifier] = None
+
+# Feedback store: Postgres ai_training_feedback table, or a local SQLite file when FEEDBACK_SQLITE_PATH is set
+FEEDBACK_SQLITE_PATH = os.getenv("FEEDBACK_SQLITE_PATH", "")
+DB_CONFIG = {
+    "host": os.getenv("POSTGRES_HOST", "localhost"),
+    "port": int(os.getenv("POSTGRES_PORT", "5432")),
+    "database": os.getenv("POSTGRES_DB", "airp_master"),
+    "user": os.getenv("POSTGRES_USER", "airp_admin"),
+    "password": os.getenv("POSTGRES_PASSWORD", "airp_secure_2024"),
+}
+FEEDBACK_DB_POOL_MAX = int(os.getenv("FEEDBACK_DB_POOL_MAX", "4"))
+# Background retraining of the local classifier from feedback: seconds between rounds (0 disables),
+# new feedback needed for a round, and most feedback rows read per round (new rows for the incremental
+# update; most recent rows for the holdout and full retrains)
+RETRAIN_INTERVAL_SECONDS = int(os.getenv("RETRAIN_INTERVAL_SECONDS", "900"))
+RETRAIN_MIN_NEW_FEEDBACK = int(os.getenv("RETRAIN_MIN_NEW_FEEDBACK", "50"))
+RETRAIN_FEEDBACK_WINDOW = int(os.getenv("RETRAIN_FEEDBACK_WINDOW", "50000"))
+# Rounds a batch of new feedback is retried while its candidate loses to the current model
+RETRAIN_MAX_REJECTIONS = int(os.getenv("RETRAIN_MAX_REJECTIONS", "3"))
+# Workers share GL_MODEL_DIR: the one holding its retraining lock retrains, the others reload CURRENT
+model_registry = ModelRegistry(GL_MODEL_DIR)
+LOCAL_MODEL_NAME = "gl_classifier"
+
 # ============================================
 # DATA MODELS
 # ============================================
@@ -100,7 +194,23 @@ class ClassificationResponse(BaseModel):
     processing_time_ms: float
 
 
+class BatchClassificationRequest(BaseModel):
+    invoices: List[ClassificationRequest] = Field(..., min_length=1)
+
+
+class BatchClassificationResponse(BaseModel):
+    timestamp: str
+    results: List[ClassificationResponse]
+    llm_prompts: int
+    processing_time_ms: float
+
+
+class CacheInvalidationRequest(BaseModel):
+    tenant_id: str = Field(..., description="Tenant whose chart of accounts changed")
+
+
 class FeedbackRequest(BaseModel):
+    tenant_id: Optional[str] = Field(None, description="Tenant UUID (needed to evict the line's cached suggestion)")
     invoice_id: str
     line_number: int
     suggested_account: str
@@ -108,6 +218,12 @@ class FeedbackRequest(BaseModel):
     is_correct: bool
     user_id: str
     notes: Optional[str] = None
+    # The classified line; feedback without a description is stored but cannot train the local model
+    description: Optional[str] = None
+    vendor_name: Optional[str] = None
+    customer_name: Optional[str] = None
+    transaction_type: str = "AP"
+    confidence_score: Optional[float] = Field(None, ge=0.0, le=1.0)
 
 
 # ============================================
@@ -133,6 +249,175 @@ DEMO_CHART_OF_ACCOUNTS = {
     "2100": {"name": "Accounts Payable", "keywords": ["payable", "vendor"]},
 }
 
+# ============================================
+# CLASSIFICATION CACHE
+# ============================================
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercase letters-only form used in cache keys ("Office Rent - Test #17" → "office rent test")"""
+    return " ".join(re.sub(r"[^a-z]+", " ", (text or "").lower()).split())
+
+
+def chart_fingerprint() -> str:
+    """Short hash of the chart of accounts; part of every cache key so a changed chart never serves old codes"""
+    return hashlib.sha1(json.dumps(DEMO_CHART_OF_ACCOUNTS, sort_keys=True).encode()).hexdigest()[:12]
+
+
+# The demo chart is fixed at import and nothing edits it yet, so the fingerprint is computed once.
+# Whatever starts editing charts must recompute it and call /cache/invalidate for the tenant
+CHART_FINGERPRINT = chart_fingerprint()
+
+
+def redis_glob_escape(text: str) -> str:
+    """Escape Redis glob metacharacters so text only matches itself in a SCAN MATCH pattern"""
+    return re.sub(r"([*?\[\]\\])", r"\\\1", text)
+
+
+class ClassificationCache:
+    """
+    Confident LLM suggestions keyed on (tenant, chart, transaction type, vendor, description).
+
+    Vendor and description are normalized so repeat lines that only differ
+    in numbers, case or punctuation share an entry. Lookups try the
+    in-process LRU first (entries expire after CLASSIFICATION_CACHE_TTL_SECONDS),
+    then Redis (REDIS_TTL), whose hits are copied into the LRU. Redis errors
+    count as misses and never fail a classification.
+
+    evict() and invalidate_tenant() drop entries from this worker's LRU and
+    from Redis; other workers' LRU entries expire within the local TTL.
+    The local model is not part of the key (entries survive promotions and
+    are shared by every worker); callers consult the local model before the
+    cache so a newly promoted model still takes precedence.
+    """
+
+    KEY_PREFIX = "airp:classify"
+
+    def __init__(self, redis_client=None, cache_size: int = CLASSIFICATION_CACHE_SIZE):
+        self.redis = redis_client
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[float, AccountSuggestion]]" = OrderedDict()
+
+    def key(
+        self,
+        tenant_id: str,
+        transaction_type: str,
+        vendor_or_customer: Optional[str],
+        description: str,
+    ) -> Optional[str]:
+        """Cache key for a line, or None when the description has nothing to key on"""
+        description_key = normalize_text(description)
+        if not description_key:
+            return None
+        line_key = "|".join((transaction_type.upper(), normalize_text(vendor_or_customer), description_key))
+        line_hash = hashlib.sha1(line_key.encode()).hexdigest()
+        return f"{self.KEY_PREFIX}:{tenant_id}:{CHART_FINGERPRINT}:{line_hash}"
+
+    def _remember(self, key: str, suggestion: AccountSuggestion) -> None:
+        self._cache[key] = (time.monotonic() + CLASSIFICATION_CACHE_TTL_SECONDS, suggestion)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, key: Optional[str]) -> Optional[AccountSuggestion]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: List[Optional[str]]) -> List[Optional[AccountSuggestion]]:
+        """Cached suggestions for several keys; LRU misses are read from Redis with a single MGET"""
+        results: List[Optional[AccountSuggestion]] = [None] * len(keys)
+        redis_positions: Dict[str, List[int]] = {}
+        now = time.monotonic()
+        for position, key in enumerate(keys):
+            if key is None:
+                continue
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                cache_lookups.labels(tier="local", result="hit").inc()
+                results[position] = entry[1].model_copy()
+                continue
+            if entry is not None:
+                del self._cache[key]
+            cache_lookups.labels(tier="local", result="miss").inc()
+            redis_positions.setdefault(key, []).append(position)
+
+        if self.redis is None or not redis_positions:
+            return results
+        redis_keys = list(redis_positions)
+        try:
+            payloads = await self.redis.mget(redis_keys)
+        except Exception as e:
+            logger.warning(f"Classification cache read failed: {str(e)}")
+            payloads = [None] * len(redis_keys)
+        for key, payload in zip(redis_keys, payloads):
+            positions = redis_positions[key]
+            if payload is None:
+                cache_lookups.labels(tier="redis", result="miss").inc(len(positions))
+                continue
+            cache_lookups.labels(tier="redis", result="hit").inc(len(positions))
+            suggestion = AccountSuggestion.model_validate_json(payload)
+            self._remember(key, suggestion)
+            for position in positions:
+                results[position] = suggestion.model_copy()
+        return results
+
+    async def set(self, key: Optional[str], suggestion: AccountSuggestion) -> None:
+        if key is None:
+            return
+        self._remember(key, suggestion.model_copy())
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, suggestion.model_dump_json(), ex=REDIS_TTL)
+        except Exception as e:
+            logger.warning(f"Classification cache write failed: {str(e)}")
+
+    async def evict(self, key: Optional[str]) -> None:
+        """Drop one suggestion from this worker's LRU and from Redis (e.g. after the user corrected it)"""
+        if key is None:
+            return
+        self._cache.pop(key, None)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.unlink(key)
+        except Exception as e:
+            logger.warning(f"Classification cache eviction failed: {str(e)}")
+
+    async def invalidate_tenant(self, tenant_id: str) -> int:
+        """Drop every cached suggestion of a tenant; returns the number of entries removed"""
+        prefix = f"{self.KEY_PREFIX}:{tenant_id}:"
+        local_keys = [key for key in self._cache if key.startswith(prefix)]
+        for key in local_keys:
+            del self._cache[key]
+        removed = len(local_keys)
+
+        if self.redis is not None:
+            try:
+                # Escaped, so a tenant ID like "*" cannot match other tenants' keys
+                pattern = redis_glob_escape(prefix) + "*"
+                redis_keys = [key async for key in self.redis.scan_iter(match=pattern, count=1000)]
+                for start in range(0, len(redis_keys), 1000):
+                    removed += await self.redis.unlink(*redis_keys[start:start + 1000])
+            except Exception as e:
+                logger.error(f"Classification cache invalidation failed for tenant {tenant_id}: {str(e)}")
+                raise
+        return removed
+
+
+classification_cache = ClassificationCache(
+    redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD or None,
+        db=REDIS_DB,
+        socket_timeout=0.25,
+        socket_connect_timeout=0.25,
+    )
+    if REDIS_HOST
+    else None
+)
+
+
 # ============================================
 # CORE CLASSIFICATION LOGIC
 # ============================================
@@ -165,6 +450,84 @@ def rule_based_classification(description: str) -> Optional[AccountSuggestion]:
     return None
 
 
+def local_classification(lines: List[Tuple[str, Optional[str], str]]) -> List[Optional[AccountSuggestion]]:
+    """
+    Local model suggestions for (description, vendor or customer, transaction type) lines
+
+    Only predictions at or above the model's calibrated accept threshold, for
+    accounts in the chart, are returned; the rest are None.
+    """
+    if local_classifier is None or not lines:
+        return [None] * len(lines)
+
+    suggestions: List[Optional[AccountSuggestion]] = []
+    for account_code, confidence in local_classifier.predict(lines):
+        account = DEMO_CHART_OF_ACCOUNTS.get(account_code)
+        if account is None or confidence < local_classifier.accept_threshold:
+            suggestions.append(None)
+            continue
+        suggestions.append(AccountSuggestion(
+            account_code=account_code,
+            account_name=account["name"],
+            confidence_score=min(confidence, 1.0),
+            reasoning=f"Local model v{local_classifier.version} prediction ({confidence:.0%} confidence)",
+        ))
+    return suggestions
+
+
+def report_local_classifier(classifier: Optional[LocalGLClassifier]) -> None:
+    """Export the version and holdout metrics of the local model in use"""
+    local_model_version.set((classifier.version or 0) if classifier else 0)
+    for metric in ("accuracy", "coverage", "accepted_precision"):
+        local_model_holdout.labels(metric=metric).set(classifier.metrics.get(metric, 0.0) if classifier else 0.0)
+
+
+def load_local_classifier() -> None:
+    """Load the current local model version from GL_MODEL_DIR (empty disables the local model)"""
+    global local_classifier
+    if not GL_MODEL_DIR:
+        return
+    try:
+        local_classifier = model_registry.load_current()
+    except Exception as e:
+        logger.error(f"Failed to load local GL classifier from {GL_MODEL_DIR}: {str(e)}")
+        return
+    report_local_classifier(local_classifier)
+    if local_classifier is None:
+        logger.warning(f"No local GL classifier in {GL_MODEL_DIR} - every uncached line goes to the LLM")
+    else:
+        logger.info(
+            f"Loaded local GL classifier v{local_classifier.version} "
+            f"(accept threshold {local_classifier.accept_threshold:.3f})"
+        )
+
+
+def sync_local_classifier() -> None:
+    """Reload the local model when CURRENT names another version (promoted by the retraining worker or the CLI)"""
+    if not GL_MODEL_DIR:
+        return
+    loaded_version = local_classifier.version if local_classifier is not None else None
+    if model_registry.current_version() != loaded_version:
+        load_local_classifier()
+
+
+def chart_of_accounts_context() -> str:
+    return "\n".join([
+        f"- {code}: {info['name']}"
+        for code, info in DEMO_CHART_OF_ACCOUNTS.items()
+    ])
+
+
+def parse_llm_json(response_text: str):
+    """Extract the JSON payload from a model response (handles markdown code blocks)"""
+    response_text = response_text.strip()
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+    return json.loads(response_text)
+
+
 async def llm_classification(
     description: str,
     transaction_type: str,
@@ -177,11 +540,7 @@ async def llm_classification(
         logger.warning("LLM client not available, falling back to rules")
         return None
 
-    # Build chart of accounts context
-    coa_context = "\n".join([
-        f"- {code}: {info['name']}"
-        for code, info in DEMO_CHART_OF_ACCOUNTS.items()
-    ])
+    coa_context = chart_of_accounts_context()
 
     prompt = f"""You are an expert financial accountant specializing in IFRS and UAE accounting standards.
 
@@ -210,23 +569,15 @@ Respond in this exact JSON format:
 }}"""
 
     try:
-        message = ai_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=500,
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}],
-        )
-
-        response_text = message.content[0].text.strip()
-
-        # Extract JSON from response (handle markdown code blocks)
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
+        async with llm_semaphore:
+            message = await ai_client.messages.create(
+                model="claude-3-5-sonnet-20241022",
+                max_tokens=500,
+                temperature=0.1,
+                messages=[{"role": "user", "content": prompt}],
+            )
 
-        import json
-        result = json.loads(response_text)
+        result = parse_llm_json(message.content[0].text)
 
         return AccountSuggestion(
             account_code=result["account_code"],
@@ -244,13 +595,23 @@ async def hybrid_classification(
     description: str,
     transaction_type: str,
     vendor_or_customer: Optional[str],
+    cache_key: Optional[str],
 ) -> AccountSuggestion:
     """
-    Hybrid approach: Try LLM first, fall back to rules
+    Hybrid approach for a line the local model and the cache could not answer: LLM, falling back to rules
     """
     # Try LLM classification
     llm_result = await llm_classification(description, transaction_type, vendor_or_customer)
+    suggestion = resolve_classification(llm_result, description)
+    if suggestion is llm_result:
+        await classification_cache.set(cache_key, suggestion)
+    return suggestion
+
 
+def resolve_classification(llm_result: Optional[AccountSuggestion], description: str) -> AccountSuggestion:
+    """
+    Accept a confident LLM suggestion, otherwise fall back to rules, then to the default account
+    """
     if llm_result and llm_result.confidence_score >= 0.75:
         classification_counter.labels(confidence_level="high", method="llm").inc()
         return llm_result
@@ -272,6 +633,495 @@ async def hybrid_classification(
     )
 
 
+# ============================================
+# BATCHED CLASSIFICATION
+# ============================================
+
+BATCH_PROMPT_HEADER = """You are an expert financial accountant specializing in IFRS and UAE accounting standards.
+
+For each transaction below, determine the most appropriate General Ledger (GL) account code.
+
+Available GL Accounts:
+{coa_context}
+
+Transactions:
+"""
+
+BATCH_PROMPT_FOOTER = """
+Respond with a JSON array containing one object per transaction, in this exact format:
+[
+  {"id": 1, "account_code": "XXXX", "account_name": "Account Name", "confidence_score": 0.95, "reasoning": "Brief explanation"}
+]"""
+
+# (invoice index, line index) of a line inside a batch request
+LineRef = Tuple[int, int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for prompt budgeting (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def format_batch_line(prompt_id: int, invoice: ClassificationRequest, line: InvoiceLine) -> str:
+    counterparty_label = "Vendor" if invoice.transaction_type == "AP" else "Customer"
+    counterparty = invoice.vendor_name or invoice.customer_name or "Unknown"
+    return (
+        f"- ID: {prompt_id}, Type: {invoice.transaction_type}, "
+        f"{counterparty_label}: {counterparty}, Description: {line.description}"
+    )
+
+
+def plan_classification_batches(
+    invoices: List[ClassificationRequest],
+    line_refs: List[LineRef],
+) -> List[List[LineRef]]:
+    """
+    Group invoice lines into prompts.
+
+    Lines keep the given order; a prompt is closed when it reaches
+    LLM_BATCH_MAX_LINES lines or when the next line would push its
+    estimated size past LLM_BATCH_TOKEN_BUDGET. The chart of accounts is
+    sent once per prompt, so an invoice costs one call unless it is larger
+    than the budget.
+    """
+    base_tokens = estimate_tokens(
+        BATCH_PROMPT_HEADER.format(coa_context=chart_of_accounts_context()) + BATCH_PROMPT_FOOTER
+    )
+    batches: List[List[LineRef]] = []
+    current: List[LineRef] = []
+    current_tokens = base_tokens
+
+    for invoice_index, line_index in line_refs:
+        invoice = invoices[invoice_index]
+        line_tokens = estimate_tokens(format_batch_line(len(current) + 1, invoice, invoice.lines[line_index]))
+        if current and (
+            len(current) >= LLM_BATCH_MAX_LINES
+            or current_tokens + line_tokens > LLM_BATCH_TOKEN_BUDGET
+        ):
+            batches.append(current)
+            current, current_tokens = [], base_tokens
+        current.append((invoice_index, line_index))
+        current_tokens += line_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def llm_classification_batch(
+    invoices: List[ClassificationRequest],
+    line_refs: List[LineRef],
+) -> List[Optional[AccountSuggestion]]:
+    """
+    LLM classification of several invoice lines in one prompt
+
+    Returns one suggestion per line reference, None where the model gave no
+    usable answer (the caller falls back to rules for those lines).
+    """
+    if not ai_client or not line_refs:
+        return [None] * len(line_refs)
+
+    lines_context = "\n".join(
+        format_batch_line(prompt_id, invoices[invoice_index], invoices[invoice_index].lines[line_index])
+        for prompt_id, (invoice_index, line_index) in enumerate(line_refs, start=1)
+    )
+    prompt = (
+        BATCH_PROMPT_HEADER.format(coa_context=chart_of_accounts_context())
+        + lines_context + "\n"
+        + BATCH_PROMPT_FOOTER
+    )
+
+    results: Dict[int, AccountSuggestion] = {}
+    try:
+        async with llm_semaphore:
+            message = await ai_client.messages.create(
+                model="claude-3-5-sonnet-20241022",
+                max_tokens=min(120 * len(line_refs) + 100, 4096),
+                temperature=0.1,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        batch_prompt_lines.observe(len(line_refs))
+
+        suggestions = parse_llm_json(message.content[0].text)
+        if isinstance(suggestions, dict):
+            suggestions = suggestions.get("classifications", [])
+
+        for suggestion in suggestions:
+            try:
+                prompt_id = int(suggestion["id"])
+                if not 1 <= prompt_id <= len(line_refs) or prompt_id in results:
+                    continue
+                results[prompt_id] = AccountSuggestion(
+                    account_code=str(suggestion["account_code"]),
+                    account_name=suggestion["account_name"],
+                    confidence_score=min(float(suggestion["confidence_score"]), 1.0),
+                    reasoning=f"LLM Analysis: {suggestion['reasoning']}",
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping malformed batched classification {suggestion!r}: {e}")
+
+    except Exception as e:
+        logger.error(f"Batched LLM classification failed: {str(e)}")
+
+    return [results.get(prompt_id) for prompt_id in range(1, len(line_refs) + 1)]
+
+
+async def classify_invoices(invoices: List[ClassificationRequest]) -> Tuple[List[List[AccountSuggestion]], int]:
+    """
+    Classify the lines of several invoices with batched prompts
+
+    Returns (suggestions per invoice in line order, number of prompts).
+    Confident local model predictions are taken first (so a newly promoted
+    model wins over older cached answers), then cached LLM answers, and only
+    the rest are sent to the LLM; prompts run concurrently (bounded by llm_semaphore). Lines without a
+    confident LLM answer fall back to rules individually.
+    """
+    suggestions: List[List[Optional[AccountSuggestion]]] = [[None] * len(invoice.lines) for invoice in invoices]
+    line_refs = [
+        (invoice_index, line_index)
+        for invoice_index, invoice in enumerate(invoices)
+        for line_index in range(len(invoice.lines))
+    ]
+
+    # Confident local predictions skip the cache and the LLM call
+    local_results = local_classification([
+        (
+            invoices[invoice_index].lines[line_index].description,
+            invoices[invoice_index].vendor_name or invoices[invoice_index].customer_name,
+            invoices[invoice_index].transaction_type,
+        )
+        for invoice_index, line_index in line_refs
+    ])
+    cache_keys: Dict[LineRef, Optional[str]] = {}
+    for (invoice_index, line_index), local_result in zip(line_refs, local_results):
+        if local_result:
+            classification_counter.labels(confidence_level="high", method="ml").inc()
+            suggestions[invoice_index][line_index] = local_result
+            continue
+        invoice = invoices[invoice_index]
+        cache_keys[(invoice_index, line_index)] = classification_cache.key(
+            invoice.tenant_id,
+            invoice.transaction_type,
+            invoice.vendor_name or invoice.customer_name,
+            invoice.lines[line_index].description,
+        )
+
+    llm_lines: List[LineRef] = []
+    for line_ref, cached in zip(cache_keys, await classification_cache.get_many(list(cache_keys.values()))):
+        invoice_index, line_index = line_ref
+        if cached:
+            classification_counter.labels(confidence_level="high", method="cache").inc()
+            suggestions[invoice_index][line_index] = cached
+        else:
+            llm_lines.append(line_ref)
+
+    batches = plan_classification_batches(invoices, llm_lines) if ai_client else []
+
+    batch_results = await asyncio.gather(*(llm_classification_batch(invoices, line_refs) for line_refs in batches))
+    for line_refs, llm_results in zip(batches, batch_results):
+        for line_ref, llm_result in zip(line_refs, llm_results):
+            invoice_index, line_index = line_ref
+            description = invoices[invoice_index].lines[line_index].description
+            suggestion = resolve_classification(llm_result, description)
+            if suggestion is llm_result:
+                await classification_cache.set(cache_keys[line_ref], suggestion)
+            suggestions[invoice_index][line_index] = suggestion
+
+    # Without an AI client the remaining lines take the rule path
+    for invoice, invoice_suggestions in zip(invoices, suggestions):
+        for line_index, line in enumerate(invoice.lines):
+            if invoice_suggestions[line_index] is None:
+                invoice_suggestions[line_index] = resolve_classification(None, line.description)
+
+    return suggestions, len(batches)
+
+
+# ============================================
+# FEEDBACK STORE & RETRAINING
+# ============================================
+
+class FeedbackStore:
+    """
+    Classification feedback in the ai_training_feedback table.
+
+    Backed by Postgres (schemas/sql/ddl.sql) or, when a SQLite path is
+    given, by a local table with the same columns (JSON as text) that
+    stands in for Postgres in tests and single-node setups. Feedback that
+    carries the line's description is what the retraining job learns from;
+    feedback_date orders rows for incremental retraining.
+    """
+
+    SQLITE_DDL = """CREATE TABLE IF NOT EXISTS ai_training_feedback (
+        feedback_id TEXT PRIMARY KEY,
+        tenant_id TEXT,
+        model_name TEXT NOT NULL,
+        model_version TEXT NOT NULL,
+        input_data TEXT NOT NULL,
+        predicted_output TEXT NOT NULL,
+        actual_output TEXT,
+        is_correct INTEGER,
+        confidence_score REAL,
+        user_id TEXT,
+        feedback_date TEXT NOT NULL,
+        metadata TEXT
+    )"""
+
+    def __init__(self, sqlite_path: str = ""):
+        self.sqlite_path = sqlite_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pool: Optional[ThreadedConnectionPool] = None
+        # ThreadedConnectionPool raises when exhausted; callers wait for a free connection instead
+        self._pool_slots = threading.BoundedSemaphore(FEEDBACK_DB_POOL_MAX)
+
+    def _execute(self, sql: str, params: tuple = (), fetch: bool = False) -> list:
+        """Run one statement (psycopg2 %s placeholders) and commit; returns the rows when fetch is set"""
+        if self.sqlite_path:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+                    self._conn.execute(self.SQLITE_DDL)
+                    self._conn.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_ai_feedback_model_date "
+                        "ON ai_training_feedback(model_name, feedback_date)"
+                    )
+                rows = self._conn.execute(sql.replace("%s", "?"), params).fetchall()
+                self._conn.commit()
+                return rows
+
+        with self._pool_slots:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(1, FEEDBACK_DB_POOL_MAX, **DB_CONFIG)
+            conn = self._pool.getconn()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall() if fetch else []
+                conn.commit()
+                return rows
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._pool.putconn(conn, close=bool(conn.closed))
+
+    def add(self, feedback: FeedbackRequest, model_version: str) -> str:
+        """
+        Store one feedback record; returns its feedback_id
+
+        Feedback without a (UUID) tenant is stored with a NULL tenant_id; it
+        still trains the shared local model but belongs to no tenant.
+        """
+        feedback_id = str(uuid.uuid4())
+        try:
+            user_id = str(uuid.UUID(feedback.user_id))
+        except ValueError:
+            user_id = None  # Column is a UUID; non-UUID user ids are kept in metadata
+        try:
+            tenant_id = str(uuid.UUID(feedback.tenant_id)) if feedback.tenant_id else None
+        except ValueError:
+            tenant_id = None  # Kept in metadata like user_id
+        self._execute(
+            """INSERT INTO ai_training_feedback
+                   (feedback_id, tenant_id, model_name, model_version, input_data, predicted_output,
+                    actual_output, is_correct, confidence_score, user_id, feedback_date, metadata)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            (
+                feedback_id,
+                tenant_id,
+                LOCAL_MODEL_NAME,
+                model_version,
+                json.dumps({
+                    "invoice_id": feedback.invoice_id,
+                    "line_number": feedback.line_number,
+                    "description": feedback.description,
+                    "vendor_or_customer": feedback.vendor_name or feedback.customer_name,
+                    "transaction_type": feedback.transaction_type,
+                }),
+                json.dumps({"account_code": feedback.suggested_account}),
+                json.dumps({"account_code": feedback.actual_account}),
+                feedback.is_correct,
+                feedback.confidence_score,
+                user_id,
+                datetime.now(timezone.utc).isoformat(timespec="microseconds"),
+                json.dumps({"tenant_id": feedback.tenant_id, "user_id": feedback.user_id, "notes": feedback.notes}),
+            ),
+        )
+        return feedback_id
+
+    @staticmethod
+    def _examples(rows: list) -> Tuple[List[TrainingExample], Optional[str]]:
+        """Training examples of (input_data, actual_output, feedback_date) rows, and the newest feedback_date"""
+        examples = []
+        newest = None
+        for input_data, actual_output, feedback_date in rows:
+            # Postgres returns JSONB as dicts and timestamps as datetimes, SQLite returns text
+            input_data = json.loads(input_data) if isinstance(input_data, str) else input_data
+            actual_output = json.loads(actual_output) if isinstance(actual_output, str) else actual_output
+            if isinstance(feedback_date, datetime):
+                feedback_date = feedback_date.isoformat(timespec="microseconds")
+            newest = max(newest or feedback_date, feedback_date)
+            account_code = (actual_output or {}).get("account_code")
+            if not input_data.get("description") or not account_code:
+                continue
+            examples.append(TrainingExample(
+                description=input_data["description"],
+                account_code=str(account_code),
+                vendor_or_customer=input_data.get("vendor_or_customer"),
+                transaction_type=input_data.get("transaction_type") or "AP",
+            ))
+        return examples, newest
+
+    def examples_since(self, watermark: Optional[str], limit: int) -> Tuple[List[TrainingExample], Optional[str]]:
+        """
+        Trainable feedback among the oldest `limit` rows newer than the watermark (all rows when None),
+        and the new watermark
+        """
+        sql = "SELECT input_data, actual_output, feedback_date FROM ai_training_feedback WHERE model_name = %s"
+        params: tuple = (LOCAL_MODEL_NAME,)
+        if watermark is not None:
+            sql += " AND feedback_date > %s"
+            params += (watermark,)
+        examples, newest = self._examples(
+            self._execute(sql + " ORDER BY feedback_date LIMIT %s", params + (limit,), fetch=True)
+        )
+        return examples, newest or watermark
+
+    def newest_feedback_date(self) -> Optional[str]:
+        """feedback_date of the newest row, in the format examples_since() takes as a watermark"""
+        [(newest,)] = self._execute(
+            "SELECT MAX(feedback_date) FROM ai_training_feedback WHERE model_name = %s",
+            (LOCAL_MODEL_NAME,),
+            fetch=True,
+        )
+        return newest.isoformat(timespec="microseconds") if isinstance(newest, datetime) else newest
+
+    def recent_examples(self, limit: int) -> List[TrainingExample]:
+        """Trainable feedback among the `limit` most recent rows"""
+        examples, _ = self._examples(self._execute(
+            """SELECT input_data, actual_output, feedback_date FROM ai_training_feedback
+               WHERE model_name = %s ORDER BY feedback_date DESC LIMIT %s""",
+            (LOCAL_MODEL_NAME, limit),
+            fetch=True,
+        ))
+        return examples
+
+
+feedback_store = FeedbackStore(FEEDBACK_SQLITE_PATH)
+retrain_lock = threading.Lock()
+retrain_task: Optional[asyncio.Task] = None
+# Consecutive rounds whose candidate lost to the current model on the same new feedback
+retrain_rejections = 0
+
+
+def retrain_local_classifier() -> str:
+    """
+    One retraining round; returns "promoted", "rejected", "skipped" or
+    "not_leader" (another worker holds the retraining lock of GL_MODEL_DIR).
+
+    The candidate is the current model updated with partial_fit on feedback
+    newer than its feedback_watermark (at most RETRAIN_FEEDBACK_WINDOW rows
+    per round; a full train on recent feedback when there is no current
+    model or the feedback uses new accounts). The holdout split of recent
+    feedback is never trained on. Candidate and current model are both
+    calibrated on its calibration half and scored on its evaluation half;
+    the candidate is saved and promoted only if it beats the current model
+    on evaluation (accuracy, coverage).
+
+    A candidate that ties moves the current model's watermark past its
+    feedback, which adds nothing the holdout can measure. A worse candidate
+    leaves the feedback above the watermark to be retried with more data,
+    for at most RETRAIN_MAX_REJECTIONS rounds. The in-process watermark of an
+    unpromoted model is not saved, so after a restart that feedback is
+    evaluated once more.
+    """
+    global local_classifier, retrain_rejections
+    if not GL_MODEL_DIR:
+        return "skipped"
+    if not model_registry.try_lock():
+        return "not_leader"
+
+    with retrain_lock:
+        sync_local_classifier()
+        current = local_classifier
+        new_examples, watermark = feedback_store.examples_since(
+            current.feedback_watermark if current else None, RETRAIN_FEEDBACK_WINDOW
+        )
+        if len(new_examples) < RETRAIN_MIN_NEW_FEEDBACK:
+            return "skipped"
+        recent = feedback_store.recent_examples(RETRAIN_FEEDBACK_WINDOW)
+        calibration, evaluation = split_calibration(split_holdout(recent)[1])
+        if not calibration or not evaluation:
+            return "skipped"
+
+        try:
+            if current is None:
+                raise ValueError("no current model")
+            candidate = current.partial_fit(split_holdout(new_examples)[0])
+        except ValueError as e:
+            logger.info(f"Full retrain of the local GL classifier on recent feedback: {str(e)}")
+            try:
+                candidate = LocalGLClassifier.train(recent)
+            except ValueError as e:
+                logger.info(f"Not enough feedback to train the local GL classifier: {str(e)}")
+                return "skipped"
+        candidate.calibrate(calibration, evaluation=evaluation)
+        candidate.feedback_watermark = watermark
+
+        if current is not None:
+            baseline = current.partial_fit([])
+            baseline.calibrate(calibration, evaluation=evaluation)
+            candidate_score = (candidate.metrics["accuracy"], candidate.metrics["coverage"])
+            baseline_score = (baseline.metrics["accuracy"], baseline.metrics["coverage"])
+            if candidate_score <= baseline_score:
+                retrain_rejections += 1
+                if candidate_score == baseline_score or retrain_rejections >= RETRAIN_MAX_REJECTIONS:
+                    current.feedback_watermark = watermark
+                    retrain_rejections = 0
+                logger.info(
+                    f"Retrained GL classifier not promoted: holdout accuracy/coverage {candidate_score} "
+                    f"vs current v{current.version} {baseline_score}; feedback watermark {current.feedback_watermark}"
+                )
+                return "rejected"
+
+        version = model_registry.save(candidate)
+        model_registry.promote(version)
+        local_classifier = candidate
+        retrain_rejections = 0
+        model_promotions.inc()
+        report_local_classifier(candidate)
+        logger.info(
+            f"Promoted local GL classifier v{version}: holdout accuracy {candidate.metrics['accuracy']:.1%}, "
+            f"coverage {candidate.metrics['coverage']:.1%} on {len(evaluation)} evaluation lines"
+        )
+        return "promoted"
+
+
+async def run_retraining() -> str:
+    try:
+        outcome = await asyncio.to_thread(retrain_local_classifier)
+    except Exception as e:
+        logger.error(f"Local GL classifier retraining failed: {str(e)}", exc_info=True)
+        outcome = "failed"
+    retrain_runs.labels(outcome=outcome).inc()
+    return outcome
+
+
+async def retrain_loop() -> None:
+    """
+    Every RETRAIN_INTERVAL_SECONDS, the worker holding the retraining lock
+    retrains; the others pick up the version it promoted
+    """
+    while True:
+        await asyncio.sleep(RETRAIN_INTERVAL_SECONDS)
+        if await asyncio.to_thread(model_registry.try_lock):
+            await run_retraining()
+        else:
+            await asyncio.to_thread(sync_local_classifier)
+
+
 # ============================================
 # API ENDPOINTS
 # ============================================
@@ -284,6 +1134,7 @@ async def health_check():
         "service": "ai-auto-accounting",
         "ai_provider": AI_PROVIDER,
         "ai_available": ai_client is not None,
+        "local_model_version": local_classifier.version if local_classifier else None,
         "timestamp": datetime.utcnow().isoformat(),
     }
 
@@ -302,17 +1153,45 @@ async def classify_transaction(request: ClassificationRequest):
     start_time = datetime.utcnow()
 
     try:
-        suggestions = []
-
         vendor_or_customer = request.vendor_name or request.customer_name
 
-        for line in request.lines:
-            suggestion = await hybrid_classification(
-                line.description,
-                request.transaction_type,
-                vendor_or_customer,
+        # Confident local predictions come first, so a newly promoted model wins over cached LLM answers
+        local_results = local_classification([
+            (line.description, vendor_or_customer, request.transaction_type) for line in request.lines
+        ])
+        for local_result in local_results:
+            if local_result:
+                classification_counter.labels(confidence_level="high", method="ml").inc()
+
+        # One cache round trip for the other lines
+        cache_keys = [
+            None if local_result else classification_cache.key(
+                request.tenant_id, request.transaction_type, vendor_or_customer, line.description
             )
-            suggestions.append(suggestion)
+            for line, local_result in zip(request.lines, local_results)
+        ]
+        cached_suggestions = await classification_cache.get_many(cache_keys)
+        for cached in cached_suggestions:
+            if cached:
+                classification_counter.labels(confidence_level="high", method="cache").inc()
+
+        # Remaining lines are classified concurrently; llm_semaphore bounds the LLM calls in flight
+        async def classify_line(
+            line: InvoiceLine,
+            local_result: Optional[AccountSuggestion],
+            cache_key: Optional[str],
+            cached: Optional[AccountSuggestion],
+        ):
+            if local_result:
+                return local_result
+            if cached:
+                return cached
+            return await hybrid_classification(line.description, request.transaction_type, vendor_or_customer, cache_key)
+
+        suggestions = await asyncio.gather(*(
+            classify_line(line, local_result, cache_key, cached)
+            for line, local_result, cache_key, cached in zip(request.lines, local_results, cache_keys, cached_suggestions)
+        ))
 
         processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
 
@@ -332,16 +1211,64 @@ async def classify_transaction(request: ClassificationRequest):
         )
 
 
+@app.post("/classify-batch", response_model=BatchClassificationResponse)
+async def classify_batch(request: BatchClassificationRequest):
+    """
+    Classify the lines of many invoices with as few LLM calls as possible
+    """
+    start_time = datetime.utcnow()
+
+    try:
+        suggestions, llm_prompts = await classify_invoices(request.invoices)
+
+        timestamp = datetime.utcnow().isoformat()
+        processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
+
+        return BatchClassificationResponse(
+            timestamp=timestamp,
+            results=[
+                ClassificationResponse(
+                    invoice_id=invoice.invoice_id,
+                    timestamp=timestamp,
+                    method="hybrid",
+                    suggestions=invoice_suggestions,
+                    processing_time_ms=processing_time,
+                )
+                for invoice, invoice_suggestions in zip(request.invoices, suggestions)
+            ],
+            llm_prompts=llm_prompts,
+            processing_time_ms=processing_time,
+        )
+
+    except Exception as e:
+        logger.error(f"Batch classification failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Batch classification failed: {str(e)}",
+        )
+
+
 @app.post("/feedback")
 async def submit_feedback(feedback: FeedbackRequest):
     """
     Submit user feedback for model training
     """
     try:
+        model_version = str(local_classifier.version) if local_classifier and local_classifier.version else "none"
+        feedback_id = await asyncio.to_thread(feedback_store.add, feedback, model_version)
+
+        # Stop serving the suggestion the user just corrected
+        if feedback.tenant_id and feedback.description and not feedback.is_correct:
+            await classification_cache.evict(classification_cache.key(
+                feedback.tenant_id,
+                feedback.transaction_type,
+                feedback.vendor_name or feedback.customer_name,
+                feedback.description,
+            ))
+
         feedback_type = "correct" if feedback.is_correct else "incorrect"
         feedback_counter.labels(feedback_type=feedback_type).inc()
 
-        # In production, this would store in database for retraining
         logger.info(
             f"Feedback received for invoice {feedback.invoice_id}: "
             f"Suggested={feedback.suggested_account}, Actual={feedback.actual_account}, "
@@ -352,6 +1279,7 @@ async def submit_feedback(feedback: FeedbackRequest):
             "status": "success",
             "message": "Feedback recorded for model improvement",
             "invoice_id": feedback.invoice_id,
+            "feedback_id": feedback_id,
         }
 
     except Exception as e:
@@ -362,6 +1290,52 @@ async def submit_feedback(feedback: FeedbackRequest):
         )
 
 
+@app.post("/cache/invalidate")
+async def invalidate_classification_cache(request: CacheInvalidationRequest):
+    """
+    Drop a tenant's cached suggestions (call when its chart of accounts changes)
+    """
+    try:
+        removed = await classification_cache.invalidate_tenant(request.tenant_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Cache invalidation failed: {str(e)}",
+        )
+
+    logger.info(f"Classification cache invalidated for tenant {request.tenant_id}: {removed} entries")
+    return {
+        "status": "success",
+        "tenant_id": request.tenant_id,
+        "entries_removed": removed,
+    }
+
+
+@app.post("/model/retrain")
+async def retrain_model():
+    """
+    Run a feedback retraining round now (the background job runs every RETRAIN_INTERVAL_SECONDS)
+
+    Only the worker holding the retraining lock retrains; the others answer 409.
+    """
+    outcome = await run_retraining()
+    if outcome == "failed":
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Retraining failed",
+        )
+    if outcome == "not_leader":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another worker runs retraining; retry or wait for its next round",
+        )
+    return {
+        "outcome": outcome,
+        "model_version": local_classifier.version if local_classifier else None,
+        "holdout_metrics": local_classifier.metrics if local_classifier else {},
+    }
+
+
 @app.get("/accounts")
 async def get_chart_of_accounts():
     """
@@ -381,12 +1355,20 @@ async def get_chart_of_accounts():
 
 @app.on_event("startup")
 async def startup_event():
+    global retrain_task
     logger.info("=" * 60)
     logger.info("AIRP v2.0 - AI Auto-Accounting Service")
     logger.info("AI-Native Financial ERP")
     logger.info("=" * 60)
     logger.info(f"AI Provider: {AI_PROVIDER}")
     logger.info(f"AI Client Available: {ai_client is not None}")
+    logger.info(f"LLM Max Concurrency: {LLM_MAX_CONCURRENCY}")
+    logger.info(f"Classification Cache: LRU {CLASSIFICATION_CACHE_SIZE}, Redis {REDIS_HOST or 'disabled'}")
+    load_local_classifier()
+    logger.info(f"Feedback Store: {'SQLite ' + FEEDBACK_SQLITE_PATH if FEEDBACK_SQLITE_PATH else 'Postgres'}")
+    if RETRAIN_INTERVAL_SECONDS > 0 and GL_MODEL_DIR:
+        retrain_task = asyncio.create_task(retrain_loop())
+        logger.info(f"Feedback retraining every {RETRAIN_INTERVAL_SECONDS}s")
     logger.info(f"Port: {os.getenv('PORT', 8001)}")
     logger.info("=" * 60)
 
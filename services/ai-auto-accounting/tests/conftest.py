@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Import the service as the container does (uvicorn app.main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp_dir = tempfile.mkdtemp(prefix="ai-auto-accounting-tests-")
+# Feedback goes to a throwaway SQLite file instead of Postgres
+os.environ.setdefault("FEEDBACK_SQLITE_PATH", os.path.join(_tmp_dir, "feedback.sqlite3"))
+# Local models are saved to and loaded from a throwaway directory
+os.environ.setdefault("GL_MODEL_DIR", os.path.join(_tmp_dir, "models"))
+# Unit tests never call the model; LLM tests install a fake client
+os.environ["ANTHROPIC_API_KEY"] = ""
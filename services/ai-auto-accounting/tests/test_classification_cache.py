@@ -0,0 +1,230 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.main import AccountSuggestion, ClassificationCache, ClassificationRequest, classify_invoices, redis_glob_escape
+
+
+def redis_glob_match(pattern: str, key: str) -> bool:
+    """Redis MATCH semantics for the patterns the cache builds: * and ? wildcards, backslash escapes"""
+    regex, chars = "", iter(pattern)
+    for char in chars:
+        if char == "\\":
+            regex += re.escape(next(chars))
+        elif char == "*":
+            regex += ".*"
+        elif char == "?":
+            regex += "."
+        else:
+            regex += re.escape(char)
+    return re.fullmatch(regex, key, re.DOTALL) is not None
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis.asyncio calls the cache makes"""
+
+    def __init__(self, fail: bool = False):
+        self.data = {}
+        self.fail = fail
+        self.mget_calls = []
+
+    async def mget(self, keys):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.mget_calls.append(list(keys))
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.data[key] = value
+
+    async def unlink(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def scan_iter(self, match=None, count=None):
+        for key in list(self.data):
+            if redis_glob_match(match, key):
+                yield key
+
+
+def suggestion(code: str = "5300") -> AccountSuggestion:
+    return AccountSuggestion(account_code=code, account_name="Rent Expense", confidence_score=0.92, reasoning="Rent")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_key_normalizes_numbers_case_and_punctuation():
+    cache = ClassificationCache()
+
+    assert cache.key("t1", "ap", "Dubai Properties LLC", "Office rent #17 - Jan") == cache.key(
+        "t1", "AP", "DUBAI PROPERTIES LLC.", "office RENT #18 - jan"
+    )
+    assert cache.key("t1", "AP", "Dubai Properties", "Office rent") != cache.key("t2", "AP", "Dubai Properties", "Office rent")
+    assert cache.key("t1", "AP", None, "#1234") is None
+
+
+def test_key_survives_local_model_promotions(monkeypatch):
+    cache = ClassificationCache()
+    monkeypatch.setattr(main, "local_classifier", None)
+    before = cache.key("t1", "AP", "Dubai Properties", "Office rent")
+
+    monkeypatch.setattr(main, "local_classifier", SimpleNamespace(version=7))
+
+    assert cache.key("t1", "AP", "Dubai Properties", "Office rent") == before
+    assert main.CHART_FINGERPRINT in before
+
+
+def test_confident_local_prediction_wins_over_a_cached_answer(monkeypatch):
+    cache = ClassificationCache()
+    monkeypatch.setattr(main, "classification_cache", cache)
+    monkeypatch.setattr(main, "ai_client", None)
+    request = ClassificationRequest(
+        tenant_id="t1",
+        invoice_id="I1",
+        vendor_name="Vendor",
+        transaction_type="AP",
+        lines=[{"line_number": 1, "description": "Office rent", "amount": 100.0}],
+    )
+    run(cache.set(cache.key("t1", "AP", "Vendor", "Office rent"), suggestion("6100")))
+    local = AccountSuggestion(account_code="5300", account_name="Rent Expense", confidence_score=0.97, reasoning="local")
+    monkeypatch.setattr(main, "local_classification", lambda lines: [local] * len(lines))
+
+    assert run(main.classify_transaction(request)).suggestions == [local]
+    assert run(classify_invoices([request]))[0] == [[local]]
+
+    monkeypatch.setattr(main, "local_classification", lambda lines: [None] * len(lines))
+
+    assert run(main.classify_transaction(request)).suggestions[0].account_code == "6100"
+
+
+def test_local_hit_without_redis():
+    cache = ClassificationCache()
+    key = cache.key("t1", "AP", "Dubai Properties", "Office rent")
+    run(cache.set(key, suggestion()))
+
+    assert run(cache.get(key)) == suggestion()
+    assert run(cache.get(cache.key("t1", "AP", "Dubai Properties", "Parking"))) is None
+
+
+def test_get_many_reads_all_misses_with_one_mget():
+    redis = FakeRedis()
+    writer = ClassificationCache(redis)
+    keys = [writer.key("t1", "AP", "Vendor", f"Line {name}") for name in ("a", "b", "c")]
+    run(writer.set(keys[0], suggestion("5300")))
+    run(writer.set(keys[2], suggestion("6100")))
+
+    reader = ClassificationCache(redis)
+    results = run(reader.get_many([keys[0], keys[1], keys[2], keys[0], None]))
+
+    assert [result.account_code if result else None for result in results] == ["5300", None, "6100", "5300", None]
+    assert redis.mget_calls == [[keys[0], keys[1], keys[2]]]
+
+    # Redis hits were copied into the local LRU
+    run(reader.get_many([keys[0], keys[2]]))
+    assert len(redis.mget_calls) == 1
+
+
+def test_expired_local_entries_fall_back_to_redis(monkeypatch):
+    redis = FakeRedis()
+    cache = ClassificationCache(redis)
+    key = cache.key("t1", "AP", "Vendor", "Line")
+    monkeypatch.setattr(main, "CLASSIFICATION_CACHE_TTL_SECONDS", -1)
+    run(cache.set(key, suggestion()))
+
+    assert run(cache.get(key)) == suggestion()
+    assert redis.mget_calls == [[key]]
+
+
+def test_redis_errors_count_as_misses():
+    cache = ClassificationCache(FakeRedis(fail=True))
+    key = cache.key("t1", "AP", "Vendor", "Line")
+
+    run(cache.set(key, suggestion()))  # the write failure is logged, the LRU still has it
+    assert run(cache.get(key)) == suggestion()
+    assert run(cache.get(cache.key("t1", "AP", "Vendor", "Other line"))) is None
+
+
+def test_cached_suggestions_are_copies():
+    cache = ClassificationCache()
+    key = cache.key("t1", "AP", "Vendor", "Line")
+    run(cache.set(key, suggestion()))
+
+    run(cache.get(key)).account_code = "9999"
+
+    assert run(cache.get(key)).account_code == "5300"
+
+
+def test_lru_is_bounded():
+    cache = ClassificationCache(cache_size=2)
+    keys = [cache.key("t1", "AP", "Vendor", f"Line {name}") for name in ("a", "b", "c")]
+    for key in keys:
+        run(cache.set(key, suggestion()))
+
+    assert run(cache.get(keys[0])) is None
+    assert run(cache.get(keys[2])) is not None
+
+
+def test_evict_drops_local_and_redis_entry():
+    redis = FakeRedis()
+    cache = ClassificationCache(redis)
+    key = cache.key("t1", "AP", "Vendor", "Line")
+    run(cache.set(key, suggestion()))
+
+    run(cache.evict(key))
+
+    assert key not in redis.data
+    assert run(cache.get(key)) is None
+
+
+def test_invalidate_tenant_only_drops_that_tenant():
+    redis = FakeRedis()
+    cache = ClassificationCache(redis)
+    t1_key = cache.key("t1", "AP", "Vendor", "Line")
+    t2_key = cache.key("t2", "AP", "Vendor", "Line")
+    run(cache.set(t1_key, suggestion()))
+    run(cache.set(t2_key, suggestion()))
+
+    removed = run(cache.invalidate_tenant("t1"))
+
+    assert removed == 2  # the LRU entry and the Redis entry
+    assert run(cache.get(t1_key)) is None
+    assert run(cache.get(t2_key)) is not None
+
+
+def test_redis_glob_escape():
+    assert redis_glob_escape("ai-acct:t1:") == "ai-acct:t1:"
+    assert redis_glob_escape("a*b?c[d]e\\f") == "a\\*b\\?c\\[d\\]e\\\\f"
+    assert redis_glob_match(redis_glob_escape("a*b?[c]\\") + "*", "a*b?[c]\\tail")
+    assert not redis_glob_match(redis_glob_escape("a*") + "*", "abc")
+
+
+def test_invalidate_tenant_with_glob_characters_leaves_other_tenants():
+    redis = FakeRedis()
+    cache = ClassificationCache(redis)
+    keys = [cache.key(tenant_id, "AP", "Vendor", "Line") for tenant_id in ("t1", "t2", "*")]
+    for key in keys:
+        run(cache.set(key, suggestion()))
+    other_keys = keys[:2]
+
+    assert run(cache.invalidate_tenant("?1")) == 0
+    assert run(cache.invalidate_tenant("*")) == 2
+
+    assert all(key in redis.data for key in other_keys)
+    assert keys[2] not in redis.data
+    assert all(run(cache.get(key)) is not None for key in other_keys)
+
+
+def test_invalidate_tenant_raises_when_redis_fails():
+    class BrokenScan(FakeRedis):
+        async def scan_iter(self, match=None, count=None):
+            raise ConnectionError("redis down")
+            yield
+
+    with pytest.raises(ConnectionError):
+        run(ClassificationCache(BrokenScan()).invalidate_tenant("t1"))
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.main import (
+    AccountSuggestion,
+    ClassificationCache,
+    ClassificationRequest,
+    classify_invoices,
+    llm_classification_batch,
+    plan_classification_batches,
+)
+
+# Description keyword → account the fake model answers with
+ANSWERS = {
+    "rent": ("5300", "Rent Expense"),
+    "laptop": ("5900", "IT & Software"),
+    "flight": ("5800", "Travel & Entertainment"),
+}
+
+
+class FakeBatchClient:
+    """Stand-in for anthropic.AsyncAnthropic answering batched prompts from ANSWERS; records the prompts"""
+
+    def __init__(self, confidence: float = 0.9):
+        self.confidence = confidence
+        self.prompts = []
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def create(self, model, max_tokens, temperature, messages):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        answers = []
+        for prompt_id, description in re.findall(r"^- ID: (\d+), .*Description: (.*)$", prompt, re.MULTILINE):
+            for keyword, (code, name) in ANSWERS.items():
+                if keyword in description.lower():
+                    answers.append({"id": int(prompt_id), "account_code": code, "account_name": name,
+                                    "confidence_score": self.confidence, "reasoning": f"{keyword} line"})
+        return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(answers))])
+
+
+def invoice(invoice_id, *descriptions, vendor="Acme LLC", tenant_id="t1"):
+    return ClassificationRequest(
+        tenant_id=tenant_id,
+        invoice_id=invoice_id,
+        vendor_name=vendor,
+        transaction_type="AP",
+        lines=[{"line_number": n, "description": d, "amount": 100.0} for n, d in enumerate(descriptions, start=1)],
+    )
+
+
+def all_lines(invoices):
+    return [(i, j) for i, inv in enumerate(invoices) for j in range(len(inv.lines))]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Fresh cache, no local model, and a fake LLM client (None for the rule path)"""
+    monkeypatch.setattr(main, "classification_cache", ClassificationCache())
+    monkeypatch.setattr(main, "local_classifier", None)
+    monkeypatch.setattr(main, "llm_semaphore", asyncio.Semaphore(main.LLM_MAX_CONCURRENCY))
+
+    def install(client):
+        monkeypatch.setattr(main, "ai_client", client)
+        return client
+
+    return install
+
+
+def test_batches_keep_line_order_and_close_at_the_line_limit(monkeypatch):
+    monkeypatch.setattr(main, "LLM_BATCH_MAX_LINES", 3)
+    invoices = [invoice("I1", "Office rent", "Laptop"), invoice("I2", "Flight", "Rent", "Laptop bag")]
+
+    assert plan_classification_batches(invoices, all_lines(invoices)) == [
+        [(0, 0), (0, 1), (1, 0)],
+        [(1, 1), (1, 2)],
+    ]
+
+
+def test_batches_close_at_the_token_budget(monkeypatch):
+    base = main.estimate_tokens(
+        main.BATCH_PROMPT_HEADER.format(coa_context=main.chart_of_accounts_context()) + main.BATCH_PROMPT_FOOTER
+    )
+    invoices = [invoice("I1", "Office rent " + "x" * 100, "Laptop", "Flight " + "y" * 400)]
+    first_line = main.estimate_tokens(main.format_batch_line(1, invoices[0], invoices[0].lines[0]))
+    monkeypatch.setattr(main, "LLM_BATCH_TOKEN_BUDGET", base + first_line)
+
+    # The oversized last line still gets a prompt of its own
+    assert plan_classification_batches(invoices, all_lines(invoices)) == [[(0, 0)], [(0, 1)], [(0, 2)]]
+
+
+def test_batch_answers_skip_unknown_duplicate_and_malformed_ids(llm):
+    async def create(**kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(text=json.dumps({"classifications": [
+            {"id": 1, "account_code": 5300, "account_name": "Rent Expense", "confidence_score": 1.4, "reasoning": "r"},
+            {"id": 1, "account_code": "5900", "account_name": "IT", "confidence_score": 0.9, "reasoning": "dup"},
+            {"id": 7, "account_code": "5900", "account_name": "IT", "confidence_score": 0.9, "reasoning": "?"},
+            {"id": 2, "account_code": "5900"},
+        ]}))])
+
+    llm(SimpleNamespace(messages=SimpleNamespace(create=create)))
+    invoices = [invoice("I1", "Office rent", "Laptop")]
+
+    results = asyncio.run(llm_classification_batch(invoices, all_lines(invoices)))
+
+    assert results[0].account_code == "5300" and results[0].confidence_score == 1.0
+    assert results[1] is None
+
+
+def test_one_prompt_covers_lines_of_several_invoices(llm):
+    client = llm(FakeBatchClient())
+    invoices = [invoice("I1", "Office rent March", "Laptop"), invoice("I2", "Flight to Riyadh")]
+
+    suggestions, prompts = asyncio.run(classify_invoices(invoices))
+
+    assert prompts == 1 and len(client.prompts) == 1
+    assert [[s.account_code for s in invoice_suggestions] for invoice_suggestions in suggestions] == [
+        ["5300", "5900"], ["5800"]
+    ]
+
+
+def test_unconfident_or_missing_answers_fall_back_to_rules(llm):
+    llm(FakeBatchClient(confidence=0.5))
+    invoices = [invoice("I1", "Office rent March", "Quarterly insurance premium")]
+
+    [[rent, insurance]], _ = asyncio.run(classify_invoices(invoices))
+
+    assert rent.account_code == "5300" and rent.reasoning.startswith("Keyword-based")
+    assert insurance.account_code == "6100" and insurance.reasoning.startswith("Keyword-based")
+
+
+def test_without_a_client_every_line_takes_the_rule_path(llm):
+    llm(None)
+
+    [[rent, unknown]], prompts = asyncio.run(classify_invoices([invoice("I1", "Office rent", "Sundry")]))
+
+    assert prompts == 0
+    assert rent.account_code == "5300"
+    assert unknown.account_code == "5500" and unknown.confidence_score == 0.30
+
+
+def test_cached_lines_are_not_sent_again(llm):
+    client = llm(FakeBatchClient())
+    asyncio.run(classify_invoices([invoice("I1", "Office rent #1")]))
+
+    [[first, second]], prompts = asyncio.run(classify_invoices([invoice("I2", "Office rent #2", "Laptop")]))
+
+    assert prompts == 1 and len(client.prompts) == 2
+    assert "Office rent" not in client.prompts[1]
+    assert (first.account_code, second.account_code) == ("5300", "5900")
+
+
+def test_confident_local_predictions_skip_the_llm(llm, monkeypatch):
+    client = llm(FakeBatchClient())
+    monkeypatch.setattr(main, "local_classification", lambda lines: [
+        AccountSuggestion(account_code="5300", account_name="Rent Expense", confidence_score=0.97, reasoning="local")
+        if "rent" in description.lower() else None
+        for description, _, _ in lines
+    ])
+
+    [[rent, laptop]], _ = asyncio.run(classify_invoices([invoice("I1", "Office rent", "Laptop")]))
+
+    assert rent.reasoning == "local"
+    assert laptop.account_code == "5900"
+    assert "Office rent" not in client.prompts[0]
+
+
+def test_classify_batch_endpoint(llm):
+    llm(FakeBatchClient())
+    body = {"invoices": [invoice("I1", "Office rent").model_dump(), invoice("I2", "Laptop").model_dump()]}
+
+    response = TestClient(main.app).post("/classify-batch", json=body).json()
+
+    assert response["llm_prompts"] == 1
+    assert [result["invoice_id"] for result in response["results"]] == ["I1", "I2"]
+    assert [result["suggestions"][0]["account_code"] for result in response["results"]] == ["5300", "5900"]
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.main import ClassificationCache, ClassificationRequest, classify_transaction, llm_classification
+
+ANSWERS = {"rent": ("5300", "Rent Expense"), "laptop": ("5900", "IT & Software"), "hotel": ("5800", "Travel")}
+
+
+class SlowClient:
+    """Fake async LLM client: answers single-line prompts after `latency` seconds and tracks calls in flight"""
+
+    def __init__(self, latency: float = 0.05, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def create(self, model, max_tokens, temperature, messages):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.fail:
+                raise RuntimeError("overloaded")
+            description = messages[0]["content"].split("- Description: ", 1)[1].split("\n", 1)[0].lower()
+            code, name = next(answer for keyword, answer in ANSWERS.items() if keyword in description)
+            answer = {"account_code": code, "account_name": name, "confidence_score": 0.9, "reasoning": "test"}
+            return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(answer))])
+        finally:
+            self.in_flight -= 1
+
+
+def invoice(invoice_id, *descriptions):
+    return ClassificationRequest(
+        tenant_id="t1",
+        invoice_id=invoice_id,
+        vendor_name="Acme LLC",
+        transaction_type="AP",
+        lines=[{"line_number": n, "description": d, "amount": 100.0} for n, d in enumerate(descriptions, start=1)],
+    )
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    """Install a fake LLM client with a fresh cache, no local model and an llm_semaphore of the given size"""
+
+    def install(client, concurrency: int = main.LLM_MAX_CONCURRENCY):
+        monkeypatch.setattr(main, "ai_client", client)
+        monkeypatch.setattr(main, "llm_semaphore", asyncio.Semaphore(concurrency))
+        monkeypatch.setattr(main, "classification_cache", ClassificationCache())
+        monkeypatch.setattr(main, "local_classifier", None)
+        return client
+
+    return install
+
+
+def test_lines_of_one_request_are_classified_concurrently_within_the_limit(use_client):
+    client = use_client(SlowClient(latency=0.05), concurrency=3)
+    descriptions = [f"{keyword} {i}" for i in range(3) for keyword in ("Rent", "Laptop", "Hotel")]
+
+    started = time.perf_counter()
+    response = asyncio.run(classify_transaction(invoice("I1", *descriptions)))
+    elapsed = time.perf_counter() - started
+
+    assert client.max_in_flight == 3
+    assert elapsed < 9 * 0.05
+    assert [s.account_code for s in response.suggestions] == ["5300", "5900", "5800"] * 3
+
+
+def test_requests_share_the_worker_limit(use_client):
+    client = use_client(SlowClient(latency=0.05), concurrency=4)
+
+    async def run():
+        return await asyncio.gather(*(classify_transaction(invoice(f"I{i}", "Rent", "Laptop")) for i in range(4)))
+
+    responses = asyncio.run(run())
+
+    assert client.max_in_flight == 4
+    assert all([s.account_code for s in response.suggestions] == ["5300", "5900"] for response in responses)
+
+
+def test_llm_calls_do_not_block_the_event_loop(use_client):
+    use_client(SlowClient(latency=0.2))
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    async def run():
+        task = asyncio.create_task(ticker())
+        try:
+            await classify_transaction(invoice("I1", "Rent"))
+        finally:
+            task.cancel()
+
+    asyncio.run(run())
+
+    assert ticks >= 10
+
+
+def test_failed_llm_call_falls_back_to_rules(use_client):
+    use_client(SlowClient(latency=0, fail=True))
+
+    assert asyncio.run(llm_classification("Office rent", "AP", "Acme LLC")) is None
+    [suggestion] = asyncio.run(classify_transaction(invoice("I1", "Office rent"))).suggestions
+    assert suggestion.account_code == "5300" and suggestion.reasoning.startswith("Keyword-based")
@@ -0,0 +1,210 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from app import gl_classifier, main
+from app.gl_classifier import (
+    NEVER_ACCEPT,
+    LocalGLClassifier,
+    ModelRegistry,
+    TrainingExample,
+    feature_text,
+    split_holdout,
+)
+from app.main import FeedbackRequest, FeedbackStore
+
+# (account code, vendor, description words) of the synthetic chart
+ACCOUNTS = [
+    ("5300", "Dubai Properties", ["office rent", "monthly lease", "warehouse rent", "head office lease"]),
+    ("5400", "DEWA", ["electricity bill", "water and power", "utility charges", "electricity and water"]),
+    ("5600", "Google", ["workspace subscription", "cloud storage plan", "software licence", "saas subscription"]),
+]
+
+
+def make_examples(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    examples = []
+    for i in range(count):
+        code, vendor, phrases = ACCOUNTS[i % len(ACCOUNTS)]
+        examples.append(TrainingExample(
+            description=f"{rng.choice(phrases)} {rng.choice(['jan', 'feb', 'mar', 'q1', 'q2'])} {i}",
+            account_code=code,
+            vendor_or_customer=vendor,
+        ))
+    return examples
+
+
+@pytest.fixture(scope="module")
+def examples():
+    return make_examples(300)
+
+
+@pytest.fixture(scope="module")
+def classifier(examples):
+    return LocalGLClassifier.train(examples)
+
+
+def as_lines(examples):
+    return [(example.description, example.vendor_or_customer, example.transaction_type) for example in examples]
+
+
+def test_split_holdout_is_stable(examples):
+    train, holdout = split_holdout(examples)
+
+    assert (train, holdout) == split_holdout(list(examples))
+    assert len(train) + len(holdout) == len(examples)
+    assert 0.1 < len(holdout) / len(examples) < 0.3
+
+
+def test_train_needs_enough_examples_of_two_codes(examples):
+    with pytest.raises(ValueError):
+        LocalGLClassifier.train(examples[:10])
+    with pytest.raises(ValueError):
+        LocalGLClassifier.train([example for example in examples if example.account_code == "5300"])
+
+
+def test_predicts_trained_accounts(classifier):
+    predictions = classifier.predict([
+        ("Office rent April", "Dubai Properties", "AP"),
+        ("Electricity bill April", "DEWA", "AP"),
+        ("Workspace subscription April", "Google", "AP"),
+    ])
+
+    assert [code for code, _ in predictions] == ["5300", "5400", "5600"]
+    assert all(0.0 < confidence <= 1.0 for _, confidence in predictions)
+    assert classifier.predict([]) == []
+
+
+def test_predict_proba_matches_sklearn(classifier, examples):
+    features = classifier.vectorizer.transform(feature_text(*line) for line in as_lines(examples[:20]))
+
+    np.testing.assert_allclose(classifier.predict_proba(features), classifier.model.predict_proba(features))
+
+
+def test_calibrate_picks_lowest_threshold_reaching_target_precision(classifier, examples):
+    # Noisy labels force the accepted set to shrink before it is precise enough
+    holdout = [
+        example._replace(account_code="5400") if i % 4 == 0 and example.account_code == "5300" else example
+        for i, example in enumerate(make_examples(120, seed=1))
+    ]
+    calibrated = classifier.partial_fit([])
+    calibrated.calibrate(holdout, target_precision=0.9)
+
+    predictions = calibrated.predict(as_lines(holdout))
+    correct = np.array([code == example.account_code for (code, _), example in zip(predictions, holdout)])
+    confidences = np.array([confidence for _, confidence in predictions])
+    accepted = confidences >= calibrated.accept_threshold
+
+    assert calibrated.accept_threshold < NEVER_ACCEPT
+    assert correct[accepted].mean() >= 0.9
+    # Accepting the next less confident prediction would fall below the target
+    below = confidences < calibrated.accept_threshold
+    if below.any():
+        next_row = np.flatnonzero(below)[np.argmax(confidences[below])]
+        with_next = accepted.copy()
+        with_next[next_row] = True
+        assert correct[with_next].mean() < 0.9
+    assert calibrated.metrics["target_precision"] == 0.9
+    assert calibrated.metrics["accepted_precision"] == pytest.approx(correct[accepted].mean())
+
+
+def test_calibrate_never_accepts_without_reachable_precision(classifier, examples):
+    calibrated = classifier.partial_fit([])
+
+    calibrated.calibrate([], target_precision=0.95)
+    assert calibrated.accept_threshold == NEVER_ACCEPT
+
+    wrong_labels = [example._replace(account_code="9999") for example in examples[:30]]
+    calibrated.calibrate(wrong_labels, target_precision=0.95)
+    assert calibrated.accept_threshold == NEVER_ACCEPT
+    assert calibrated.metrics["coverage"] == 0.0
+
+
+def test_partial_fit_returns_updated_copy(classifier):
+    current = classifier.partial_fit([])
+    current.feedback_watermark = "2025-01-31T00:00:00"
+    coefficients = current.model.coef_.copy()
+    line = ("Courier delivery charges", "Aramex", "AP")
+    feedback = [TrainingExample("Courier delivery charges", "5600", "Aramex")] * 40
+
+    updated = current.partial_fit(feedback)
+
+    np.testing.assert_array_equal(current.model.coef_, coefficients)
+    assert updated is not current
+    assert updated.accept_threshold == current.accept_threshold
+    assert updated.feedback_watermark == current.feedback_watermark
+    [(code, confidence)] = updated.predict([line])
+    assert code == "5600"
+    before = current.predict_proba(current.vectorizer.transform([feature_text(*line)]))[0]
+    assert confidence > before[current.classes.index("5600")]
+
+
+def test_partial_fit_rejects_unseen_account_codes(classifier):
+    with pytest.raises(ValueError, match="9100"):
+        classifier.partial_fit([TrainingExample("Bank charges", "9100", "ENBD")])
+
+
+def test_artifact_round_trip(classifier, examples):
+    restored = LocalGLClassifier.from_artifact(classifier.to_artifact())
+
+    assert restored.predict(as_lines(examples[:30])) == classifier.predict(as_lines(examples[:30]))
+    assert restored.accept_threshold == classifier.accept_threshold
+
+    with pytest.raises(ValueError):
+        LocalGLClassifier.from_artifact({**classifier.to_artifact(), "n_features": 1024})
+
+
+def test_cli_trains_from_jsonl(tmp_path, examples):
+    data = tmp_path / "examples.jsonl"
+    data.write_text("\n".join(json.dumps({
+        "description": example.description, "account_code": example.account_code, "vendor_name": example.vendor_or_customer,
+    }) for example in examples))
+
+    assert gl_classifier.main(["train", "--data", str(data), "--model-dir", str(tmp_path / "models")]) == 0
+
+    registry = ModelRegistry(str(tmp_path / "models"))
+    assert registry.current_version() == 1
+    assert registry.load_current().feedback_watermark is None
+
+
+def test_cli_trains_from_feedback(tmp_path, monkeypatch, examples):
+    store = FeedbackStore(str(tmp_path / "feedback.sqlite3"))
+    for i, example in enumerate(examples):
+        store.add(FeedbackRequest(
+            invoice_id=f"I{i}",
+            line_number=1,
+            suggested_account="5500",
+            actual_account=example.account_code,
+            is_correct=False,
+            user_id="u1",
+            description=example.description,
+            vendor_name=example.vendor_or_customer,
+        ), "v0")
+    monkeypatch.setattr(main, "feedback_store", store)
+    model_dir = str(tmp_path / "models")
+
+    assert gl_classifier.main(["train", "--from-feedback", "--no-promote", "--model-dir", model_dir]) == 0
+
+    registry = ModelRegistry(model_dir)
+    assert registry.current_version() is None
+    trained = registry.load(1)
+    assert trained.feedback_watermark == store.newest_feedback_date()
+    # The service's next incremental round starts after the trained feedback
+    assert store.examples_since(trained.feedback_watermark, 1000) == ([], trained.feedback_watermark)
+    assert trained.predict([("Office rent April", "Dubai Properties", "AP")])[0][0] == "5300"
+
+
+def test_cli_needs_exactly_one_source(tmp_path):
+    with pytest.raises(SystemExit):
+        gl_classifier.main(["train", "--model-dir", str(tmp_path)])
+    with pytest.raises(SystemExit):
+        gl_classifier.main(["train", "--data", "x.jsonl", "--from-feedback", "--model-dir", str(tmp_path)])
+
+
+def test_cli_reports_too_little_feedback(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "feedback_store", FeedbackStore(str(tmp_path / "empty.sqlite3")))
+
+    assert gl_classifier.main(["train", "--from-feedback", "--model-dir", str(tmp_path / "models")]) == 1
+    assert ModelRegistry(str(tmp_path / "models")).versions() == []
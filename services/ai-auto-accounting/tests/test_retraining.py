@@ -0,0 +1,174 @@
+import asyncio
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.gl_classifier import (
+    DEFAULT_TARGET_PRECISION,
+    LocalGLClassifier,
+    ModelRegistry,
+    TrainingExample,
+    split_calibration,
+    split_holdout,
+)
+from app.main import FeedbackRequest, FeedbackStore, retrain_local_classifier, sync_local_classifier
+
+ACCOUNTS = [
+    ("5300", "Dubai Properties", ["office rent", "monthly lease", "warehouse rent"]),
+    ("5400", "DEWA", ["electricity bill", "water and power", "utility charges"]),
+    ("5600", "Google", ["workspace subscription", "cloud storage plan", "software licence"]),
+]
+
+
+def make_examples(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    examples = []
+    for i in range(count):
+        code, vendor, phrases = ACCOUNTS[i % len(ACCOUNTS)]
+        examples.append(TrainingExample(
+            description=f"{rng.choice(phrases)} {rng.choice(['jan', 'feb', 'mar'])} {i}",
+            account_code=code,
+            vendor_or_customer=vendor,
+        ))
+    return examples
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """A fresh model directory and feedback store installed in the service, with no model loaded"""
+    model_dir = str(tmp_path / "models")
+    store = FeedbackStore(str(tmp_path / "feedback.sqlite3"))
+    monkeypatch.setattr(main, "GL_MODEL_DIR", model_dir)
+    monkeypatch.setattr(main, "model_registry", ModelRegistry(model_dir))
+    monkeypatch.setattr(main, "feedback_store", store)
+    monkeypatch.setattr(main, "local_classifier", None)
+    monkeypatch.setattr(main, "retrain_rejections", 0)
+    monkeypatch.setattr(main, "RETRAIN_MIN_NEW_FEEDBACK", 10)
+    yield store
+    main.model_registry.release()
+
+
+def add_feedback(store, examples):
+    for i, example in enumerate(examples):
+        store.add(FeedbackRequest(
+            invoice_id=f"I{i}",
+            line_number=1,
+            suggested_account="5500",
+            actual_account=example.account_code,
+            is_correct=False,
+            user_id="u1",
+            description=example.description,
+            vendor_name=example.vendor_or_customer,
+        ), "v0")
+
+
+def test_split_calibration_halves_the_holdout():
+    _, holdout = split_holdout(make_examples(600))
+
+    calibration, evaluation = split_calibration(holdout)
+
+    assert (calibration, evaluation) == split_calibration(list(holdout))
+    assert sorted(calibration + evaluation) == sorted(holdout)
+    assert not set(calibration) & set(evaluation)
+    assert 0.3 < len(calibration) / len(holdout) < 0.7
+
+
+def test_train_reports_metrics_on_the_evaluation_half():
+    examples = make_examples(600)
+    calibration, evaluation = split_calibration(split_holdout(examples)[1])
+
+    classifier = LocalGLClassifier.train(examples)
+
+    assert classifier.metrics["calibration_examples"] == len(calibration)
+    assert classifier.metrics["examples"] == len(evaluation)
+    assert classifier.metrics == {
+        **classifier.evaluate(evaluation),
+        "calibration_examples": len(calibration),
+        "target_precision": classifier.metrics["target_precision"],
+        "training_examples": classifier.metrics["training_examples"],
+    }
+
+
+def test_retraining_calibrates_and_evaluates_on_separate_halves(service, monkeypatch):
+    examples = make_examples(600)
+    add_feedback(service, examples)
+    calibration, evaluation = split_calibration(split_holdout(examples)[1])
+    calls = []
+    calibrate = LocalGLClassifier.calibrate
+
+    def recording_calibrate(self, holdout, target_precision=DEFAULT_TARGET_PRECISION, evaluation=None):
+        calls.append((sorted(holdout), sorted(evaluation or [])))
+        calibrate(self, holdout, target_precision, evaluation)
+
+    monkeypatch.setattr(LocalGLClassifier, "calibrate", recording_calibrate)
+
+    assert retrain_local_classifier() == "promoted"
+
+    # train() calibrates its own split of the same feedback; the round then recalibrates on the shared halves
+    assert calls[-1] == (sorted(calibration), sorted(evaluation))
+    assert main.local_classifier.metrics["examples"] == len(evaluation)
+    assert main.model_registry.current_version() == main.local_classifier.version == 1
+
+    add_feedback(service, make_examples(60, seed=1))
+    calls.clear()
+    retrain_local_classifier()
+
+    # Candidate and current model both calibrate on the calibration half and are scored on the evaluation half
+    assert len(calls) == 2
+    assert all(evaluated and not set(calibrated) & set(evaluated) for calibrated, evaluated in calls)
+
+
+def test_only_the_lock_holder_retrains(service):
+    add_feedback(service, make_examples(600))
+    leader = ModelRegistry(main.GL_MODEL_DIR)
+    assert leader.try_lock()
+
+    try:
+        assert retrain_local_classifier() == "not_leader"
+        response = TestClient(main.app).post("/model/retrain")
+        assert response.status_code == 409
+        assert main.model_registry.versions() == []
+    finally:
+        leader.release()
+
+    assert retrain_local_classifier() == "promoted"
+    assert not leader.try_lock()
+
+
+def test_sync_reloads_only_a_new_current_version(service):
+    other_worker = ModelRegistry(main.GL_MODEL_DIR)
+    other_worker.promote(other_worker.save(LocalGLClassifier.train(make_examples(300))))
+
+    sync_local_classifier()
+    loaded = main.local_classifier
+    sync_local_classifier()
+
+    assert loaded.version == 1
+    assert main.local_classifier is loaded
+
+
+def test_retrain_loop_of_a_follower_picks_up_promotions(service, monkeypatch):
+    monkeypatch.setattr(main, "RETRAIN_INTERVAL_SECONDS", 0)
+    leader = ModelRegistry(main.GL_MODEL_DIR)
+    assert leader.try_lock()
+
+    async def run():
+        task = asyncio.create_task(main.retrain_loop())
+        try:
+            leader.promote(leader.save(LocalGLClassifier.train(make_examples(300))))
+            for _ in range(500):
+                if main.local_classifier is not None:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+
+    try:
+        asyncio.run(run())
+    finally:
+        leader.release()
+
+    assert main.local_classifier.version == 1
+    assert main.model_registry.versions() == [1]
@@ -0,0 +1,526 @@
+"""
+AIRP v2.0 - AI Matching Stage
+Candidate pre-ranking, single and batched LLM prompts, rate limiting and conflict resolution
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import anthropic
+import httpx
+
+try:
+    from app.models import BankTransaction, GLTransaction, TransactionMatch
+    from app.metrics import ai_calls, ai_tokens
+    from app.columns import to_day_ordinal
+    from app.matching import StageStats, counterparty_tokens
+except ImportError:  # Running from inside app/ (python main.py)
+    from models import BankTransaction, GLTransaction, TransactionMatch
+    from metrics import ai_calls, ai_tokens
+    from columns import to_day_ordinal
+    from matching import StageStats, counterparty_tokens
+
+logger = logging.getLogger(__name__)
+
+# Initialize AI client
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+AI_PROVIDER = os.getenv("AI_PROVIDER", "anthropic")
+
+if AI_PROVIDER == "anthropic" and ANTHROPIC_API_KEY and len(ANTHROPIC_API_KEY) > 10:
+    try:
+        # Create httpx client without proxies to avoid compatibility issues
+        http_client = httpx.AsyncClient(timeout=60.0)
+
+        # Initialize async Anthropic client so AI calls never block the event loop
+        ai_client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            http_client=http_client,
+            max_retries=2
+        )
+        logger.info("Initialized Anthropic Claude client")
+    except Exception as e:
+        ai_client = None
+        logger.warning(f"Failed to initialize Anthropic client: {e} - running in demo mode")
+else:
+    ai_client = None
+    logger.warning("No AI client initialized - running in demo mode")
+
+# Maximum concurrent AI matching calls across the whole service
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+# Maximum AI calls started per minute across the whole service (0 = no rate limit)
+AI_MAX_REQUESTS_PER_MINUTE = int(os.getenv("AI_MAX_REQUESTS_PER_MINUTE", "0"))
+# AI matching mode: "single" (one prompt per bank line) or "batched" (several bank lines per prompt)
+AI_MATCH_MODE = os.getenv("AI_MATCH_MODE", "single")
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "10"))
+# Approximate input token budget per batched prompt (estimated at ~4 characters per token)
+AI_BATCH_TOKEN_BUDGET = int(os.getenv("AI_BATCH_TOKEN_BUDGET", "6000"))
+AI_BATCH_MAX_CANDIDATES = int(os.getenv("AI_BATCH_MAX_CANDIDATES", "40"))
+# Candidate pre-ranking before the AI stage: top-K sent per bank line, minimum relevance to call the model
+AI_CANDIDATES_TOP_K = int(os.getenv("AI_CANDIDATES_TOP_K", "10"))
+AI_MIN_CANDIDATE_SCORE = float(os.getenv("AI_MIN_CANDIDATE_SCORE", "0.35"))
+# Days at which the date component of the candidate relevance score reaches zero
+AI_CANDIDATE_DATE_SCALE_DAYS = int(os.getenv("AI_CANDIDATE_DATE_SCALE_DAYS", "30"))
+
+
+def reference_tokens(text: str) -> set:
+    """Uppercase alphanumeric fragments of a reference or description (e.g. DD-DEWA-8765 → DEWA, 8765)"""
+    return {
+        token for token in re.split(r"[^A-Z0-9]+", text.upper())
+        if len(token) >= 4 or (len(token) >= 3 and any(ch.isdigit() for ch in token))
+    }
+
+
+class AICandidateRanker:
+    """
+    Pre-ranks open GL entries for each bank line before the AI stage.
+
+    Relevance combines amount proximity, date distance, reference-number
+    hits and description token overlap. Amount and date scores are computed
+    with NumPy over all candidates; reference and token hits come from
+    inverted indexes built once per stage.
+    """
+
+    AMOUNT_WEIGHT = 0.45
+    DATE_WEIGHT = 0.2
+    REFERENCE_WEIGHT = 0.15
+    TOKEN_WEIGHT = 0.2
+
+    def __init__(self, gl_txns: List[GLTransaction]):
+        self.gl_txns = gl_txns
+        self.amounts = np.array([gl.amount for gl in gl_txns], dtype=np.float64)
+        self.days = np.array([to_day_ordinal(gl.entry_date) or -1 for gl in gl_txns], dtype=np.int64)
+
+        self.token_postings: Dict[str, List[int]] = defaultdict(list)
+        self.reference_postings: Dict[str, List[int]] = defaultdict(list)
+        for gl_idx, gl in enumerate(gl_txns):
+            for word in counterparty_tokens(gl.description):
+                self.token_postings[word].append(gl_idx)
+            for token in reference_tokens(f"{gl.entry_id} {gl.description}"):
+                self.reference_postings[token].append(gl_idx)
+
+    def rank(self, bank_txn: BankTransaction, top_k: int = AI_CANDIDATES_TOP_K) -> List[Tuple[float, GLTransaction]]:
+        """Top-K (relevance, GL entry) pairs for a bank line, best first"""
+        if not self.gl_txns:
+            return []
+
+        amount_diff = np.abs(self.amounts - bank_txn.amount) / max(abs(bank_txn.amount), 0.01)
+        scores = self.AMOUNT_WEIGHT * (1.0 - np.minimum(amount_diff, 1.0))
+
+        bank_day = to_day_ordinal(bank_txn.transaction_date)
+        if bank_day is None:
+            scores += self.DATE_WEIGHT * 0.5
+        else:
+            date_score = 1.0 - np.minimum(np.abs(self.days - bank_day) / AI_CANDIDATE_DATE_SCALE_DAYS, 1.0)
+            scores += self.DATE_WEIGHT * np.where(self.days < 0, 0.5, date_score)
+
+        if bank_txn.reference_number:
+            hits = [
+                gl_idx
+                for token in reference_tokens(bank_txn.reference_number)
+                for gl_idx in self.reference_postings.get(token, ())
+            ]
+            if hits:
+                scores[np.unique(hits)] += self.REFERENCE_WEIGHT
+
+        bank_words = counterparty_tokens(bank_txn.description)
+        if bank_words:
+            overlap = np.zeros(len(self.gl_txns))
+            for word in bank_words:
+                postings = self.token_postings.get(word)
+                if postings:
+                    overlap[postings] += 1
+            scores += self.TOKEN_WEIGHT * overlap / len(bank_words)
+
+        top_k = min(top_k, len(self.gl_txns))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(float(scores[gl_idx]), self.gl_txns[gl_idx]) for gl_idx in top]
+
+    def plausible_candidates(self, bank_txn: BankTransaction, top_k: int = AI_CANDIDATES_TOP_K) -> List[GLTransaction]:
+        """Top-K candidates, or an empty list when none clears AI_MIN_CANDIDATE_SCORE"""
+        ranked = self.rank(bank_txn, top_k)
+        if not ranked or ranked[0][0] < AI_MIN_CANDIDATE_SCORE:
+            return []
+        return [gl for _, gl in ranked]
+
+
+def parse_ai_json(response_text: str):
+    """Extract the JSON payload from a model response (handles markdown code blocks)"""
+    response_text = response_text.strip()
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+    return json.loads(response_text)
+
+
+def format_gl_candidate(gl: GLTransaction) -> str:
+    return f"- ID: {gl.entry_id}, Date: {gl.entry_date}, Desc: {gl.description}, Amount: {gl.amount}"
+
+
+def format_bank_line(bank_txn: BankTransaction) -> str:
+    return (
+        f"- ID: {bank_txn.transaction_id}, Date: {bank_txn.transaction_date}, "
+        f"Desc: {bank_txn.description}, Amount: {bank_txn.amount}"
+    )
+
+
+def record_ai_call(message) -> None:
+    """Count a completed model call and its token usage"""
+    ai_calls.labels(outcome="made").inc()
+    usage = getattr(message, "usage", None)
+    if usage is not None:
+        ai_tokens.labels(direction="input").inc(usage.input_tokens)
+        ai_tokens.labels(direction="output").inc(usage.output_tokens)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for prompt budgeting (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+async def ai_match(bank_txn: BankTransaction, gl_txns: List[GLTransaction]) -> Optional[TransactionMatch]:
+    """AI-powered matching for complex cases"""
+    if not ai_client:
+        return None
+
+    gl_context = "\n".join([
+        format_gl_candidate(gl)
+        for gl in gl_txns[:AI_CANDIDATES_TOP_K]  # Pre-ranked candidates
+    ])
+
+    prompt = f"""You are a bank reconciliation expert. Match this bank transaction to the most likely GL entry.
+
+Bank Transaction:
+- ID: {bank_txn.transaction_id}
+- Date: {bank_txn.transaction_date}
+- Description: {bank_txn.description}
+- Amount: {bank_txn.amount}
+
+Candidate GL Entries:
+{gl_context}
+
+If there's a confident match, respond in this exact JSON format:
+{{
+  "matched_gl_id": "entry_id",
+  "confidence": 0.95,
+  "reasoning": "Brief explanation"
+}}
+
+If no confident match exists, respond with:
+{{
+  "matched_gl_id": null,
+  "confidence": 0.0,
+  "reasoning": "No confident match found"
+}}
+"""
+
+    try:
+        message = await ai_client.messages.create(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=300,
+            temperature=0.1,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        record_ai_call(message)
+
+        result = parse_ai_json(message.content[0].text)
+
+        if result.get("matched_gl_id") and result.get("confidence", 0) >= 0.8:
+            return TransactionMatch(
+                bank_transaction_id=bank_txn.transaction_id,
+                gl_transaction_id=result["matched_gl_id"],
+                confidence_score=result["confidence"],
+                match_reasoning=f"AI Match: {result['reasoning']}",
+                match_type="ai",
+            )
+
+    except Exception as e:
+        ai_calls.labels(outcome="failed").inc()
+        logger.error(f"AI matching failed: {str(e)}")
+
+    return None
+
+
+BATCH_PROMPT_HEADER = """You are a bank reconciliation expert. Match each bank transaction below to the most likely GL entry from the shared candidate list. Each GL entry can be matched to at most one bank transaction.
+
+"""
+
+BATCH_PROMPT_FOOTER = """
+Respond with a JSON array containing one object per bank transaction, in this exact format:
+[
+  {"bank_id": "bank transaction ID", "matched_gl_id": "entry_id", "confidence": 0.95, "reasoning": "Brief explanation"}
+]
+
+Use "matched_gl_id": null and "confidence": 0.0 when there is no confident match.
+"""
+
+
+async def ai_match_batch(
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+) -> List[Optional[TransactionMatch]]:
+    """AI matching for several bank lines in one prompt with a shared candidate set"""
+    if not ai_client or not bank_txns:
+        return [None] * len(bank_txns)
+
+    gl_context = "\n".join(format_gl_candidate(gl) for gl in gl_txns)
+    bank_context = "\n".join(format_bank_line(bank_txn) for bank_txn in bank_txns)
+
+    prompt = (
+        BATCH_PROMPT_HEADER
+        + f"Bank Transactions:\n{bank_context}\n\nCandidate GL Entries:\n{gl_context}\n"
+        + BATCH_PROMPT_FOOTER
+    )
+
+    results: Dict[str, TransactionMatch] = {}
+    try:
+        message = await ai_client.messages.create(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=min(150 * len(bank_txns) + 100, 4096),
+            temperature=0.1,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        record_ai_call(message)
+
+        assignments = parse_ai_json(message.content[0].text)
+        if isinstance(assignments, dict):
+            assignments = assignments.get("matches", [])
+
+        bank_ids = {bank_txn.transaction_id for bank_txn in bank_txns}
+        for assignment in assignments:
+            try:
+                bank_id = assignment.get("bank_id")
+                confidence = float(assignment.get("confidence") or 0)
+                if bank_id not in bank_ids or bank_id in results:
+                    continue
+                if assignment.get("matched_gl_id") and confidence >= 0.8:
+                    results[bank_id] = TransactionMatch(
+                        bank_transaction_id=bank_id,
+                        gl_transaction_id=assignment["matched_gl_id"],
+                        confidence_score=min(confidence, 1.0),
+                        match_reasoning=f"AI Match: {assignment.get('reasoning', '')}",
+                        match_type="ai",
+                    )
+            except (AttributeError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping malformed batched AI assignment {assignment!r}: {e}")
+
+    except Exception as e:
+        ai_calls.labels(outcome="failed").inc()
+        logger.error(f"Batched AI matching failed: {str(e)}")
+
+    return [results.get(bank_txn.transaction_id) for bank_txn in bank_txns]
+
+
+def plan_ai_batches(
+    bank_txns: List[BankTransaction],
+    candidates_by_bank_id: Dict[str, List[GLTransaction]],
+) -> List[Tuple[List[BankTransaction], List[GLTransaction]]]:
+    """
+    Group bank lines into batched prompts with a shared candidate set.
+
+    A batch is closed when it reaches AI_BATCH_SIZE lines, when the next
+    line's new candidates would push the shared set past
+    AI_BATCH_MAX_CANDIDATES, or when the estimated prompt would exceed
+    AI_BATCH_TOKEN_BUDGET.
+    """
+    base_tokens = estimate_tokens(BATCH_PROMPT_HEADER + BATCH_PROMPT_FOOTER)
+    batches: List[Tuple[List[BankTransaction], List[GLTransaction]]] = []
+    current: List[BankTransaction] = []
+    current_candidates: Dict[str, GLTransaction] = {}
+    current_tokens = base_tokens
+
+    for bank_txn in bank_txns:
+        candidates = candidates_by_bank_id[bank_txn.transaction_id]
+        new_candidates = [gl for gl in candidates if gl.entry_id not in current_candidates]
+        line_tokens = estimate_tokens(format_bank_line(bank_txn)) + sum(
+            estimate_tokens(format_gl_candidate(gl)) for gl in new_candidates
+        )
+        if current and (
+            len(current) >= AI_BATCH_SIZE
+            or len(current_candidates) + len(new_candidates) > AI_BATCH_MAX_CANDIDATES
+            or current_tokens + line_tokens > AI_BATCH_TOKEN_BUDGET
+        ):
+            batches.append((current, list(current_candidates.values())))
+            current, current_candidates, current_tokens = [], {}, base_tokens
+            new_candidates = candidates
+            line_tokens = estimate_tokens(format_bank_line(bank_txn)) + sum(
+                estimate_tokens(format_gl_candidate(gl)) for gl in new_candidates
+            )
+        current.append(bank_txn)
+        current_candidates.update((gl.entry_id, gl) for gl in new_candidates)
+        current_tokens += line_tokens
+
+    if current:
+        batches.append((current, list(current_candidates.values())))
+    return batches
+
+
+class AIRateLimiter:
+    """Spaces AI call starts so at most `per_minute` begin per minute (0 disables)"""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+ai_rate_limiter = AIRateLimiter(AI_MAX_REQUESTS_PER_MINUTE)
+
+
+async def gather_until(deadline: Optional[float], coros: list) -> Tuple[list, List[int]]:
+    """
+    Run coroutines concurrently until a time.monotonic() deadline (None waits for all).
+
+    Returns their results in order, with None for the ones still running at
+    the deadline (which are cancelled), and the positions of those.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    if not tasks:
+        return [], []
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        _, unfinished = await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if unfinished:
+        await asyncio.gather(*unfinished, return_exceptions=True)
+    return (
+        [None if task in unfinished else task.result() for task in tasks],
+        [pos for pos, task in enumerate(tasks) if task in unfinished],
+    )
+
+
+def resolve_ai_conflicts(
+    results: List[Optional[TransactionMatch]],
+    available_gl_ids: set,
+) -> List[TransactionMatch]:
+    """
+    Resolve concurrent AI results where several bank lines claim the same GL entry.
+
+    The highest confidence claim wins, ties go to the earlier bank line;
+    losers stay unmatched. Claims on GL entries that were not offered as
+    candidates are dropped. Returned matches keep bank input order.
+    """
+    claims = [
+        (position, match) for position, match in enumerate(results)
+        if match and match.gl_transaction_id in available_gl_ids
+    ]
+    claims.sort(key=lambda claim: (-claim[1].confidence_score, claim[0]))
+
+    taken_gl_ids = set()
+    accepted = []
+    for position, match in claims:
+        if match.gl_transaction_id in taken_gl_ids:
+            logger.info(
+                f"AI match conflict: {match.bank_transaction_id} lost "
+                f"{match.gl_transaction_id} to a higher-confidence claim"
+            )
+            continue
+        taken_gl_ids.add(match.gl_transaction_id)
+        accepted.append((position, match))
+
+    return [match for _, match in sorted(accepted, key=lambda claim: claim[0])]
+
+
+async def ai_match_stage(
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+    ai_mode: Optional[str] = None,
+    progress: Optional[asyncio.Queue] = None,
+    stats: Optional[StageStats] = None,
+    deadline: Optional[float] = None,
+) -> Tuple[List[TransactionMatch], List[str]]:
+    """
+    Run the AI stage concurrently (bounded by AI_MAX_CONCURRENCY) and resolve conflicts.
+
+    Each bank line only sees its top-ranked candidates, and lines without a
+    plausible candidate skip the model entirely. In "single" mode each bank
+    line gets its own prompt; in "batched" mode bank lines share prompts and
+    the union of their candidates.
+
+    Calls still running at the deadline (a time.monotonic() value) are
+    cancelled. Returns the matches and the IDs of bank lines left pending.
+    """
+    if not ai_client or not bank_txns or not gl_txns:
+        return [], []
+    if deadline is not None and time.monotonic() >= deadline:
+        return [], [txn.transaction_id for txn in bank_txns]
+
+    ranker = AICandidateRanker(gl_txns)
+    candidates_by_bank_id = {}
+    for bank_txn in bank_txns:
+        candidates = ranker.plausible_candidates(bank_txn)
+        if candidates:
+            candidates_by_bank_id[bank_txn.transaction_id] = candidates
+    ai_bank_txns = [txn for txn in bank_txns if txn.transaction_id in candidates_by_bank_id]
+    if stats is not None:
+        stats.add(sum(len(candidates) for candidates in candidates_by_bank_id.values()), len(bank_txns))
+
+    skipped = len(bank_txns) - len(ai_bank_txns)
+    if skipped:
+        ai_calls.labels(outcome="skipped").inc(skipped)
+        logger.info(f"AI stage: skipped {skipped} bank lines with no plausible GL candidate")
+
+    completed = 0
+
+    def report_progress(lines: int) -> None:
+        nonlocal completed
+        completed += lines
+        if progress is not None:
+            progress.put_nowait({"completed": completed, "total": len(ai_bank_txns)})
+
+    if (ai_mode or AI_MATCH_MODE) == "batched":
+        batches = plan_ai_batches(ai_bank_txns, candidates_by_bank_id)
+
+        async def bounded_ai_match_batch(batch: List[BankTransaction], candidates: List[GLTransaction]):
+            async with ai_semaphore:
+                await ai_rate_limiter.wait()
+                batch_result = await ai_match_batch(batch, candidates)
+            report_progress(len(batch))
+            return batch_result
+
+        batch_results, unfinished = await gather_until(
+            deadline, [bounded_ai_match_batch(*batch) for batch in batches]
+        )
+        pending = [bank_txn.transaction_id for pos in unfinished for bank_txn in batches[pos][0]]
+        results = []
+        for (batch, candidates), batch_result in zip(batches, batch_results):
+            if batch_result is None:
+                continue
+            offered = {gl.entry_id for gl in candidates}
+            results.extend(
+                match if match and match.gl_transaction_id in offered else None
+                for match in batch_result
+            )
+    else:
+        async def bounded_ai_match(bank_txn: BankTransaction) -> Optional[TransactionMatch]:
+            async with ai_semaphore:
+                await ai_rate_limiter.wait()
+                match = await ai_match(bank_txn, candidates_by_bank_id[bank_txn.transaction_id])
+            report_progress(1)
+            offered = {gl.entry_id for gl in candidates_by_bank_id[bank_txn.transaction_id]}
+            return match if match and match.gl_transaction_id in offered else None
+
+        results, unfinished = await gather_until(deadline, [bounded_ai_match(bank_txn) for bank_txn in ai_bank_txns])
+        pending = [ai_bank_txns[pos].transaction_id for pos in unfinished]
+
+    if pending:
+        logger.warning(f"AI stage: deadline reached with {len(pending)} bank lines pending")
+    return resolve_ai_conflicts(results, {gl.entry_id for gl in gl_txns}), pending
@@ -0,0 +1,317 @@
+"""
+AIRP v2.0 - Columnar Transactions
+Run-local vocabulary and NumPy column view of bank lines and GL entries that the matching stages work on
+"""
+import os
+import copy
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from datetime import date
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+try:
+    from app.statement_ingest import StatementColumns
+    from app.models import GLTransaction
+except ImportError:  # Running from inside app/ (python main.py)
+    from statement_ingest import StatementColumns
+    from models import GLTransaction
+
+# Character n-gram length for the fuzzy description fallback (0 disables the n-gram signal)
+FUZZY_NGRAM_SIZE = int(os.getenv("FUZZY_NGRAM_SIZE", "3"))
+# Highest-weight n-grams of a bank line looked up in the GL n-gram index
+FUZZY_NGRAM_PROBES = int(os.getenv("FUZZY_NGRAM_PROBES", "6"))
+
+
+def to_fils(amount: float) -> int:
+    """Convert an amount to integer fils (1/100 of the currency unit)"""
+    return int(round(amount * 100))
+
+
+def amounts_to_fils(amounts: Iterable[float]) -> np.ndarray:
+    """int64 array of amounts in fils"""
+    return np.fromiter((to_fils(amount) for amount in amounts), dtype=np.int64)
+
+
+def to_day_ordinal(date_str: str) -> Optional[int]:
+    """Convert an ISO date string to a day ordinal, or None if it cannot be parsed"""
+    try:
+        return date.fromisoformat(date_str[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def description_words(description: str) -> set:
+    """Lowercased word set used for description similarity"""
+    return set(description.lower().split())
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, start + count) for every (start, count) pair"""
+    total = int(counts.sum())
+    return np.repeat(starts, counts) + (np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts))
+
+
+class GLColumns:
+    """
+    Columnar open GL lines, filled batch by batch from a database cursor.
+
+    Amounts are integer fils and repeated dates, descriptions and account
+    codes/names share a single string. Indexing and iteration build
+    GLTransaction objects on demand, so the columns can stand in for a list of
+    GL entries, and TransactionColumns.from_gl reads them without building rows.
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.amounts_fils = array("q")
+        self.entry_dates: List[str] = []
+        self.descriptions: List[str] = []
+        self.account_codes: List[str] = []
+        self.account_names: List[str] = []
+        self._strings: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> GLTransaction:
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return self.row(row % len(self))
+
+    def __iter__(self) -> Iterator[GLTransaction]:
+        return (self.row(row) for row in range(len(self)))
+
+    def _share(self, value: str) -> str:
+        return self._strings.setdefault(value, value)
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        """Append (line_id, entry_date, description, amount, account_code, account_name) rows"""
+        for line_id, entry_date, description, amount, account_code, account_name in rows:
+            self.ids.append(line_id)
+            self.amounts_fils.append(to_fils(float(amount)))
+            self.entry_dates.append(self._share(entry_date))
+            self.descriptions.append(self._share(description))
+            self.account_codes.append(self._share(account_code))
+            self.account_names.append(self._share(account_name))
+
+    def row(self, row: int) -> GLTransaction:
+        # Column values are already typed; skip pydantic validation
+        return GLTransaction.model_construct(
+            entry_id=self.ids[row],
+            entry_date=self.entry_dates[row],
+            description=self.descriptions[row],
+            amount=self.amounts_fils[row] / 100,
+            account_code=self.account_codes[row],
+            account_name=self.account_names[row],
+        )
+
+
+def gl_entry_ids(gl_txns: Sequence) -> List[str]:
+    """entry_id of every GL line, read from the ID column when the lines are GLColumns"""
+    if isinstance(gl_txns, GLColumns):
+        return gl_txns.ids
+    return [gl.entry_id for gl in gl_txns]
+
+
+class RunVocabulary:
+    """Description words and date strings interned once per run, shared by the bank and GL columns"""
+
+    def __init__(self):
+        self.words: Dict[str, int] = {}
+        self.dates: Dict[str, Tuple[int, int]] = {}
+
+    def date(self, date_str: str) -> Tuple[int, int]:
+        """(interned date string id, day ordinal or -1 if it cannot be parsed)"""
+        interned = self.dates.get(date_str)
+        if interned is None:
+            day = to_day_ordinal(date_str)
+            interned = (len(self.dates), day if day is not None else -1)
+            self.dates[date_str] = interned
+        return interned
+
+    def tokenize(self, descriptions: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """CSR (offsets, token ids) of each description's words, ids sorted per row"""
+        offsets = np.zeros(len(descriptions) + 1, dtype=np.int64)
+        token_ids: List[int] = []
+        words = self.words
+        for row, description in enumerate(descriptions):
+            token_ids.extend(sorted({words.setdefault(word, len(words)) for word in description_words(description)}))
+            offsets[row + 1] = len(token_ids)
+        return offsets, np.array(token_ids, dtype=np.int64)
+
+    def counterparty_mask(self) -> np.ndarray:
+        """Token ids that count as counterparty tokens (see counterparty_tokens)"""
+        mask = np.zeros(len(self.words), dtype=bool)
+        for word, token in self.words.items():
+            mask[token] = len(word) > 2 and word.isalpha()
+        return mask
+
+
+class TransactionColumns:
+    """
+    Columnar form of one side (bank or GL) of a reconciliation run.
+
+    Built once per run: amounts as int64 fils, dates as interned ids (the
+    exact-match key) and day ordinals, description words as vocabulary ids in CSR layout (the
+    tokens of row i are token_ids[token_offsets[i]:token_offsets[i + 1]]).
+    Stages take row index arrays and return matched rows instead of building
+    filtered transaction lists; the original objects are only needed again
+    for the AI stage.
+    """
+
+    def __init__(
+        self,
+        transactions: Sequence,
+        ids: List[str],
+        amounts_fils: np.ndarray,
+        dates: List[str],
+        descriptions: List[str],
+        references: List[Optional[str]],
+        vocabulary: RunVocabulary,
+    ):
+        self.transactions = transactions
+        self.ids = ids
+        self.descriptions = descriptions
+        self.references = references
+        self.amounts_fils = amounts_fils
+        self.date_keys = np.empty(len(ids), dtype=np.int64)
+        self.days = np.empty(len(ids), dtype=np.int64)
+        for row, date_str in enumerate(dates):
+            self.date_keys[row], self.days[row] = vocabulary.date(date_str)
+        self.token_offsets, self.token_ids = vocabulary.tokenize(descriptions)
+
+    @classmethod
+    def from_bank(cls, bank_txns: Sequence, vocabulary: RunVocabulary) -> "TransactionColumns":
+        if isinstance(bank_txns, StatementColumns):
+            return cls.from_statement(bank_txns, vocabulary)
+        return cls(
+            bank_txns,
+            [txn.transaction_id for txn in bank_txns],
+            amounts_to_fils(txn.amount for txn in bank_txns),
+            [txn.transaction_date for txn in bank_txns],
+            [txn.description for txn in bank_txns],
+            [txn.reference_number for txn in bank_txns],
+            vocabulary,
+        )
+
+    @classmethod
+    def from_statement(cls, statement: StatementColumns, vocabulary: RunVocabulary) -> "TransactionColumns":
+        """Columns read straight from an uploaded statement, without building its rows"""
+        return cls(
+            statement,
+            [statement.transaction_id(row) for row in range(len(statement))],
+            np.array(statement.amounts_fils, dtype=np.int64),
+            statement.transaction_dates(),
+            statement.descriptions,
+            statement.references,
+            vocabulary,
+        )
+
+    @classmethod
+    def from_gl(cls, gl_txns: Sequence, vocabulary: RunVocabulary) -> "TransactionColumns":
+        if isinstance(gl_txns, GLColumns):
+            return cls.from_gl_columns(gl_txns, vocabulary)
+        return cls(
+            gl_txns,
+            [txn.entry_id for txn in gl_txns],
+            amounts_to_fils(txn.amount for txn in gl_txns),
+            [txn.entry_date for txn in gl_txns],
+            [txn.description for txn in gl_txns],
+            [None] * len(gl_txns),
+            vocabulary,
+        )
+
+    @classmethod
+    def from_gl_columns(cls, gl_lines: GLColumns, vocabulary: RunVocabulary) -> "TransactionColumns":
+        """Columns read straight from GL lines loaded from the database, without building their rows"""
+        return cls(
+            gl_lines,
+            gl_lines.ids,
+            np.array(gl_lines.amounts_fils, dtype=np.int64),
+            gl_lines.entry_dates,
+            gl_lines.descriptions,
+            [None] * len(gl_lines),
+            vocabulary,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def with_descriptions(self, replacements: Dict[int, str], vocabulary: RunVocabulary) -> "TransactionColumns":
+        """Copy whose description tokens use replacement descriptions for some rows (other columns are shared)"""
+        columns = copy.copy(self)
+        columns.descriptions = [replacements.get(row, description) for row, description in enumerate(self.descriptions)]
+        columns.token_offsets, columns.token_ids = vocabulary.tokenize(columns.descriptions)
+        return columns
+
+    def gather_tokens(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(position in rows, token id) for every token of the given rows"""
+        counts = self.token_offsets[rows + 1] - self.token_offsets[rows]
+        return np.repeat(np.arange(len(rows)), counts), self.token_ids[expand_ranges(self.token_offsets[rows], counts)]
+
+    def amount(self, row: int) -> float:
+        return int(self.amounts_fils[row]) / 100
+
+
+class NgramIndex:
+    """
+    Character n-gram TF-IDF vectors of GL descriptions, for fuzzy candidates that share no whole word.
+
+    Catches spelling and spacing variants ("ETISALAT-UAE" vs "Etisalat UAE",
+    "AMAZONWEBSERVICES" vs "Amazon Web Services"), not synonyms. Rows are
+    L2-normalised, so the dot product of a bank and a GL row is their cosine
+    similarity. GL rows are given in amount-sorted order and the inverted
+    index keys are (n-gram * n_gl + GL position), like the word postings in
+    fuzzy_candidate_pairs. IDF is fitted on distinct descriptions so that
+    recurring entries do not drown out their own n-grams.
+    """
+
+    def __init__(self, gl_descriptions: List[str]):
+        self.vectorizer = TfidfVectorizer(
+            analyzer="char_wb",
+            ngram_range=(FUZZY_NGRAM_SIZE, FUZZY_NGRAM_SIZE),
+            sublinear_tf=True,
+            dtype=np.float32,
+        )
+        self.vectorizer.fit(list(dict.fromkeys(gl_descriptions)))
+        self.gl = self.vectors(gl_descriptions)
+        n_gl = self.gl.shape[0]
+        gl_pos = np.repeat(np.arange(n_gl), np.diff(self.gl.indptr))
+        self.posting_keys = np.sort(self.gl.indices.astype(np.int64) * n_gl + gl_pos)
+
+    @classmethod
+    def build(cls, gl_descriptions: List[str]) -> Optional["NgramIndex"]:
+        """Index over the descriptions, or None when the n-gram signal is disabled or nothing can be indexed"""
+        if FUZZY_NGRAM_SIZE <= 0 or not gl_descriptions:
+            return None
+        try:
+            return cls(gl_descriptions)
+        except ValueError:
+            # Empty n-gram vocabulary (e.g. all descriptions blank)
+            return None
+
+    def vectors(self, descriptions: List[str]):
+        """CSR TF-IDF rows of the descriptions (each distinct description is vectorised once)"""
+        distinct: Dict[str, int] = {}
+        inverse = np.fromiter(
+            (distinct.setdefault(description, len(distinct)) for description in descriptions),
+            dtype=np.int64,
+            count=len(descriptions),
+        )
+        return self.vectorizer.transform(list(distinct))[inverse]
+
+    @staticmethod
+    def probes(vectors) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, n-gram id) of the FUZZY_NGRAM_PROBES highest-weight n-grams of every row"""
+        counts = np.diff(vectors.indptr)
+        rows = np.repeat(np.arange(vectors.shape[0]), counts)
+        order = np.lexsort((-vectors.data, rows))
+        rank = np.arange(len(order)) - np.repeat(vectors.indptr[:-1], counts)
+        keep = order[rank < FUZZY_NGRAM_PROBES]
+        return rows[keep], vectors.indices[keep].astype(np.int64)
+
+    def cosine(self, vectors, rows: np.ndarray, gl_pos: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each (row of vectors, GL position) pair"""
+        return np.asarray(vectors[rows].multiply(self.gl[gl_pos]).sum(axis=1)).ravel()
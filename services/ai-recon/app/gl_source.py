@@ -0,0 +1,171 @@
+"""
+AIRP v2.0 - GL Source
+Open GL lines for a bank account, streamed from Postgres (gl_source="database")
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import uuid
+from typing import Optional, Sequence, Tuple
+from datetime import date
+
+from fastapi import HTTPException, status
+import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+try:
+    from app.statement_ingest import StatementColumns
+    from app.models import GLTransaction, ReconciliationRequest
+    from app.columns import GLColumns, to_day_ordinal
+except ImportError:  # Running from inside app/ (python main.py)
+    from statement_ingest import StatementColumns
+    from models import GLTransaction, ReconciliationRequest
+    from columns import GLColumns, to_day_ordinal
+
+logger = logging.getLogger(__name__)
+
+# Postgres source for open GL lines (gl_source="database")
+DB_CONFIG = {
+    "host": os.getenv("POSTGRES_HOST", "localhost"),
+    "port": int(os.getenv("POSTGRES_PORT", "5432")),
+    "database": os.getenv("POSTGRES_DB", "airp_master"),
+    "user": os.getenv("POSTGRES_USER", "airp_admin"),
+    "password": os.getenv("POSTGRES_PASSWORD", "airp_secure_2024"),
+}
+GL_DB_POOL_MIN = int(os.getenv("GL_DB_POOL_MIN", "1"))
+GL_DB_POOL_MAX = int(os.getenv("GL_DB_POOL_MAX", "5"))
+# Rows fetched per round trip from the server-side cursor
+GL_FETCH_BATCH_SIZE = int(os.getenv("GL_FETCH_BATCH_SIZE", "2000"))
+# Days added around the bank statement's date range when querying GL lines
+GL_DB_DATE_PADDING_DAYS = int(os.getenv("GL_DB_DATE_PADDING_DAYS", "30"))
+
+
+# Posted lines on the bank account's GL account that no bank transaction has been matched to yet.
+# bank_transactions only records the matched journal *entry*, so exclusion is per entry: once one
+# line of an entry is matched, its other lines on the same bank GL account (e.g. a batch payment
+# booked as several lines) are left out too. Matching per line needs a matched line ID column.
+OPEN_GL_LINES_SQL = """
+    SELECT jel.line_id::text,
+           je.entry_date::text,
+           COALESCE(jel.description, je.description, ''),
+           ABS(COALESCE(jel.debit_amount, 0) - COALESCE(jel.credit_amount, 0)),
+           coa.account_code,
+           coa.account_name
+    FROM bank_accounts ba
+    JOIN journal_entry_lines jel
+      ON jel.account_id = ba.gl_account_id AND jel.tenant_id = ba.tenant_id
+    JOIN journal_entries je ON je.entry_id = jel.entry_id
+    JOIN chart_of_accounts coa ON coa.account_id = jel.account_id
+    WHERE ba.tenant_id = %(tenant_id)s
+      AND ba.bank_account_id = %(bank_account_id)s
+      AND je.status = 'posted'
+      AND je.entry_date BETWEEN %(date_from)s AND %(date_to)s
+      AND NOT EXISTS (
+          SELECT 1 FROM bank_transactions bt
+          WHERE bt.tenant_id = ba.tenant_id
+            AND bt.matched_journal_entry_id = je.entry_id
+            AND bt.reconciliation_status IN ('matched', 'reconciled')
+      )
+    ORDER BY je.entry_date, jel.line_id
+"""
+
+db_pool: Optional[ThreadedConnectionPool] = None
+db_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when exhausted; callers wait for a free connection instead
+db_pool_slots = threading.BoundedSemaphore(GL_DB_POOL_MAX)
+
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            db_pool = ThreadedConnectionPool(GL_DB_POOL_MIN, GL_DB_POOL_MAX, **DB_CONFIG)
+        return db_pool
+
+
+def load_open_gl_lines(tenant_id: str, bank_account_id: str, date_from: date, date_to: date) -> GLColumns:
+    """
+    Stream open GL lines for a bank account from Postgres.
+
+    Uses a pooled connection and a named (server-side) cursor, so rows arrive
+    in GL_FETCH_BATCH_SIZE batches instead of one client-side result set.
+    Each batch goes straight into the GL columns; no per-line objects are built.
+    """
+    with db_pool_slots:
+        pool = get_db_pool()
+        conn = pool.getconn()
+        try:
+            gl_lines = GLColumns()
+            with conn.cursor(name=f"recon_open_gl_{uuid.uuid4().hex}") as cursor:
+                cursor.execute(OPEN_GL_LINES_SQL, {
+                    "tenant_id": tenant_id,
+                    "bank_account_id": bank_account_id,
+                    "date_from": date_from,
+                    "date_to": date_to,
+                })
+                while True:
+                    rows = cursor.fetchmany(GL_FETCH_BATCH_SIZE)
+                    if not rows:
+                        break
+                    gl_lines.extend(rows)
+            return gl_lines
+        finally:
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=bool(conn.closed))
+
+
+def gl_date_range(request: ReconciliationRequest, bank_txns: Sequence) -> Tuple[date, date]:
+    """Explicit GL date bounds, or the bank statement's date range padded by GL_DB_DATE_PADDING_DAYS"""
+    if isinstance(bank_txns, StatementColumns):
+        days = [day for day in bank_txns.day_ordinals if day]
+    else:
+        days = [d for d in (to_day_ordinal(txn.transaction_date) for txn in bank_txns) if d is not None]
+    if (request.gl_date_from is None or request.gl_date_to is None) and not days:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="gl_date_from and gl_date_to are required when bank lines have no ISO dates",
+        )
+    date_from = request.gl_date_from or date.fromordinal(min(days) - GL_DB_DATE_PADDING_DAYS)
+    date_to = request.gl_date_to or date.fromordinal(max(days) + GL_DB_DATE_PADDING_DAYS)
+    return date_from, date_to
+
+
+async def resolve_gl_transactions(request: ReconciliationRequest, bank_txns: Sequence) -> Sequence[GLTransaction]:
+    """GL lines from the request body or, for gl_source="database", GL columns loaded from Postgres"""
+    if request.gl_source == "request":
+        return request.gl_transactions
+
+    # Both are uuid columns; a malformed ID is a bad request, not a database outage
+    try:
+        tenant_id = str(uuid.UUID(request.tenant_id))
+        account_id = str(uuid.UUID(request.account_id))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='tenant_id and account_id must be UUIDs when gl_source is "database"',
+        )
+
+    date_from, date_to = gl_date_range(request, bank_txns)
+    started = time.perf_counter()
+    try:
+        gl_txns = await asyncio.to_thread(load_open_gl_lines, tenant_id, account_id, date_from, date_to)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError) as e:
+        logger.error(f"Loading GL lines failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="GL database unavailable",
+        )
+    except psycopg2.Error as e:
+        logger.error(f"Loading GL lines failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Loading GL lines failed",
+        )
+    logger.info(
+        f"Loaded {len(gl_txns)} open GL lines for account {request.account_id} "
+        f"({date_from} to {date_to}) in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    return gl_txns
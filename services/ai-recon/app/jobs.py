@@ -0,0 +1,308 @@
+"""
+AIRP v2.0 - Account Reconciliation and Jobs
+Reconciliation of one account request, multi-account jobs and follow-up jobs for pending AI lines
+"""
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Union
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+try:
+    from app.models import (
+        AccountJobResult,
+        GLTransaction,
+        ReconciliationJob,
+        ReconciliationRequest,
+        ReconciliationResponse,
+        SessionLinesRequest,
+    )
+    from app.metrics import reconciliation_counter, reconciliation_duration
+    from app.stores import statement_store
+    from app.gl_source import resolve_gl_transactions
+    from app.columns import gl_entry_ids
+    from app.matching import StageStats
+    from app.ai_matching import ai_match_stage
+    from app.pipeline import drain_progress, observe_stage, reconcile_transactions
+except ImportError:  # Running from inside app/ (python main.py)
+    from models import (
+        AccountJobResult,
+        GLTransaction,
+        ReconciliationJob,
+        ReconciliationRequest,
+        ReconciliationResponse,
+        SessionLinesRequest,
+    )
+    from metrics import reconciliation_counter, reconciliation_duration
+    from stores import statement_store
+    from gl_source import resolve_gl_transactions
+    from columns import gl_entry_ids
+    from matching import StageStats
+    from ai_matching import ai_match_stage
+    from pipeline import drain_progress, observe_stage, reconcile_transactions
+
+logger = logging.getLogger(__name__)
+
+# Multi-account reconciliation jobs (/jobs/reconcile)
+RECON_JOB_WORKERS = int(os.getenv("RECON_JOB_WORKERS", "4"))
+RECON_JOB_MAX_CONCURRENT_ACCOUNTS = int(os.getenv("RECON_JOB_MAX_CONCURRENT_ACCOUNTS", "8"))
+MAX_STORED_JOBS = int(os.getenv("MAX_STORED_JOBS", "50"))
+
+
+def resolve_bank_transactions(request: Union[ReconciliationRequest, SessionLinesRequest]) -> Sequence:
+    """
+    Bank lines from the request body, or a previously uploaded statement's
+    column store (a sequence whose rows are only built on demand)
+    """
+    if not request.statement_id:
+        return request.bank_transactions
+
+    stored = statement_store.get(request.statement_id)
+    if stored is None or stored[0] != request.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Statement {request.statement_id} not found",
+        )
+    return stored[2]
+
+
+def reconciliation_options(request: ReconciliationRequest) -> dict:
+    return {
+        "fuzzy_date_window_days": request.fuzzy_date_window_days,
+        "assignment": request.assignment,
+        "split_matching": request.split_matching,
+        "ai_mode": request.ai_mode,
+        "tenant_id": request.tenant_id if request.use_aliases else None,
+    }
+
+
+def request_deadline(request: ReconciliationRequest) -> Optional[float]:
+    """time.monotonic() deadline for a request, counted from now"""
+    return time.monotonic() + request.deadline_ms / 1000 if request.deadline_ms else None
+
+
+def reconciliation_rate_pct(bank_count: int, unmatched_count: int) -> float:
+    return (bank_count - unmatched_count) / bank_count * 100 if bank_count else 0
+
+
+async def reconcile_request(
+    request: ReconciliationRequest,
+    executor: Optional[Executor] = None,
+    on_event: Optional[Callable[[dict], None]] = None,
+) -> ReconciliationResponse:
+    start_time = datetime.utcnow()
+    deadline = request_deadline(request)
+
+    bank_txns = resolve_bank_transactions(request)
+    gl_txns = await resolve_gl_transactions(request, bank_txns)
+
+    matches, group_matches, unmatched_bank, unmatched_gl, stage_timings, pending_ai = await reconcile_transactions(
+        bank_txns,
+        gl_txns,
+        on_event=on_event,
+        executor=executor,
+        deadline=deadline,
+        **reconciliation_options(request),
+    )
+
+    processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
+    reconciliation_duration.observe(processing_time / 1000)
+
+    return ReconciliationResponse(
+        account_id=request.account_id,
+        timestamp=datetime.utcnow().isoformat(),
+        matches=matches,
+        group_matches=group_matches,
+        unmatched_bank=unmatched_bank,
+        unmatched_gl=unmatched_gl,
+        reconciliation_rate=reconciliation_rate_pct(len(bank_txns), len(unmatched_bank)),
+        processing_time_ms=processing_time,
+        stage_timings_ms=stage_timings,
+        pending_ai=pending_ai,
+        pending_ai_job_id=start_pending_ai_job(request, bank_txns, gl_txns, pending_ai, unmatched_gl),
+    )
+
+
+reconciliation_jobs: "OrderedDict[str, ReconciliationJob]" = OrderedDict()
+# Strong references to running job tasks (the event loop only keeps weak ones)
+job_tasks: Dict[str, asyncio.Task] = {}
+job_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_job_executor() -> ProcessPoolExecutor:
+    """Process pool for the CPU-bound exact/fuzzy/split stages of job accounts"""
+    global job_executor
+    if job_executor is None:
+        job_executor = ProcessPoolExecutor(
+            max_workers=RECON_JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return job_executor
+
+
+def shutdown_job_executor() -> None:
+    if job_executor is not None:
+        job_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def store_job(job: ReconciliationJob) -> None:
+    reconciliation_jobs[job.job_id] = job
+    # Evict the oldest finished jobs; running jobs are kept regardless
+    for job_id in list(reconciliation_jobs):
+        if len(reconciliation_jobs) <= MAX_STORED_JOBS:
+            break
+        if reconciliation_jobs[job_id].status == "completed":
+            del reconciliation_jobs[job_id]
+
+
+async def run_reconciliation_job(job: ReconciliationJob, accounts: List[ReconciliationRequest]) -> None:
+    """
+    Reconcile many accounts concurrently. Deterministic stages go to the
+    process pool; AI calls from every account share ai_semaphore and
+    ai_rate_limiter, so a month-end job cannot exceed the service's AI limits.
+    """
+    job.status = "running"
+    executor = get_job_executor()
+    account_slots = asyncio.Semaphore(RECON_JOB_MAX_CONCURRENT_ACCOUNTS)
+
+    async def run_account(request: ReconciliationRequest) -> None:
+        key = f"{request.tenant_id}/{request.account_id}"
+
+        def on_event(event: dict) -> None:
+            if event["type"] == "stage_complete":
+                job.running[key] = f"{event['stage']} complete"
+            elif event["type"] == "progress":
+                job.running[key] = f"ai {event['completed']}/{event['total']}"
+
+        async with account_slots:
+            job.running[key] = "started"
+            try:
+                response = await reconcile_request(request, executor=executor, on_event=on_event)
+                result = AccountJobResult(
+                    tenant_id=request.tenant_id, account_id=request.account_id, status="completed", result=response
+                )
+            except HTTPException as e:
+                result = AccountJobResult(
+                    tenant_id=request.tenant_id, account_id=request.account_id, status="failed", error=str(e.detail)
+                )
+            except Exception as e:
+                logger.error(f"Job {job.job_id}: reconciliation of {key} failed: {str(e)}", exc_info=True)
+                result = AccountJobResult(
+                    tenant_id=request.tenant_id, account_id=request.account_id, status="failed", error=str(e)
+                )
+            finally:
+                job.running.pop(key, None)
+
+        job.results.append(result)
+        if result.status == "completed":
+            job.completed_accounts += 1
+        else:
+            job.failed_accounts += 1
+
+    try:
+        await asyncio.gather(*(run_account(request) for request in accounts))
+    finally:
+        job.status = "completed"
+        job.finished_at = datetime.utcnow().isoformat()
+        job_tasks.pop(job.job_id, None)
+        logger.info(
+            f"Job {job.job_id}: {job.completed_accounts} accounts reconciled, {job.failed_accounts} failed"
+        )
+
+
+async def run_pending_ai_job(
+    job: ReconciliationJob,
+    request: ReconciliationRequest,
+    bank_txns: list,
+    gl_txns: List[GLTransaction],
+) -> None:
+    """
+    Finish the AI stage for bank lines left pending by a request deadline.
+
+    The result covers those lines only: their AI matches, the ones still
+    unmatched, and the GL entries left open.
+    """
+    job.status = "running"
+    key = f"{request.tenant_id}/{request.account_id}"
+    job.running[key] = "ai started"
+    start_time = datetime.utcnow()
+    try:
+        progress: asyncio.Queue = asyncio.Queue()
+        stats = StageStats()
+        ai_task = asyncio.create_task(ai_match_stage(bank_txns, gl_txns, request.ai_mode, progress, stats))
+        async for item in drain_progress(ai_task, progress):
+            job.running[key] = f"ai {item['completed']}/{item['total']}"
+        matches, _ = await ai_task
+        for match in matches:
+            reconciliation_counter.labels(match_quality=match.match_type).inc()
+
+        duration_ms = (datetime.utcnow() - start_time).total_seconds() * 1000
+        observe_stage({"stage": "ai", "duration_ms": duration_ms, "candidates": stats.candidates, "lines": stats.lines})
+        matched_bank_ids = {match.bank_transaction_id for match in matches}
+        matched_gl_ids = {match.gl_transaction_id for match in matches}
+        unmatched_bank = [txn.transaction_id for txn in bank_txns if txn.transaction_id not in matched_bank_ids]
+        result = AccountJobResult(
+            tenant_id=request.tenant_id,
+            account_id=request.account_id,
+            status="completed",
+            result=ReconciliationResponse(
+                account_id=request.account_id,
+                timestamp=datetime.utcnow().isoformat(),
+                matches=matches,
+                unmatched_bank=unmatched_bank,
+                unmatched_gl=[gl.entry_id for gl in gl_txns if gl.entry_id not in matched_gl_ids],
+                reconciliation_rate=reconciliation_rate_pct(len(bank_txns), len(unmatched_bank)),
+                processing_time_ms=duration_ms,
+                stage_timings_ms={"ai": duration_ms},
+            ),
+        )
+        job.completed_accounts += 1
+    except Exception as e:
+        logger.error(f"Job {job.job_id}: pending AI lines of {key} failed: {str(e)}", exc_info=True)
+        result = AccountJobResult(
+            tenant_id=request.tenant_id, account_id=request.account_id, status="failed", error=str(e)
+        )
+        job.failed_accounts += 1
+    finally:
+        job.running.pop(key, None)
+        job.status = "completed"
+        job.finished_at = datetime.utcnow().isoformat()
+        job_tasks.pop(job.job_id, None)
+
+    job.results.append(result)
+
+
+def start_pending_ai_job(
+    request: ReconciliationRequest,
+    bank_txns: list,
+    gl_txns: List[GLTransaction],
+    pending_ai: List[str],
+    unmatched_gl: List[str],
+) -> Optional[str]:
+    """Start a background job for the pending_ai lines of a request; returns its ID (None if nothing is pending)"""
+    if not pending_ai:
+        return None
+    pending_ids = set(pending_ai)
+    open_gl_ids = set(unmatched_gl)
+    job = ReconciliationJob(
+        job_id=str(uuid.uuid4()),
+        status="queued",
+        total_accounts=1,
+        created_at=datetime.utcnow().isoformat(),
+    )
+    store_job(job)
+    job_tasks[job.job_id] = asyncio.create_task(run_pending_ai_job(
+        job,
+        request,
+        [txn for txn in bank_txns if txn.transaction_id in pending_ids],
+        [gl_txns[row] for row, entry_id in enumerate(gl_entry_ids(gl_txns)) if entry_id in open_gl_ids],
+    ))
+    logger.info(f"Job {job.job_id}: finishing {len(pending_ai)} pending AI lines for {request.account_id}")
+    return job.job_id
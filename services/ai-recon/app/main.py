@@ -3,22 +3,86 @@ AIRP v2.0 - AI Bank Reconciliation Service
 Autonomous matching of bank transactions with GL entries
 """
 import os
+import csv
+import json
+import asyncio
 import logging
-from typing import List, Optional
+import uuid
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
-from pydantic import BaseModel, Field
-import anthropic
-import httpx
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-# Configure logging
+# Configure logging (before the service modules, which log while initializing)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+try:
+    from app.statement_ingest import StatementColumns, create_parser, detect_format
+    from app.models import (
+        BankTransaction,
+        ConfirmedMatch,
+        GLTransaction,
+        ReconciliationJob,
+        ReconciliationJobRequest,
+        ReconciliationRequest,
+        ReconciliationResponse,
+        SessionLinesRequest,
+        SessionResponse,
+    )
+    from app.stores import alias_store, session_locks, session_store, store_statement
+    from app.gl_source import resolve_gl_transactions
+    from app.ai_matching import AI_PROVIDER, ai_client
+    from app.pipeline import reconcile_stages, reconcile_transactions
+    from app.jobs import (
+        job_tasks,
+        reconcile_request,
+        reconciliation_jobs,
+        reconciliation_options,
+        reconciliation_rate_pct,
+        request_deadline,
+        resolve_bank_transactions,
+        run_reconciliation_job,
+        shutdown_job_executor,
+        start_pending_ai_job,
+        store_job,
+    )
+except ImportError:  # Running from inside app/ (python main.py)
+    from statement_ingest import StatementColumns, create_parser, detect_format
+    from models import (
+        BankTransaction,
+        ConfirmedMatch,
+        GLTransaction,
+        ReconciliationJob,
+        ReconciliationJobRequest,
+        ReconciliationRequest,
+        ReconciliationResponse,
+        SessionLinesRequest,
+        SessionResponse,
+    )
+    from stores import alias_store, session_locks, session_store, store_statement
+    from gl_source import resolve_gl_transactions
+    from ai_matching import AI_PROVIDER, ai_client
+    from pipeline import reconcile_stages, reconcile_transactions
+    from jobs import (
+        job_tasks,
+        reconcile_request,
+        reconciliation_jobs,
+        reconciliation_options,
+        reconciliation_rate_pct,
+        request_deadline,
+        resolve_bank_transactions,
+        run_reconciliation_job,
+        shutdown_job_executor,
+        start_pending_ai_job,
+        store_job,
+    )
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AIRP v2.0 - AI Bank Reconciliation",
@@ -35,317 +99,377 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Prometheus metrics
-reconciliation_counter = Counter(
-    "airp_ai_recon_reconciliations_total",
-    "Total reconciliations performed",
-    ["match_quality"],
-)
-reconciliation_duration = Histogram(
-    "airp_ai_recon_duration_seconds",
-    "Reconciliation duration",
-)
+# /reconcile/stream flushes buffered NDJSON records at stage boundaries or after this many matches
+STREAM_FLUSH_RECORDS = int(os.getenv("STREAM_FLUSH_RECORDS", "500"))
 
-# Initialize AI client
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
-AI_PROVIDER = os.getenv("AI_PROVIDER", "anthropic")
-
-if AI_PROVIDER == "anthropic" and ANTHROPIC_API_KEY and len(ANTHROPIC_API_KEY) > 10:
-    try:
-        # Create httpx client without proxies to avoid compatibility issues
-        http_client = httpx.Client(timeout=60.0)
-
-        # Initialize Anthropic client with custom httpx client
-        ai_client = anthropic.Anthropic(
-            api_key=ANTHROPIC_API_KEY,
-            http_client=http_client,
-            max_retries=2
-        )
-        logger.info("Initialized Anthropic Claude client")
-    except Exception as e:
-        ai_client = None
-        logger.warning(f"Failed to initialize Anthropic client: {e} - running in demo mode")
-else:
-    ai_client = None
-    logger.warning("No AI client initialized - running in demo mode")
 
 # ============================================
-# DATA MODELS
+# API ENDPOINTS
 # ============================================
 
-class BankTransaction(BaseModel):
-    transaction_id: str
-    transaction_date: str
-    description: str
-    amount: float
-    transaction_type: str  # debit or credit
-    reference_number: Optional[str] = None
-
+@app.get("/health")
+async def health_check():
+    """Health check endpoint"""
+    return {
+        "status": "healthy",
+        "service": "ai-recon",
+        "ai_provider": AI_PROVIDER,
+        "ai_available": ai_client is not None,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
 
-class GLTransaction(BaseModel):
-    entry_id: str
-    entry_date: str
-    description: str
-    amount: float
-    account_code: str
-    account_name: str
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-class ReconciliationRequest(BaseModel):
-    tenant_id: str = Field(..., description="Tenant UUID")
-    account_id: str = Field(..., description="Bank Account UUID")
-    bank_transactions: List[BankTransaction]
-    gl_transactions: List[GLTransaction]
 
+@app.post("/statements/upload")
+async def upload_statement(
+    request: Request,
+    tenant_id: str,
+    account_id: str,
+    statement_format: Optional[str] = Query(None, alias="format"),
+    filename: str = "",
+):
+    """
+    Stream a raw CSV, MT940 or CAMT.053 statement body into columnar storage.
+    The returned statement_id can be passed to /reconcile.
+    """
+    start_time = datetime.utcnow()
+    parser = None
 
-class TransactionMatch(BaseModel):
-    bank_transaction_id: str
-    gl_transaction_id: str
-    confidence_score: float = Field(..., ge=0.0, le=1.0)
-    match_reasoning: str
-    match_type: str  # exact, fuzzy, ai, manual
+    try:
+        # Chunks are parsed in a worker thread so large uploads do not block the event loop
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if parser is None:
+                statement_format = statement_format or detect_format(chunk, filename)
+                parser = create_parser(statement_format, StatementColumns())
+            await asyncio.to_thread(parser.feed, chunk)
+
+        if parser is None:
+            raise ValueError("Empty statement body")
+        columns = await asyncio.to_thread(parser.close)
+
+    except (ValueError, csv.Error, ET.ParseError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Statement parsing failed: {str(e)}",
+        )
 
+    statement_id = store_statement(tenant_id, account_id, columns)
+    processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
+    logger.info(f"Ingested statement {statement_id}: {len(columns)} lines in {processing_time:.0f}ms")
 
-class ReconciliationResponse(BaseModel):
-    account_id: str
-    timestamp: str
-    matches: List[TransactionMatch]
-    unmatched_bank: List[str]
-    unmatched_gl: List[str]
-    reconciliation_rate: float
-    processing_time_ms: float
+    return {
+        "statement_id": statement_id,
+        "account_id": account_id,
+        "format": statement_format,
+        "line_count": len(columns),
+        "approximate_bytes": columns.approximate_bytes(),
+        "processing_time_ms": processing_time,
+    }
 
 
-# ============================================
-# RECONCILIATION LOGIC
-# ============================================
+def server_timing(stage_timings_ms: Dict[str, float], total_ms: float) -> str:
+    """Server-Timing header value with one metric per stage plus the total"""
+    metrics = [f"{stage};dur={duration_ms:.1f}" for stage, duration_ms in stage_timings_ms.items()]
+    metrics.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(metrics)
 
-def exact_match(bank_txn: BankTransaction, gl_txns: List[GLTransaction]) -> Optional[TransactionMatch]:
-    """Find exact matches based on amount and date"""
-    for gl_txn in gl_txns:
-        if (abs(bank_txn.amount - gl_txn.amount) < 0.01 and
-            bank_txn.transaction_date == gl_txn.entry_date):
-            return TransactionMatch(
-                bank_transaction_id=bank_txn.transaction_id,
-                gl_transaction_id=gl_txn.entry_id,
-                confidence_score=1.0,
-                match_reasoning="Exact match on amount and date",
-                match_type="exact",
-            )
-    return None
-
-
-def fuzzy_match(bank_txn: BankTransaction, gl_txns: List[GLTransaction]) -> Optional[TransactionMatch]:
-    """Fuzzy matching based on amount tolerance and date range"""
-    best_match = None
-    best_score = 0.0
-
-    for gl_txn in gl_txns:
-        # Amount similarity (within 1%)
-        amount_diff = abs(bank_txn.amount - gl_txn.amount) / max(abs(bank_txn.amount), 0.01)
-        amount_score = 1.0 - min(amount_diff, 1.0)
-
-        # Description similarity (simple keyword matching)
-        bank_words = set(bank_txn.description.lower().split())
-        gl_words = set(gl_txn.description.lower().split())
-        common_words = bank_words.intersection(gl_words)
-        desc_score = len(common_words) / max(len(bank_words), 1) if bank_words else 0
-
-        # Combined score
-        score = (amount_score * 0.7) + (desc_score * 0.3)
-
-        if score > best_score and score > 0.75:
-            best_score = score
-            best_match = TransactionMatch(
-                bank_transaction_id=bank_txn.transaction_id,
-                gl_transaction_id=gl_txn.entry_id,
-                confidence_score=score,
-                match_reasoning=f"Fuzzy match: {int(score*100)}% similarity",
-                match_type="fuzzy",
-            )
-
-    return best_match
-
-
-async def ai_match(bank_txn: BankTransaction, gl_txns: List[GLTransaction]) -> Optional[TransactionMatch]:
-    """AI-powered matching for complex cases"""
-    if not ai_client:
-        return None
-
-    gl_context = "\n".join([
-        f"- ID: {gl.entry_id}, Date: {gl.entry_date}, Desc: {gl.description}, Amount: {gl.amount}"
-        for gl in gl_txns[:10]  # Limit to top 10 candidates
-    ])
-
-    prompt = f"""You are a bank reconciliation expert. Match this bank transaction to the most likely GL entry.
-
-Bank Transaction:
-- ID: {bank_txn.transaction_id}
-- Date: {bank_txn.transaction_date}
-- Description: {bank_txn.description}
-- Amount: {bank_txn.amount}
-
-Candidate GL Entries:
-{gl_context}
-
-If there's a confident match, respond in this exact JSON format:
-{{
-  "matched_gl_id": "entry_id",
-  "confidence": 0.95,
-  "reasoning": "Brief explanation"
-}}
-
-If no confident match exists, respond with:
-{{
-  "matched_gl_id": null,
-  "confidence": 0.0,
-  "reasoning": "No confident match found"
-}}
-"""
 
+@app.post("/reconcile", response_model=ReconciliationResponse)
+async def reconcile(request: ReconciliationRequest, response: Response):
+    """
+    Reconcile bank transactions with GL entries
+    """
     try:
-        message = ai_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=300,
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}],
-        )
-
-        response_text = message.content[0].text.strip()
+        result = await reconcile_request(request)
+        response.headers["Server-Timing"] = server_timing(result.stage_timings_ms, result.processing_time_ms)
+        return result
 
-        # Extract JSON from response
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Reconciliation failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Reconciliation failed: {str(e)}",
+        )
 
-        import json
-        result = json.loads(response_text)
 
-        if result.get("matched_gl_id") and result.get("confidence", 0) >= 0.8:
-            return TransactionMatch(
-                bank_transaction_id=bank_txn.transaction_id,
-                gl_transaction_id=result["matched_gl_id"],
-                confidence_score=result["confidence"],
-                match_reasoning=f"AI Match: {result['reasoning']}",
-                match_type="ai",
-            )
+def ndjson_record(event: dict) -> str:
+    record = dict(event)
+    if "match" in record:
+        record["match"] = record["match"].model_dump()
+    if "group_match" in record:
+        record["group_match"] = record["group_match"].model_dump()
+    return json.dumps(record) + "\n"
 
-    except Exception as e:
-        logger.error(f"AI matching failed: {str(e)}")
 
-    return None
+@app.post("/reconcile/stream")
+async def reconcile_stream(request: ReconciliationRequest):
+    """
+    Reconcile bank transactions with GL entries, streaming results as NDJSON.
 
+    Exact and fuzzy matches are sent as soon as their stage finishes, AI
+    progress while the model calls complete, and a final summary record
+    carries the reconciliation rate, unmatched IDs and stage timings.
+    """
+    start_time = datetime.utcnow()
+    deadline = request_deadline(request)
+    bank_txns = resolve_bank_transactions(request)
+    gl_txns = await resolve_gl_transactions(request, bank_txns)
+
+    async def generate_records() -> AsyncIterator[str]:
+        buffer: List[str] = []
+        try:
+            async for event in reconcile_stages(
+                bank_txns, gl_txns, deadline=deadline, **reconciliation_options(request)
+            ):
+                if event["type"] == "summary":
+                    event = {
+                        **event,
+                        "account_id": request.account_id,
+                        "timestamp": datetime.utcnow().isoformat(),
+                        "reconciliation_rate": reconciliation_rate_pct(len(bank_txns), len(event["unmatched_bank"])),
+                        "processing_time_ms": (datetime.utcnow() - start_time).total_seconds() * 1000,
+                        "pending_ai_job_id": start_pending_ai_job(
+                            request, bank_txns, gl_txns, event["pending_ai"], event["unmatched_gl"]
+                        ),
+                    }
+                buffer.append(ndjson_record(event))
+                # Flush at stage boundaries, on progress and every STREAM_FLUSH_RECORDS matches
+                if event["type"] not in ("match", "group_match") or len(buffer) >= STREAM_FLUSH_RECORDS:
+                    yield "".join(buffer)
+                    buffer = []
+        except Exception as e:
+            logger.error(f"Streaming reconciliation failed: {str(e)}", exc_info=True)
+            buffer.append(json.dumps({"type": "error", "detail": f"Reconciliation failed: {str(e)}"}) + "\n")
+        if buffer:
+            yield "".join(buffer)
+
+    return StreamingResponse(generate_records(), media_type="application/x-ndjson")
+
+
+async def match_session_lines(
+    session_id: str,
+    options: dict,
+    new_bank_ids: set,
+    new_gl_ids: set,
+) -> Tuple[int, int, Dict[str, float]]:
+    """
+    Match newly added session lines against everything still open.
 
-async def reconcile_transactions(bank_txns: List[BankTransaction], gl_txns: List[GLTransaction]) -> tuple:
-    """Hybrid reconciliation: exact → fuzzy → AI"""
-    matches = []
-    matched_bank_ids = set()
-    matched_gl_ids = set()
+    New bank lines are reconciled against all open GL entries, then the
+    older open bank lines against the new GL entries that are left. Pairs of
+    two older lines were already tried and are not scored (or sent to the
+    AI) again. Returns new match and group match counts and stage timings.
+    """
+    open_bank, open_gl = session_store.open_lines(session_id)
+    new_bank = [txn for txn in open_bank if txn.transaction_id in new_bank_ids]
+    old_bank = [txn for txn in open_bank if txn.transaction_id not in new_bank_ids]
+
+    match_count = 0
+    group_count = 0
+    stage_timings: Dict[str, float] = defaultdict(float)
+
+    async def run_pass(bank_txns: List[BankTransaction], gl_txns: List[GLTransaction]) -> set:
+        """Reconcile one pass, freeze its matches and return the GL IDs left open"""
+        nonlocal match_count, group_count
+        if not bank_txns or not gl_txns:
+            return {gl.entry_id for gl in gl_txns}
+        matches, group_matches, _, unmatched_gl, timings, _ = await reconcile_transactions(
+            bank_txns, gl_txns, **options
+        )
+        session_store.accept(session_id, matches, group_matches)
+        match_count += len(matches)
+        group_count += len(group_matches)
+        for stage, duration in timings.items():
+            stage_timings[stage] += duration
+        return set(unmatched_gl)
+
+    still_open_gl = await run_pass(new_bank, open_gl)
+    await run_pass(old_bank, [gl for gl in open_gl if gl.entry_id in new_gl_ids and gl.entry_id in still_open_gl])
+
+    return match_count, group_count, dict(stage_timings)
+
+
+def session_response(session_id: str, account_id: str, start_time: datetime, counts: tuple) -> SessionResponse:
+    state = session_store.state(session_id)
+    new_matches, new_group_matches, stage_timings = counts
+    return SessionResponse(
+        session_id=session_id,
+        account_id=account_id,
+        timestamp=datetime.utcnow().isoformat(),
+        matches=state["matches"],
+        group_matches=state["group_matches"],
+        unmatched_bank=state["unmatched_bank"],
+        unmatched_gl=state["unmatched_gl"],
+        reconciliation_rate=reconciliation_rate_pct(state["bank_count"], len(state["unmatched_bank"])),
+        processing_time_ms=(datetime.utcnow() - start_time).total_seconds() * 1000,
+        stage_timings_ms=stage_timings,
+        new_matches=new_matches,
+        new_group_matches=new_group_matches,
+    )
 
-    # Stage 1: Exact matches
-    for bank_txn in bank_txns:
-        available_gl = [gl for gl in gl_txns if gl.entry_id not in matched_gl_ids]
-        match = exact_match(bank_txn, available_gl)
 
-        if match:
-            matches.append(match)
-            matched_bank_ids.add(bank_txn.transaction_id)
-            matched_gl_ids.add(match.gl_transaction_id)
-            reconciliation_counter.labels(match_quality="exact").inc()
+def new_session_lines(session_id: Optional[str], bank_txns: Sequence, gl_txns: List[GLTransaction]) -> list:
+    """
+    Bank lines to add to a session as BankTransaction models.
 
-    # Stage 2: Fuzzy matches
-    unmatched_bank = [txn for txn in bank_txns if txn.transaction_id not in matched_bank_ids]
-    for bank_txn in unmatched_bank:
-        available_gl = [gl for gl in gl_txns if gl.entry_id not in matched_gl_ids]
-        match = fuzzy_match(bank_txn, available_gl)
+    Raises 409 when a line ID repeats within the call or, for an existing
+    session, is already in it; call before creating or changing the session.
+    """
+    bank_txns = [
+        txn if isinstance(txn, BankTransaction) else BankTransaction(**txn._asdict())
+        for txn in bank_txns
+    ]
+
+    bank_ids = [txn.transaction_id for txn in bank_txns]
+    gl_ids = [txn.entry_id for txn in gl_txns]
+    duplicates = [line_id for ids in (bank_ids, gl_ids) for line_id, count in Counter(ids).items() if count > 1]
+    if session_id is not None:
+        duplicates += session_store.existing_line_ids(session_id, "bank", bank_ids)
+        duplicates += session_store.existing_line_ids(session_id, "gl", gl_ids)
+    if duplicates:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=(
+                f"Lines already in session {session_id}: {sorted(duplicates)[:20]}" if session_id
+                else f"Duplicate line IDs: {sorted(duplicates)[:20]}"
+            ),
+        )
+    return bank_txns
 
-        if match:
-            matches.append(match)
-            matched_bank_ids.add(bank_txn.transaction_id)
-            matched_gl_ids.add(match.gl_transaction_id)
-            reconciliation_counter.labels(match_quality="fuzzy").inc()
 
-    # Stage 3: AI matches (for remaining unmatched)
-    unmatched_bank = [txn for txn in bank_txns if txn.transaction_id not in matched_bank_ids]
-    for bank_txn in unmatched_bank:
-        available_gl = [gl for gl in gl_txns if gl.entry_id not in matched_gl_ids]
-        if available_gl:
-            match = await ai_match(bank_txn, available_gl)
+async def add_session_lines(
+    session_id: str,
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+    options: dict,
+) -> tuple:
+    """Store lines checked by new_session_lines and match them"""
+    session_store.add_lines(session_id, bank_txns, gl_txns)
+    try:
+        return await match_session_lines(
+            session_id,
+            options,
+            {txn.transaction_id for txn in bank_txns},
+            {txn.entry_id for txn in gl_txns},
+        )
+    except Exception as e:
+        logger.error(f"Session reconciliation failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Reconciliation failed: {str(e)}",
+        )
 
-            if match:
-                matches.append(match)
-                matched_bank_ids.add(bank_txn.transaction_id)
-                matched_gl_ids.add(match.gl_transaction_id)
-                reconciliation_counter.labels(match_quality="ai").inc()
 
-    # Determine unmatched
-    unmatched_bank_ids = [txn.transaction_id for txn in bank_txns if txn.transaction_id not in matched_bank_ids]
-    unmatched_gl_ids = [txn.entry_id for txn in gl_txns if txn.entry_id not in matched_gl_ids]
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session(request: ReconciliationRequest):
+    """
+    Start an incremental reconciliation session and match its initial lines.
+    Matches accepted here are frozen; add late lines with /sessions/{id}/lines.
+    """
+    start_time = datetime.utcnow()
+    options = reconciliation_options(request)
+    bank_txns = resolve_bank_transactions(request)
+    gl_txns = await resolve_gl_transactions(request, bank_txns)
+    # Validated before the session exists, so a conflict leaves nothing behind
+    bank_txns = new_session_lines(None, bank_txns, gl_txns)
+    session_id = session_store.create(request.tenant_id, request.account_id, options)
 
-    return matches, unmatched_bank_ids, unmatched_gl_ids
+    async with session_locks.hold(session_id):
+        counts = await add_session_lines(session_id, bank_txns, gl_txns, options)
+        return session_response(session_id, request.account_id, start_time, counts)
 
 
-# ============================================
-# API ENDPOINTS
-# ============================================
+@app.post("/sessions/{session_id}/lines", response_model=SessionResponse)
+async def add_lines_to_session(session_id: str, request: SessionLinesRequest):
+    """
+    Add bank and/or GL lines to a session; only they are matched, against
+    the lines still open. Previously accepted matches are left untouched.
+    """
+    start_time = datetime.utcnow()
+    session = session_store.get(session_id, request.tenant_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Session {session_id} not found")
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "service": "ai-recon",
-        "ai_provider": AI_PROVIDER,
-        "ai_available": ai_client is not None,
-        "timestamp": datetime.utcnow().isoformat(),
-    }
+    async with session_locks.hold(session_id):
+        bank_txns = new_session_lines(session_id, resolve_bank_transactions(request), request.gl_transactions)
+        counts = await add_session_lines(session_id, bank_txns, request.gl_transactions, session["options"])
+        return session_response(session_id, session["account_id"], start_time, counts)
 
 
-@app.get("/metrics")
-async def metrics():
-    """Prometheus metrics endpoint"""
-    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str, tenant_id: str):
+    """Current matched and unmatched state of a session"""
+    start_time = datetime.utcnow()
+    session = session_store.get(session_id, tenant_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Session {session_id} not found")
+    return session_response(session_id, session["account_id"], start_time, (0, 0, {}))
 
 
-@app.post("/reconcile", response_model=ReconciliationResponse)
-async def reconcile(request: ReconciliationRequest):
+@app.post("/matches/confirm")
+async def confirm_matches(confirmed: List[ConfirmedMatch]):
     """
-    Reconcile bank transactions with GL entries
+    Record confirmed AI and manual matches as description aliases,
+    so the same wording is matched in the fuzzy stage next time
     """
-    start_time = datetime.utcnow()
-
     try:
-        matches, unmatched_bank, unmatched_gl = await reconcile_transactions(
-            request.bank_transactions,
-            request.gl_transactions,
-        )
-
-        processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
-
-        reconciliation_rate = (
-            len(matches) / len(request.bank_transactions) * 100
-            if request.bank_transactions else 0
-        )
+        learned = []
+        for match in confirmed:
+            key = alias_store.learn(match.tenant_id, match.bank_description, match.gl_description, match.match_type)
+            if key:
+                learned.append({"description_key": key, "alias": match.gl_description})
 
-        return ReconciliationResponse(
-            account_id=request.account_id,
-            timestamp=datetime.utcnow().isoformat(),
-            matches=matches,
-            unmatched_bank=unmatched_bank,
-            unmatched_gl=unmatched_gl,
-            reconciliation_rate=reconciliation_rate,
-            processing_time_ms=processing_time,
-        )
+        return {"status": "success", "learned": learned}
 
     except Exception as e:
-        logger.error(f"Reconciliation failed: {str(e)}", exc_info=True)
+        logger.error(f"Alias learning failed: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Reconciliation failed: {str(e)}",
+            detail=f"Alias learning failed: {str(e)}",
         )
 
 
+@app.get("/aliases")
+async def list_aliases(tenant_id: str):
+    """List learned description aliases for a tenant"""
+    return {"tenant_id": tenant_id, "aliases": alias_store.list_aliases(tenant_id)}
+
+
+@app.post("/jobs/reconcile", response_model=ReconciliationJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_reconciliation_job(request: ReconciliationJobRequest):
+    """
+    Start a batch reconciliation job over many (tenant, account) pairs.
+    Poll /jobs/{job_id} for progress and per-account results.
+    """
+    job = ReconciliationJob(
+        job_id=str(uuid.uuid4()),
+        status="queued",
+        total_accounts=len(request.accounts),
+        created_at=datetime.utcnow().isoformat(),
+    )
+    store_job(job)
+    job_tasks[job.job_id] = asyncio.create_task(run_reconciliation_job(job, request.accounts))
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=ReconciliationJob)
+async def get_reconciliation_job(job_id: str, since: int = 0):
+    """Job progress; results[since:] only, so pollers can fetch new account results incrementally"""
+    job = reconciliation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+    return job.model_copy(update={"results": job.results[since:], "running": dict(job.running)})
+
+
 # ============================================
 # STARTUP
 # ============================================
@@ -362,6 +486,11 @@ async def startup_event():
     logger.info("=" * 60)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_job_executor()
+
+
 if __name__ == "__main__":
     import uvicorn
 
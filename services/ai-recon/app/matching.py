@@ -0,0 +1,847 @@
+"""
+AIRP v2.0 - Deterministic Matching Stages
+Exact, reference, fuzzy, optimal assignment and split matching over TransactionColumns row indexes
+"""
+import os
+import re
+import time
+import logging
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    from app.models import GroupMatch, TransactionMatch
+    from app.columns import FUZZY_NGRAM_SIZE, NgramIndex, TransactionColumns, description_words, expand_ranges
+except ImportError:  # Running from inside app/ (python main.py)
+    from models import GroupMatch, TransactionMatch
+    from columns import FUZZY_NGRAM_SIZE, NgramIndex, TransactionColumns, description_words, expand_ranges
+
+logger = logging.getLogger(__name__)
+
+# Fuzzy matching configuration
+FUZZY_AMOUNT_WEIGHT = 0.7
+FUZZY_DESCRIPTION_WEIGHT = 0.3
+# Must stay above FUZZY_AMOUNT_WEIGHT: candidate lookups skip pairs without a shared description word
+FUZZY_SCORE_THRESHOLD = 0.75
+# Largest relative amount difference that can still clear the threshold with a perfect description score
+FUZZY_MAX_AMOUNT_DIFF = 1.0 - (FUZZY_SCORE_THRESHOLD - FUZZY_DESCRIPTION_WEIGHT) / FUZZY_AMOUNT_WEIGHT
+# Largest relative amount difference for a reference-number match (e.g. 0.02 tolerates bank fees)
+REFERENCE_MATCH_MAX_AMOUNT_DIFF = float(os.getenv("REFERENCE_MATCH_MAX_AMOUNT_DIFF", "0.02"))
+# Maximum days between bank and GL dates for fuzzy candidates (0 disables the date window)
+FUZZY_DATE_WINDOW_DAYS = int(os.getenv("FUZZY_DATE_WINDOW_DAYS", "0"))
+# Bank lines scored per NumPy block (bounds the size of the candidate pair arrays)
+VECTORIZED_FUZZY_BLOCK_SIZE = int(os.getenv("VECTORIZED_FUZZY_BLOCK_SIZE", "1024"))
+
+# Components larger than this (bank lines x GL entries) are assigned greedily by weight in optimal mode
+OPTIMAL_MAX_COMPONENT_CELLS = int(os.getenv("OPTIMAL_MAX_COMPONENT_CELLS", "4000000"))
+# Exact and fuzzy edges kept per bank line in optimal mode (best scores first); keeps the graph sparse
+OPTIMAL_MAX_CANDIDATES_PER_LINE = int(os.getenv("OPTIMAL_MAX_CANDIDATES_PER_LINE", "10"))
+
+# Split (one-to-many / many-to-one) matching configuration
+SPLIT_MATCH_MAX_PARTS = int(os.getenv("SPLIT_MATCH_MAX_PARTS", "5"))
+SPLIT_MATCH_DATE_WINDOW_DAYS = int(os.getenv("SPLIT_MATCH_DATE_WINDOW_DAYS", "7"))
+SPLIT_MATCH_MAX_CANDIDATES = int(os.getenv("SPLIT_MATCH_MAX_CANDIDATES", "30"))
+# Counterparty tokens a split candidate must share with the target (fewer when no candidate shares that
+# many); a shared reference number always qualifies
+SPLIT_MATCH_MIN_SHARED_TOKENS = int(os.getenv("SPLIT_MATCH_MIN_SHARED_TOKENS", "2"))
+# Hard time budget for the subset-sum search of a single group
+SPLIT_MATCH_TIME_BUDGET_MS = float(os.getenv("SPLIT_MATCH_TIME_BUDGET_MS", "50"))
+# Time budget for the whole split stage of one run (0 = no stage budget)
+SPLIT_MATCH_STAGE_BUDGET_MS = float(os.getenv("SPLIT_MATCH_STAGE_BUDGET_MS", "1000"))
+
+
+RowMatch = Tuple[int, int, TransactionMatch]  # (bank row, GL row, match)
+
+
+class StageStats:
+    """Candidate GL entries examined and bank lines looked up by one stage, for metrics"""
+
+    def __init__(self):
+        self.candidates = 0
+        self.lines = 0
+
+    def add(self, candidates: int, lines: int) -> None:
+        self.candidates += int(candidates)
+        self.lines += int(lines)
+
+
+def exact_key_ids(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Dense ids of the (amount, date) exact-match keys of bank and GL rows"""
+    keys = np.concatenate([
+        np.stack([bank.amounts_fils[bank_rows], bank.date_keys[bank_rows]], axis=1),
+        np.stack([gl.amounts_fils[gl_rows], gl.date_keys[gl_rows]], axis=1),
+    ])
+    _, key_ids = np.unique(keys, axis=0, return_inverse=True)
+    key_ids = key_ids.ravel()
+    return key_ids[:len(bank_rows)], key_ids[len(bank_rows):]
+
+
+def rank_within_key(keys: np.ndarray) -> np.ndarray:
+    """Occurrence number of each element among the elements with the same key, in input order"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[order] = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    return ranks
+
+
+def exact_stage(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    stats: Optional[StageStats] = None,
+) -> List[RowMatch]:
+    """
+    Exact matches on amount and date.
+
+    Bank lines take, in input order, the earliest free GL entry with the same
+    key; that is the k-th bank line of a key pairs with the k-th GL entry of
+    that key, which is computed with one sort and a join.
+    """
+    if len(bank_rows) == 0 or len(gl_rows) == 0:
+        return []
+
+    bank_keys, gl_keys = exact_key_ids(bank, bank_rows, gl, gl_rows)
+    if stats is not None:
+        stats.add(np.bincount(gl_keys, minlength=int(bank_keys.max()) + 1)[bank_keys].sum(), len(bank_rows))
+    stride = len(bank_rows) + len(gl_rows)
+    bank_slots = bank_keys * stride + rank_within_key(bank_keys)
+    gl_slots = gl_keys * stride + rank_within_key(gl_keys)
+
+    gl_order = np.argsort(gl_slots)
+    found_at = np.minimum(np.searchsorted(gl_slots, bank_slots, sorter=gl_order), len(gl_rows) - 1)
+    hit = gl_slots[gl_order[found_at]] == bank_slots
+
+    return [
+        (bank_row, gl_row, TransactionMatch(
+            bank_transaction_id=bank.ids[bank_row],
+            gl_transaction_id=gl.ids[gl_row],
+            confidence_score=1.0,
+            match_reasoning="Exact match on amount and date",
+            match_type="exact",
+        ))
+        for bank_row, gl_row in zip(bank_rows[hit].tolist(), gl_rows[gl_order[found_at[hit]]].tolist())
+    ]
+
+
+def normalize_reference(text: str) -> str:
+    """Reference number reduced to uppercase letters and digits (INV-2024/001 → INV2024001)"""
+    return re.sub(r"[^A-Z0-9]", "", text.upper())
+
+
+class ReferenceIndex:
+    """
+    Inverted index from normalized reference numbers to GL rows.
+
+    Keys are the GL entry_id and every description word that contains a
+    digit, normalized with normalize_reference; keys shorter than four
+    characters are too ambiguous to index.
+    """
+
+    MIN_KEY_LENGTH = 4
+
+    def __init__(self, gl: TransactionColumns, gl_rows: np.ndarray):
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for row in gl_rows.tolist():
+            keys = {normalize_reference(gl.ids[row])}
+            keys.update(
+                normalize_reference(word) for word in gl.descriptions[row].split()
+                if any(ch.isdigit() for ch in word)
+            )
+            for key in keys:
+                if len(key) >= self.MIN_KEY_LENGTH:
+                    self.postings[key].append(row)
+
+    def lookup(self, reference: Optional[str]) -> List[int]:
+        """GL rows carrying a reference number, in input order"""
+        if not reference:
+            return []
+        return self.postings.get(normalize_reference(reference), [])
+
+
+def reference_match_stage(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    stats: Optional[StageStats] = None,
+) -> List[RowMatch]:
+    """
+    Match bank lines to the GL entries that carry their reference number.
+
+    Among several hits the closest amount, then the closest date, then the
+    earliest GL entry wins; it is accepted when the amounts differ by at most
+    REFERENCE_MATCH_MAX_AMOUNT_DIFF (relative).
+    """
+    reference_index = ReferenceIndex(gl, gl_rows)
+    if not reference_index.postings:
+        return []
+
+    consumed = set()
+    matches = []
+    for bank_row in bank_rows.tolist():
+        reference = bank.references[bank_row]
+        hits = [gl_row for gl_row in reference_index.lookup(reference) if gl_row not in consumed]
+        if stats is not None and reference:
+            stats.add(len(hits), 1)
+        if not hits:
+            continue
+
+        bank_fils = int(bank.amounts_fils[bank_row])
+        bank_day = int(bank.days[bank_row])
+
+        def rank(gl_row: int) -> Tuple[int, int, int]:
+            gl_day = int(gl.days[gl_row])
+            day_gap = abs(gl_day - bank_day) if gl_day >= 0 and bank_day >= 0 else 0
+            return abs(int(gl.amounts_fils[gl_row]) - bank_fils), day_gap, gl_row
+
+        best = min(hits, key=rank)
+        amount_gap = abs(int(gl.amounts_fils[best]) - bank_fils)
+        amount_diff = amount_gap / max(abs(bank_fils), 1)
+        if amount_diff > REFERENCE_MATCH_MAX_AMOUNT_DIFF:
+            continue
+
+        consumed.add(best)
+        matches.append((bank_row, best, TransactionMatch(
+            bank_transaction_id=bank.ids[bank_row],
+            gl_transaction_id=gl.ids[best],
+            confidence_score=0.99 if amount_gap == 0 else 0.95,
+            match_reasoning=(
+                f"Reference {reference} found in GL entry"
+                + ("" if amount_gap == 0 else f", amount differs by {amount_diff:.1%}")
+            ),
+            match_type="reference",
+        )))
+
+    return matches
+
+
+def fuzzy_candidate_pairs(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    date_window_days: int = 0,
+    stats: Optional[StageStats] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Score blocked fuzzy candidate pairs with NumPy.
+
+    Candidates come from an inverted index over GL description tokens,
+    limited to the sorted-amount window that could still clear the fuzzy
+    threshold: each (bank line, token) looks up one contiguous range of
+    postings, and the number of hits per (bank line, GL entry) is the
+    description overlap. Pairs without a shared word score at most
+    FUZZY_AMOUNT_WEIGHT and are not generated by the word lookup.
+
+    Bank lines left without a passing candidate get a second lookup in a
+    character n-gram index (NgramIndex, built on first use): their
+    highest-weight n-grams add candidates inside the same amount window, and
+    the description score of their pairs becomes the larger of word overlap
+    and n-gram cosine similarity. Lines that already pass on words are
+    never re-scored, so the n-gram signal only costs time for lines that
+    would otherwise go to the AI stage. The check is per line, not per
+    assignment: a line whose only passing word candidate is then taken by a
+    better line gets no n-gram candidates and goes to the AI stage.
+    Extending the lookup to every line whose candidates are contested made
+    the fuzzy stage ~2.5x slower on the benchmark with no recall gain.
+
+    Yields (bank row, GL row, score) arrays per block, keeping only pairs
+    above the fuzzy threshold.
+    """
+    if len(bank_rows) == 0 or len(gl_rows) == 0:
+        return
+    if stats is not None:
+        stats.add(0, len(bank_rows))
+
+    n_gl = len(gl_rows)
+    bank_token_counts = np.diff(bank.token_offsets)
+
+    # Only tokens that occur in the bank lines can contribute to overlap
+    _, bank_tokens = bank.gather_tokens(bank_rows)
+    vocab_size = int(max(bank.token_ids.max(initial=-1), gl.token_ids.max(initial=-1))) + 1
+    in_bank = np.zeros(vocab_size, dtype=bool)
+    in_bank[bank_tokens] = True
+
+    gl_amounts = gl.amounts_fils[gl_rows]
+    gl_order = np.argsort(gl_amounts, kind="stable")
+    gl_sorted_amounts = gl_amounts[gl_order]
+    gl_sorted_pos = np.empty(n_gl, dtype=np.int64)
+    gl_sorted_pos[gl_order] = np.arange(n_gl)
+
+    # Inverted index as sorted (token * n_gl + amount-sorted GL position) keys: the postings
+    # of a token inside an amount window form one contiguous searchsorted range
+    gl_token_pos, gl_tokens = gl.gather_tokens(gl_rows)
+    keep = in_bank[gl_tokens]
+    posting_keys = np.sort(gl_tokens[keep] * n_gl + gl_sorted_pos[gl_token_pos[keep]])
+    if len(posting_keys) == 0 and FUZZY_NGRAM_SIZE <= 0:
+        return
+
+    ngrams: Optional[NgramIndex] = None
+    ngrams_built = FUZZY_NGRAM_SIZE <= 0
+
+    def lookup(keys: np.ndarray, probe_pos: np.ndarray, probe_ids: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+        """Sorted (position * n_gl + GL position) pair keys hit by the probes, with hits per pair"""
+        first = np.searchsorted(keys, probe_ids * n_gl + lo[probe_pos], side="left")
+        last = np.searchsorted(keys, probe_ids * n_gl + hi[probe_pos], side="left")
+        hit_counts = last - first
+        hit_pos = np.repeat(probe_pos, hit_counts)
+        hit_gl = keys[expand_ranges(first, hit_counts)] % n_gl
+        return np.unique(hit_pos * n_gl + hit_gl, return_counts=True)
+
+    def in_window(pair_rows: np.ndarray, pair_gl: np.ndarray) -> np.ndarray:
+        pair_bank_days = bank.days[pair_rows]
+        pair_gl_days = gl.days[pair_gl]
+        return (
+            (pair_bank_days < 0) | (pair_gl_days < 0)
+            | (np.abs(pair_bank_days - pair_gl_days) <= date_window_days)
+        )
+
+    def pair_scores(pair_rows: np.ndarray, pair_gl: np.ndarray, desc_score: np.ndarray) -> np.ndarray:
+        # Amount similarity (relative difference)
+        pair_amounts = bank.amounts_fils[pair_rows]
+        amount_diff = np.abs(pair_amounts - gl.amounts_fils[pair_gl]) / np.maximum(np.abs(pair_amounts), 1)
+        amount_score = 1.0 - np.minimum(amount_diff, 1.0)
+        return (amount_score * FUZZY_AMOUNT_WEIGHT) + (desc_score * FUZZY_DESCRIPTION_WEIGHT)
+
+    for start in range(0, len(bank_rows), VECTORIZED_FUZZY_BLOCK_SIZE):
+        rows = bank_rows[start:start + VECTORIZED_FUZZY_BLOCK_SIZE]
+        amounts = bank.amounts_fils[rows]
+        scale = np.maximum(np.abs(amounts), 1)
+
+        # Amount window per bank line, as amount-sorted GL positions [lo, hi)
+        lo = np.searchsorted(gl_sorted_amounts, amounts - FUZZY_MAX_AMOUNT_DIFF * scale, side="left")
+        hi = np.searchsorted(gl_sorted_amounts, amounts + FUZZY_MAX_AMOUNT_DIFF * scale, side="right")
+
+        # Hits per (bank line, GL entry) over the postings of the line's tokens = shared words
+        token_pos, tokens = bank.gather_tokens(rows)
+        pair_keys, common = lookup(posting_keys, token_pos, tokens, lo, hi)
+        pair_pos = pair_keys // n_gl
+        pair_rows = rows[pair_pos]
+        pair_gl = gl_rows[gl_order[pair_keys % n_gl]]
+
+        if date_window_days > 0:
+            window = in_window(pair_rows, pair_gl)
+            pair_keys, pair_pos, pair_rows, pair_gl, common = (
+                pair_keys[window], pair_pos[window], pair_rows[window], pair_gl[window], common[window]
+            )
+        if stats is not None:
+            stats.add(len(pair_rows), 0)
+
+        # Description similarity (share of bank words found in the GL description)
+        scores = pair_scores(pair_rows, pair_gl, common / bank_token_counts[pair_rows])
+        passing = scores > FUZZY_SCORE_THRESHOLD
+        block_rows, block_gl, block_scores = [pair_rows[passing]], [pair_gl[passing]], [scores[passing]]
+
+        # Lines without a passing word candidate get a second chance on character n-grams
+        fallback = np.ones(len(rows), dtype=bool)
+        fallback[pair_pos[passing]] = False
+        fallback_pos = np.flatnonzero(fallback)
+        if len(fallback_pos) and not ngrams_built:
+            ngrams_built = True
+            ngrams = NgramIndex.build([gl.descriptions[row] for row in gl_rows[gl_order]])
+        if len(fallback_pos) and ngrams is not None:
+            vectors = ngrams.vectors([bank.descriptions[row] for row in rows[fallback_pos]])
+            probe_pos, probe_ids = ngrams.probes(vectors)
+            ngram_keys, _ = lookup(ngrams.posting_keys, probe_pos, probe_ids, lo[fallback_pos], hi[fallback_pos])
+
+            # Word candidates of these lines are re-scored with n-gram similarity as well
+            local = np.full(len(rows), -1, dtype=np.int64)
+            local[fallback_pos] = np.arange(len(fallback_pos))
+            is_fallback = fallback[pair_pos]
+            word_keys = local[pair_pos[is_fallback]] * n_gl + pair_keys[is_fallback] % n_gl
+            fallback_keys = np.union1d(ngram_keys, word_keys)
+            fallback_common = np.zeros(len(fallback_keys), dtype=np.int64)
+            fallback_common[np.searchsorted(fallback_keys, word_keys)] = common[is_fallback]
+
+            fallback_rows = rows[fallback_pos[fallback_keys // n_gl]]
+            fallback_gl = gl_rows[gl_order[fallback_keys % n_gl]]
+            if date_window_days > 0:
+                window = in_window(fallback_rows, fallback_gl)
+                fallback_keys, fallback_rows, fallback_gl, fallback_common = (
+                    fallback_keys[window], fallback_rows[window], fallback_gl[window], fallback_common[window]
+                )
+            if stats is not None:
+                stats.add(len(fallback_keys) - len(word_keys), 0)
+
+            desc_score = np.maximum(
+                fallback_common / np.maximum(bank_token_counts[fallback_rows], 1),
+                ngrams.cosine(vectors, fallback_keys // n_gl, fallback_keys % n_gl),
+            )
+            scores = pair_scores(fallback_rows, fallback_gl, desc_score)
+            passing = scores > FUZZY_SCORE_THRESHOLD
+            block_rows.append(fallback_rows[passing])
+            block_gl.append(fallback_gl[passing])
+            block_scores.append(scores[passing])
+
+        block_rows = np.concatenate(block_rows)
+        if len(block_rows):
+            yield block_rows, np.concatenate(block_gl), np.concatenate(block_scores)
+
+
+def fuzzy_stage(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    date_window_days: int = 0,
+    stats: Optional[StageStats] = None,
+) -> List[RowMatch]:
+    """
+    Fuzzy matches on amount tolerance and description overlap.
+
+    Bank lines are assigned in input order, each taking its best-scoring GL
+    entry that is still free (ties go to the earliest GL entry).
+    """
+    consumed = np.zeros(len(gl), dtype=bool)
+    matches = []
+
+    for pair_rows, pair_gl, scores in fuzzy_candidate_pairs(bank, bank_rows, gl, gl_rows, date_window_days, stats):
+        # Rank candidates per bank line: best score first, earliest GL entry on ties
+        order = np.lexsort((pair_gl, -scores, pair_rows))
+        pair_rows, pair_gl, scores = pair_rows[order], pair_gl[order], scores[order]
+        group_starts = np.flatnonzero(np.r_[True, pair_rows[1:] != pair_rows[:-1]])
+        group_ends = np.r_[group_starts[1:], len(pair_rows)]
+
+        for group_start, group_end in zip(group_starts.tolist(), group_ends.tolist()):
+            # Usually the top candidate is free; only walk further on conflicts
+            for pos in range(group_start, group_end):
+                gl_row = int(pair_gl[pos])
+                if consumed[gl_row]:
+                    continue
+                consumed[gl_row] = True
+                bank_row = int(pair_rows[pos])
+                score = float(scores[pos])
+                matches.append((bank_row, gl_row, TransactionMatch(
+                    bank_transaction_id=bank.ids[bank_row],
+                    gl_transaction_id=gl.ids[gl_row],
+                    confidence_score=score,
+                    match_reasoning=f"Fuzzy match: {int(score*100)}% similarity",
+                    match_type="fuzzy",
+                )))
+                break
+
+    return matches
+
+
+def optimal_assignment(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    date_window_days: int = 0,
+    stats: Optional[StageStats] = None,
+) -> List[RowMatch]:
+    """
+    Globally optimal exact + fuzzy matching.
+
+    Builds the sparse bipartite graph of blocked candidate pairs (exact pairs
+    weigh 1.0, fuzzy pairs their fuzzy score) and solves a maximum-weight
+    matching on each connected component separately, so the result does not
+    depend on input order. Graph nodes are positions in bank_rows / gl_rows.
+    """
+    if len(bank_rows) == 0 or len(gl_rows) == 0:
+        return []
+
+    # Exact edges: up to OPTIMAL_MAX_CANDIDATES_PER_LINE GL entries sharing the bank line's
+    # (amount, date) key. They are interchangeable, so the k-th bank line of a key takes the
+    # entries from the k-th one on (wrapping around); the k-th ↔ k-th pairing of exact_stage
+    # stays in the graph while repeated keys add at most the cap in edges per line
+    bank_keys, gl_keys = exact_key_ids(bank, bank_rows, gl, gl_rows)
+    gl_key_order = np.argsort(gl_keys, kind="stable")
+    sorted_gl_keys = gl_keys[gl_key_order]
+    first = np.searchsorted(sorted_gl_keys, bank_keys, side="left")
+    counts = np.searchsorted(sorted_gl_keys, bank_keys, side="right") - first
+    kept = np.minimum(counts, OPTIMAL_MAX_CANDIDATES_PER_LINE)
+    exact_rows = np.repeat(np.arange(len(bank_rows)), kept)
+    offsets = np.repeat(rank_within_key(bank_keys), kept) + expand_ranges(np.zeros_like(kept), kept)
+    exact_gl = gl_key_order[np.repeat(first, kept) + offsets % np.repeat(np.maximum(counts, 1), kept)]
+    if stats is not None:
+        stats.add(len(exact_rows), 0)
+
+    edge_rows = [exact_rows]
+    edge_gl = [exact_gl]
+    edge_weights = [np.ones(len(exact_rows))]
+
+    # Fuzzy edges, keeping the best OPTIMAL_MAX_CANDIDATES_PER_LINE per bank line
+    for pair_rows, pair_gl, scores in fuzzy_candidate_pairs(bank, bank_rows, gl, gl_rows, date_window_days, stats):
+        pair_rows = np.searchsorted(bank_rows, pair_rows)
+        pair_gl = np.searchsorted(gl_rows, pair_gl)
+        order = np.lexsort((pair_gl, -scores, pair_rows))
+        pair_rows, pair_gl, scores = pair_rows[order], pair_gl[order], scores[order]
+        group_starts = np.flatnonzero(np.r_[True, pair_rows[1:] != pair_rows[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(pair_rows)])
+        rank = np.arange(len(pair_rows)) - np.repeat(group_starts, group_sizes)
+        keep = rank < OPTIMAL_MAX_CANDIDATES_PER_LINE
+        edge_rows.append(pair_rows[keep])
+        edge_gl.append(pair_gl[keep])
+        edge_weights.append(scores[keep])
+
+    edge_rows = np.concatenate(edge_rows)
+    edge_gl = np.concatenate(edge_gl)
+    edge_weights = np.concatenate(edge_weights)
+    if len(edge_rows) == 0:
+        return []
+
+    # A pair can be both exact and fuzzy; keep the exact edge (listed first)
+    _, first = np.unique(edge_rows * len(gl_rows) + edge_gl, return_index=True)
+    is_exact = first < len(exact_rows)
+    edge_rows, edge_gl, edge_weights = edge_rows[first], edge_gl[first], edge_weights[first]
+
+    # Connected components over bank nodes [0, n_bank) and GL nodes [n_bank, n_bank + n_gl)
+    n_bank = len(bank_rows)
+    n_nodes = n_bank + len(gl_rows)
+    graph = coo_matrix(
+        (np.ones(len(edge_rows), dtype=np.int8), (edge_rows, edge_gl + n_bank)),
+        shape=(n_nodes, n_nodes),
+    )
+    _, labels = connected_components(graph, directed=False)
+    edge_components = labels[edge_rows]
+
+    order = np.argsort(edge_components, kind="stable")
+    bounds = np.flatnonzero(np.r_[True, edge_components[order][1:] != edge_components[order][:-1], True])
+
+    chosen = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        component = order[start:end]
+        if len(component) == 1:
+            chosen.append(int(component[0]))
+            continue
+
+        rows, row_pos = np.unique(edge_rows[component], return_inverse=True)
+        cols, col_pos = np.unique(edge_gl[component], return_inverse=True)
+
+        if len(rows) * len(cols) <= OPTIMAL_MAX_COMPONENT_CELLS:
+            weights = np.zeros((len(rows), len(cols)))
+            edge_at = np.full((len(rows), len(cols)), -1, dtype=np.int64)
+            weights[row_pos, col_pos] = edge_weights[component]
+            edge_at[row_pos, col_pos] = component
+            assigned_rows, assigned_cols = linear_sum_assignment(weights, maximize=True)
+            assigned = edge_at[assigned_rows, assigned_cols]
+            chosen.extend(int(edge) for edge in assigned if edge >= 0)
+        else:
+            logger.warning(
+                f"Optimal assignment component of {len(rows)}x{len(cols)} exceeds "
+                f"{OPTIMAL_MAX_COMPONENT_CELLS} cells - assigning by descending weight"
+            )
+            used_rows, used_cols = set(), set()
+            for edge in component[np.argsort(-edge_weights[component], kind="stable")].tolist():
+                if edge_rows[edge] in used_rows or edge_gl[edge] in used_cols:
+                    continue
+                used_rows.add(edge_rows[edge])
+                used_cols.add(edge_gl[edge])
+                chosen.append(edge)
+
+    matches = []
+    for edge in sorted(chosen, key=lambda edge: edge_rows[edge]):
+        bank_row = int(bank_rows[edge_rows[edge]])
+        gl_row = int(gl_rows[edge_gl[edge]])
+        if is_exact[edge]:
+            match = TransactionMatch(
+                bank_transaction_id=bank.ids[bank_row],
+                gl_transaction_id=gl.ids[gl_row],
+                confidence_score=1.0,
+                match_reasoning="Exact match on amount and date",
+                match_type="exact",
+            )
+        else:
+            score = float(edge_weights[edge])
+            match = TransactionMatch(
+                bank_transaction_id=bank.ids[bank_row],
+                gl_transaction_id=gl.ids[gl_row],
+                confidence_score=score,
+                match_reasoning=f"Fuzzy match: {int(score*100)}% similarity (optimal assignment)",
+                match_type="fuzzy",
+            )
+        matches.append((bank_row, gl_row, match))
+
+    return matches
+
+
+def counterparty_tokens(description: str) -> set:
+    """Alphabetic description words long enough to identify a counterparty"""
+    return {word for word in description_words(description) if len(word) > 2 and word.isalpha()}
+
+
+def subset_sum(target: int, amounts: List[int], max_parts: int, deadline: float) -> Optional[List[int]]:
+    """
+    Find positions of 2..max_parts amounts (positive integer fils) summing to target.
+
+    Depth-first search over amounts in descending order, pruned by the sum of
+    the largest remaining amounts. Gives up (returns None) once the deadline
+    (a time.perf_counter() value) has passed.
+    """
+    order = sorted(range(len(amounts)), key=lambda pos: -amounts[pos])
+    values = [amounts[pos] for pos in order]
+    chosen: List[int] = []
+    nodes = 0
+
+    def search(start: int, remaining: int) -> bool:
+        nonlocal nodes
+        if remaining == 0:
+            return len(chosen) >= 2
+        slots = max_parts - len(chosen)
+        if slots == 0:
+            return False
+        # Values are sorted descending, so the next `slots` values are the largest still usable
+        if sum(values[start:start + slots]) < remaining:
+            return False
+
+        for pos in range(start, len(values)):
+            nodes += 1
+            if nodes % 256 == 0 and time.perf_counter() > deadline:
+                raise TimeoutError
+            value = values[pos]
+            if value > remaining:
+                continue
+            if pos > start and value == values[pos - 1]:
+                continue  # Same amount as a sibling already tried
+            if value * slots < remaining:
+                return False  # Even repeating this value cannot reach the target
+            chosen.append(pos)
+            if search(pos + 1, remaining - value):
+                return True
+            chosen.pop()
+        return False
+
+    try:
+        if search(0, target):
+            return [order[pos] for pos in chosen]
+    except TimeoutError:
+        pass
+    return None
+
+
+SplitCandidate = Tuple[int, Optional[int], frozenset, int]  # (fils, day ordinal, evidence keys, row)
+
+
+def split_reference_keys(columns: TransactionColumns, row: int, include_id: bool) -> set:
+    """Normalized reference numbers of a row: its reference, digit-bearing description words and optionally its id"""
+    texts = [word for word in columns.descriptions[row].split() if any(ch.isdigit() for ch in word)]
+    if columns.references[row]:
+        texts.append(columns.references[row])
+    if include_id:
+        texts.append(columns.ids[row])
+    keys = {normalize_reference(text) for text in texts}
+    return {key for key in keys if len(key) >= ReferenceIndex.MIN_KEY_LENGTH}
+
+
+def split_candidates(
+    columns: TransactionColumns,
+    rows: np.ndarray,
+    counterparty_mask: np.ndarray,
+    include_ids: bool,
+    aliased: Optional[TransactionColumns] = None,
+) -> List[SplitCandidate]:
+    """
+    Precompute the split-matching view of some rows.
+
+    Evidence keys are counterparty token ids (ints) and normalized reference
+    numbers (strings); with `aliased` (the same rows with learned alias
+    descriptions) the alias tokens count as evidence too.
+    """
+    token_pos, tokens = columns.gather_tokens(rows)
+    if aliased is not None:
+        alias_pos, alias_tokens = aliased.gather_tokens(rows)
+        token_pos, tokens = np.concatenate([token_pos, alias_pos]), np.concatenate([tokens, alias_tokens])
+        order = np.argsort(token_pos, kind="stable")
+        token_pos, tokens = token_pos[order], tokens[order]
+    keep = counterparty_mask[tokens]
+    token_pos, tokens = token_pos[keep], tokens[keep]
+    bounds = np.searchsorted(token_pos, np.arange(len(rows) + 1)).tolist()
+    tokens = tokens.tolist()
+    return [
+        (
+            fils,
+            day if day >= 0 else None,
+            frozenset(tokens[bounds[pos]:bounds[pos + 1]]) | split_reference_keys(columns, row, include_ids),
+            row,
+        )
+        for pos, (row, fils, day) in enumerate(zip(
+            rows.tolist(), columns.amounts_fils[rows].tolist(), columns.days[rows].tolist(),
+        ))
+    ]
+
+
+class SplitEvidenceIndex:
+    """
+    Split candidates posted under each of their evidence keys.
+
+    Every posting list is sorted by day ordinal with undated candidates last,
+    so the candidates of a key inside a date window are found by bisection.
+    """
+
+    def __init__(self, candidates: List[SplitCandidate]):
+        postings: Dict[object, List[SplitCandidate]] = defaultdict(list)
+        for candidate in candidates:
+            for key in candidate[2]:
+                postings[key].append(candidate)
+        self.postings: Dict[object, Tuple[List[SplitCandidate], List[int]]] = {}
+        for key, items in postings.items():
+            dated = sorted((item for item in items if item[1] is not None), key=lambda item: item[1])
+            self.postings[key] = (dated + [item for item in items if item[1] is None], [item[1] for item in dated])
+
+    def related(self, target: SplitCandidate) -> Dict[int, SplitCandidate]:
+        """Candidates sharing an evidence key with the target inside its date window, by row"""
+        _, target_day, target_keys, _ = target
+        found: Dict[int, SplitCandidate] = {}
+        for key in target_keys:
+            posting = self.postings.get(key)
+            if posting is None:
+                continue
+            items, days = posting
+            if target_day is None:
+                in_range = items
+            else:
+                lo = bisect_left(days, target_day - SPLIT_MATCH_DATE_WINDOW_DAYS)
+                hi = bisect_right(days, target_day + SPLIT_MATCH_DATE_WINDOW_DAYS)
+                in_range = items[lo:hi] + items[len(days):]
+            for item in in_range:
+                found[item[3]] = item
+        return found
+
+
+def find_split_group(
+    target: SplitCandidate,
+    index: SplitEvidenceIndex,
+    used: set,
+    deadline: float,
+) -> Optional[Tuple[List[int], str]]:
+    """
+    Find related candidates that together sum to the target transaction's amount.
+
+    Only unused, same-sign candidates inside the date window that share a
+    reference number or counterparty tokens with the target are considered,
+    nearest dates first, so unrelated lines are not grouped by a coincidental
+    sum. When some candidates share SPLIT_MATCH_MIN_SHARED_TOKENS tokens,
+    candidates sharing fewer are dropped. The search stops at the earlier of the per-group budget
+    and `deadline` (a time.perf_counter() value).
+    Returns (candidate rows, evidence description) or None.
+    """
+    target_fils, target_day, target_keys, _ = target
+    if target_fils == 0:
+        return None
+    sign = 1 if target_fils > 0 else -1
+
+    window = []
+    for candidate in index.related(target).values():
+        fils, day, keys, row = candidate
+        fils *= sign
+        if row in used or fils <= 0 or fils >= abs(target_fils):
+            continue
+        shared = target_keys & keys
+        shared_tokens = sum(isinstance(key, int) for key in shared)
+        # A shared reference number outranks any number of shared words
+        strength = SPLIT_MATCH_MIN_SHARED_TOKENS if shared_tokens < len(shared) else shared_tokens
+        distance = abs(day - target_day) if day is not None and target_day is not None else SPLIT_MATCH_DATE_WINDOW_DAYS
+        window.append((distance, row, candidate, fils, strength))
+    if not window:
+        return None
+
+    # Drop candidates related only by a word that stronger candidates share with more
+    min_strength = min(SPLIT_MATCH_MIN_SHARED_TOKENS, max(item[4] for item in window))
+    window = [item for item in window if item[4] >= min_strength]
+    if len(window) < 2:
+        return None
+
+    window.sort(key=lambda item: item[:2])
+    window = window[:SPLIT_MATCH_MAX_CANDIDATES]
+
+    deadline = min(deadline, time.perf_counter() + SPLIT_MATCH_TIME_BUDGET_MS / 1000)
+    found = subset_sum(abs(target_fils), [item[3] for item in window], SPLIT_MATCH_MAX_PARTS, deadline)
+    if not found:
+        return None
+    group = [window[pos][2] for pos in found]
+    shares_counterparty = any(isinstance(key, int) for item in group for key in target_keys & item[2])
+    return sorted(item[3] for item in group), "same counterparty" if shares_counterparty else "shared reference"
+
+
+def split_match_stage(
+    bank: TransactionColumns,
+    bank_rows: np.ndarray,
+    gl: TransactionColumns,
+    gl_rows: np.ndarray,
+    counterparty_mask: np.ndarray,
+    aliased_bank: Optional[TransactionColumns] = None,
+) -> List[Tuple[List[int], List[int], GroupMatch]]:
+    """
+    Match batched payments: one bank line against several GL entries
+    (split_bank) and several bank lines against one GL entry (split_gl).
+
+    Only lines related by a counterparty token, learned alias or reference
+    number are grouped. The whole stage stops after SPLIT_MATCH_STAGE_BUDGET_MS
+    (0 = no stage budget). Returns (bank rows, GL rows, group match) tuples.
+    """
+    deadline = (
+        time.perf_counter() + SPLIT_MATCH_STAGE_BUDGET_MS / 1000 if SPLIT_MATCH_STAGE_BUDGET_MS > 0 else float("inf")
+    )
+    bank_view = split_candidates(bank, bank_rows, counterparty_mask, include_ids=False, aliased=aliased_bank)
+    gl_view = split_candidates(gl, gl_rows, counterparty_mask, include_ids=True)
+    bank_index = SplitEvidenceIndex(bank_view)
+    gl_index = SplitEvidenceIndex(gl_view)
+    used_bank: set = set()
+    used_gl: set = set()
+    group_matches = []
+
+    def out_of_time(remaining: int) -> bool:
+        if time.perf_counter() <= deadline:
+            return False
+        logger.warning(
+            f"Split matching stopped after {SPLIT_MATCH_STAGE_BUDGET_MS:.0f} ms with {remaining} lines not searched"
+        )
+        return True
+
+    # One bank line → several GL entries
+    for pos, bank_item in enumerate(bank_view):
+        if out_of_time(len(bank_view) - pos + len(gl_view)):
+            return group_matches
+        found = find_split_group(bank_item, gl_index, used_gl, deadline)
+        if not found:
+            continue
+        gl_group, evidence = found
+        bank_row = bank_item[3]
+        used_bank.add(bank_row)
+        used_gl.update(gl_group)
+        group_matches.append(([bank_row], gl_group, GroupMatch(
+            bank_transaction_ids=[bank.ids[bank_row]],
+            gl_transaction_ids=[gl.ids[row] for row in gl_group],
+            confidence_score=0.9,
+            match_reasoning=f"Split match: {len(gl_group)} GL entries sum to {bank.amount(bank_row):.2f} ({evidence})",
+            match_type="split_bank",
+        )))
+
+    # Several bank lines → one GL entry
+    for pos, gl_item in enumerate(gl_view):
+        if gl_item[3] in used_gl:
+            continue
+        if out_of_time(len(gl_view) - pos):
+            return group_matches
+        found = find_split_group(gl_item, bank_index, used_bank, deadline)
+        if not found:
+            continue
+        bank_group, evidence = found
+        gl_row = gl_item[3]
+        used_gl.add(gl_row)
+        used_bank.update(bank_group)
+        group_matches.append((bank_group, [gl_row], GroupMatch(
+            bank_transaction_ids=[bank.ids[row] for row in bank_group],
+            gl_transaction_ids=[gl.ids[gl_row]],
+            confidence_score=0.9,
+            match_reasoning=f"Split match: {len(bank_group)} bank lines sum to {gl.amount(gl_row):.2f} ({evidence})",
+            match_type="split_gl",
+        )))
+
+    return group_matches
@@ -0,0 +1,43 @@
+"""
+AIRP v2.0 - Bank Reconciliation Metrics
+Prometheus metrics recorded by the matching stages, the AI stage and the endpoints
+"""
+from prometheus_client import Counter, Histogram
+
+# Prometheus metrics
+reconciliation_counter = Counter(
+    "airp_ai_recon_reconciliations_total",
+    "Total reconciliations performed",
+    ["match_quality"],
+)
+reconciliation_duration = Histogram(
+    "airp_ai_recon_duration_seconds",
+    "Reconciliation duration",
+)
+stage_duration = Histogram(
+    "airp_ai_recon_stage_duration_seconds",
+    "Reconciliation stage duration",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+# candidates_examined / bank_lines_examined = candidate GL entries examined per bank line
+candidates_examined = Counter(
+    "airp_ai_recon_candidates_examined_total",
+    "Candidate GL entries examined by a matching stage",
+    ["stage"],
+)
+bank_lines_examined = Counter(
+    "airp_ai_recon_bank_lines_examined_total",
+    "Bank lines looked up by a matching stage",
+    ["stage"],
+)
+ai_calls = Counter(
+    "airp_ai_recon_ai_calls_total",
+    "AI calls made and failed, and bank lines skipped without a call",
+    ["outcome"],
+)
+ai_tokens = Counter(
+    "airp_ai_recon_ai_tokens_total",
+    "AI tokens used",
+    ["direction"],
+)
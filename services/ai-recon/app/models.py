@@ -0,0 +1,134 @@
+"""
+AIRP v2.0 - Bank Reconciliation Models
+Request, response and transaction models shared by the ai-recon modules
+"""
+from typing import Dict, List, Literal, Optional
+from datetime import date
+
+from pydantic import BaseModel, Field
+
+
+class BankTransaction(BaseModel):
+    transaction_id: str
+    transaction_date: str
+    description: str
+    amount: float
+    transaction_type: str  # debit or credit
+    reference_number: Optional[str] = None
+
+
+class GLTransaction(BaseModel):
+    entry_id: str
+    entry_date: str
+    description: str
+    amount: float
+    account_code: str
+    account_name: str
+
+
+class ReconciliationRequest(BaseModel):
+    tenant_id: str = Field(..., description="Tenant UUID")
+    account_id: str = Field(..., description="Bank Account UUID")
+    bank_transactions: List[BankTransaction] = []
+    statement_id: Optional[str] = Field(
+        None, description="Use a statement uploaded via /statements/upload instead of bank_transactions"
+    )
+    gl_transactions: List[GLTransaction] = []
+    gl_source: Literal["request", "database"] = Field(
+        "request", description="database: load open GL lines for account_id instead of gl_transactions"
+    )
+    gl_date_from: Optional[date] = Field(None, description="Earliest GL entry date (database source)")
+    gl_date_to: Optional[date] = Field(None, description="Latest GL entry date (database source)")
+    fuzzy_date_window_days: Optional[int] = Field(
+        None, ge=0, description="Max days between bank and GL dates for fuzzy matches (0 disables)"
+    )
+    assignment: Literal["greedy", "optimal"] = Field(
+        "greedy", description="greedy: first bank line wins; optimal: maximum-weight matching"
+    )
+    split_matching: bool = Field(
+        False, description="Match one-to-many and many-to-one splits between lines sharing a counterparty or reference"
+    )
+    ai_mode: Optional[Literal["single", "batched"]] = Field(
+        None, description="AI stage mode (defaults to AI_MATCH_MODE)"
+    )
+    use_aliases: bool = Field(True, description="Apply learned description aliases in the fuzzy stage")
+    deadline_ms: Optional[int] = Field(
+        None, gt=0,
+        description="Return partial results after this long; unfinished AI lines are finished in a background job",
+    )
+
+
+class TransactionMatch(BaseModel):
+    bank_transaction_id: str
+    gl_transaction_id: str
+    confidence_score: float = Field(..., ge=0.0, le=1.0)
+    match_reasoning: str
+    match_type: str  # exact, reference, fuzzy, ai, manual
+
+
+class GroupMatch(BaseModel):
+    bank_transaction_ids: List[str]
+    gl_transaction_ids: List[str]
+    confidence_score: float = Field(..., ge=0.0, le=1.0)
+    match_reasoning: str
+    match_type: str  # split_bank (one bank line, many GL), split_gl (many bank lines, one GL)
+
+
+class ConfirmedMatch(BaseModel):
+    tenant_id: str = Field(..., description="Tenant UUID")
+    bank_description: str
+    gl_description: str
+    match_type: Literal["ai", "manual"]
+
+
+class ReconciliationResponse(BaseModel):
+    account_id: str
+    timestamp: str
+    matches: List[TransactionMatch]
+    group_matches: List[GroupMatch] = []
+    unmatched_bank: List[str]
+    unmatched_gl: List[str]
+    reconciliation_rate: float
+    processing_time_ms: float
+    stage_timings_ms: Dict[str, float] = {}
+    pending_ai: List[str] = Field([], description="Unmatched bank lines whose AI matching was cut off by the deadline")
+    pending_ai_job_id: Optional[str] = Field(None, description="Job finishing the pending_ai lines (poll /jobs/{id})")
+
+
+class ReconciliationJobRequest(BaseModel):
+    accounts: List[ReconciliationRequest] = Field(..., min_length=1, description="One entry per (tenant, account)")
+
+
+class AccountJobResult(BaseModel):
+    tenant_id: str
+    account_id: str
+    status: Literal["completed", "failed"]
+    result: Optional[ReconciliationResponse] = None
+    error: Optional[str] = None
+
+
+class ReconciliationJob(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "completed"]
+    total_accounts: int
+    completed_accounts: int = 0
+    failed_accounts: int = 0
+    running: Dict[str, str] = Field({}, description="tenant_id/account_id → latest stage progress")
+    results: List[AccountJobResult] = Field([], description="Per-account results in completion order")
+    created_at: str
+    finished_at: Optional[str] = None
+
+
+class SessionLinesRequest(BaseModel):
+    tenant_id: str = Field(..., description="Tenant UUID")
+    bank_transactions: List[BankTransaction] = []
+    statement_id: Optional[str] = Field(
+        None, description="Use a statement uploaded via /statements/upload instead of bank_transactions"
+    )
+    gl_transactions: List[GLTransaction] = []
+
+
+class SessionResponse(ReconciliationResponse):
+    session_id: str
+    new_matches: int = 0
+    new_group_matches: int = 0
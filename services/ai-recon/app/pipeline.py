@@ -0,0 +1,339 @@
+"""
+AIRP v2.0 - Reconciliation Pipeline
+Runs the deterministic stages and the AI stage as one stream of match, progress and summary events
+"""
+import time
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    from app.models import BankTransaction, GLTransaction, TransactionMatch
+    from app.metrics import bank_lines_examined, candidates_examined, reconciliation_counter, stage_duration
+    from app.stores import alias_descriptions
+    from app.columns import RunVocabulary, TransactionColumns, gl_entry_ids
+    from app.matching import (
+        FUZZY_DATE_WINDOW_DAYS,
+        StageStats,
+        exact_stage,
+        fuzzy_stage,
+        optimal_assignment,
+        reference_match_stage,
+        split_match_stage,
+    )
+    from app.ai_matching import ai_match_stage
+except ImportError:  # Running from inside app/ (python main.py)
+    from models import BankTransaction, GLTransaction, TransactionMatch
+    from metrics import bank_lines_examined, candidates_examined, reconciliation_counter, stage_duration
+    from stores import alias_descriptions
+    from columns import RunVocabulary, TransactionColumns, gl_entry_ids
+    from matching import (
+        FUZZY_DATE_WINDOW_DAYS,
+        StageStats,
+        exact_stage,
+        fuzzy_stage,
+        optimal_assignment,
+        reference_match_stage,
+        split_match_stage,
+    )
+    from ai_matching import ai_match_stage
+
+logger = logging.getLogger(__name__)
+
+
+def observe_stage(event: dict) -> None:
+    """Record a stage_complete event in the stage metrics"""
+    stage = event["stage"]
+    stage_duration.labels(stage=stage).observe(event["duration_ms"] / 1000)
+    if "lines" in event:
+        candidates_examined.labels(stage=stage).inc(event["candidates"])
+        bank_lines_examined.labels(stage=stage).inc(event["lines"])
+
+
+async def drain_progress(task: asyncio.Task, progress: asyncio.Queue) -> AsyncIterator[dict]:
+    """Yield progress items put on the queue until the task finishes"""
+    while True:
+        getter = asyncio.ensure_future(progress.get())
+        done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            yield getter.result()
+            continue
+        getter.cancel()
+        while not progress.empty():
+            yield progress.get_nowait()
+        return
+
+
+def deterministic_stages(
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+    fuzzy_date_window_days: Optional[int] = None,
+    assignment: str = "greedy",
+    split_matching: bool = False,
+    tenant_id: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Exact → reference → fuzzy → split stages (CPU-bound, no AI), as a stream of events.
+
+    Yields {"type": "match" | "group_match" | "stage_complete"} records;
+    stage_complete carries candidate/line counts for the lookup stages.
+    Pure computation over its arguments, so it can run in a worker process.
+    """
+    if fuzzy_date_window_days is None:
+        fuzzy_date_window_days = FUZZY_DATE_WINDOW_DAYS
+
+    # Columnar view built once; stages work on row indexes into it
+    vocabulary = RunVocabulary()
+    bank = TransactionColumns.from_bank(bank_txns, vocabulary)
+    gl = TransactionColumns.from_gl(gl_txns, vocabulary)
+    bank_open = np.ones(len(bank), dtype=bool)
+    gl_open = np.ones(len(gl), dtype=bool)
+
+    def stage_complete(stage: str, started: float, count: int, stats: Optional[StageStats] = None) -> dict:
+        duration_ms = (time.perf_counter() - started) * 1000
+        event = {"type": "stage_complete", "stage": stage, "duration_ms": duration_ms, "matches": count}
+        if stats is not None:
+            event.update(candidates=stats.candidates, lines=stats.lines)
+        return event
+
+    def accept(stage: str, bank_row: int, gl_row: int, match: TransactionMatch) -> dict:
+        bank_open[bank_row] = False
+        gl_open[gl_row] = False
+        return {"type": "match", "stage": stage, "match": match}
+
+    # Learned aliases rewrite bank descriptions for fuzzy scoring only
+    fuzzy_bank, aliases = bank, {}
+    if tenant_id:
+        try:
+            aliases = alias_descriptions(tenant_id, bank_txns)
+        except sqlite3.Error as e:
+            logger.warning(f"Alias lookup failed, scoring original descriptions: {e}")
+        if aliases:
+            fuzzy_bank = bank.with_descriptions(aliases, vocabulary)
+
+    def note_alias(bank_row: int, match: TransactionMatch) -> TransactionMatch:
+        if match.match_type == "fuzzy" and bank_row in aliases:
+            match.match_reasoning += " via learned alias"
+        return match
+
+    def reference_stage() -> Iterator[dict]:
+        # Reference matches (bank reference number found on a GL entry, any date)
+        started = time.perf_counter()
+        stats = StageStats()
+        reference_matches = reference_match_stage(
+            bank, np.flatnonzero(bank_open), gl, np.flatnonzero(gl_open), stats,
+        )
+        for bank_row, gl_row, match in reference_matches:
+            yield accept("reference", bank_row, gl_row, match)
+        yield stage_complete("reference", started, len(reference_matches), stats)
+
+    if assignment == "optimal":
+        yield from reference_stage()
+
+        # Stages 1+2: Maximum-weight matching over exact and fuzzy candidate pairs
+        started = time.perf_counter()
+        stats = StageStats()
+        optimal_matches = optimal_assignment(
+            fuzzy_bank, np.flatnonzero(bank_open), gl, np.flatnonzero(gl_open), fuzzy_date_window_days, stats,
+        )
+        for bank_row, gl_row, match in optimal_matches:
+            yield accept("optimal", bank_row, gl_row, note_alias(bank_row, match))
+        yield stage_complete("optimal", started, len(optimal_matches), stats)
+    else:
+        # Stage 1: Exact matches (k-th bank line of an amount/date key takes the k-th GL entry)
+        started = time.perf_counter()
+        stats = StageStats()
+        exact_matches = exact_stage(bank, np.flatnonzero(bank_open), gl, np.flatnonzero(gl_open), stats)
+        for bank_row, gl_row, match in exact_matches:
+            yield accept("exact", bank_row, gl_row, match)
+        yield stage_complete("exact", started, len(exact_matches), stats)
+
+        yield from reference_stage()
+
+        # Stage 2: Fuzzy matches (only GL entries in the bank line's amount/date window are scored)
+        started = time.perf_counter()
+        stats = StageStats()
+        fuzzy_matches = fuzzy_stage(
+            fuzzy_bank, np.flatnonzero(bank_open), gl, np.flatnonzero(gl_open), fuzzy_date_window_days, stats,
+        )
+        for bank_row, gl_row, match in fuzzy_matches:
+            yield accept("fuzzy", bank_row, gl_row, note_alias(bank_row, match))
+        yield stage_complete("fuzzy", started, len(fuzzy_matches), stats)
+
+    # Stage 3: Split matches (batched payments, subset-sum within a date window)
+    if split_matching:
+        started = time.perf_counter()
+        group_matches = split_match_stage(
+            bank, np.flatnonzero(bank_open), gl, np.flatnonzero(gl_open), vocabulary.counterparty_mask(),
+            fuzzy_bank if aliases else None,
+        )
+        for bank_group, gl_group, group_match in group_matches:
+            bank_open[bank_group] = False
+            gl_open[gl_group] = False
+            yield {"type": "group_match", "stage": "split", "group_match": group_match}
+        yield stage_complete("split", started, len(group_matches))
+
+
+def run_deterministic_stages(bank_txns: list, gl_txns: List[GLTransaction], options: dict) -> List[dict]:
+    """Process-pool entry point for deterministic_stages"""
+    return list(deterministic_stages(bank_txns, gl_txns, **options))
+
+
+def next_stage_events(stage_events: Iterator[dict]) -> List[dict]:
+    """Events of deterministic_stages up to and including the next stage_complete ([] when done)"""
+    events = []
+    for event in stage_events:
+        events.append(event)
+        if event["type"] == "stage_complete":
+            break
+    return events
+
+
+async def deterministic_events(
+    bank_txns: list,
+    gl_txns: List[GLTransaction],
+    options: dict,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[dict]:
+    """
+    deterministic_stages off the event loop.
+
+    With an executor all stages run there and their events arrive together;
+    otherwise each stage runs in a worker thread and its events are yielded
+    as soon as it completes, so /reconcile/stream still sends matches stage
+    by stage while health checks and other requests are served.
+    """
+    if executor is not None:
+        for event in await asyncio.get_running_loop().run_in_executor(
+            executor, run_deterministic_stages, bank_txns, gl_txns, options
+        ):
+            yield event
+        return
+
+    stage_events = deterministic_stages(bank_txns, gl_txns, **options)
+    while True:
+        events = await asyncio.to_thread(next_stage_events, stage_events)
+        if not events:
+            return
+        for event in events:
+            yield event
+
+
+async def reconcile_stages(
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+    fuzzy_date_window_days: Optional[int] = None,
+    assignment: str = "greedy",
+    split_matching: bool = False,
+    ai_mode: Optional[str] = None,
+    tenant_id: Optional[str] = None,
+    executor: Optional[Executor] = None,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[dict]:
+    """
+    Hybrid reconciliation: exact → reference → fuzzy → split → AI, as a stream of events.
+
+    Yields {"type": "match" | "group_match" | "progress" | "stage_complete"}
+    records as each stage produces them, then one {"type": "summary"} record
+    with the unmatched IDs, per-stage timings (ms) and the bank lines whose
+    AI matching was cut off by the deadline (a time.monotonic() value; the
+    deterministic stages always run to completion). The deterministic stages
+    run in the executor when one is given, otherwise in worker threads.
+    """
+    matched_bank_ids = set()
+    matched_gl_ids = set()
+    stage_timings: Dict[str, float] = {}
+
+    deterministic_options = {
+        "fuzzy_date_window_days": fuzzy_date_window_days,
+        "assignment": assignment,
+        "split_matching": split_matching,
+        "tenant_id": tenant_id,
+    }
+    async for event in deterministic_events(bank_txns, gl_txns, deterministic_options, executor):
+        if event["type"] == "match":
+            match = event["match"]
+            matched_bank_ids.add(match.bank_transaction_id)
+            matched_gl_ids.add(match.gl_transaction_id)
+            reconciliation_counter.labels(match_quality=match.match_type).inc()
+        elif event["type"] == "group_match":
+            matched_bank_ids.update(event["group_match"].bank_transaction_ids)
+            matched_gl_ids.update(event["group_match"].gl_transaction_ids)
+            reconciliation_counter.labels(match_quality="split").inc()
+        elif event["type"] == "stage_complete":
+            stage_timings[event["stage"]] = event["duration_ms"]
+            observe_stage(event)
+        yield event
+
+    # Stage 4: AI matches (for remaining unmatched, run concurrently)
+    started = time.perf_counter()
+    unmatched_bank = [txn for txn in bank_txns if txn.transaction_id not in matched_bank_ids]
+    gl_ids = gl_entry_ids(gl_txns)
+    available_gl = [gl_txns[row] for row, entry_id in enumerate(gl_ids) if entry_id not in matched_gl_ids]
+    progress: asyncio.Queue = asyncio.Queue()
+    ai_stats = StageStats()
+    ai_task = asyncio.create_task(
+        ai_match_stage(unmatched_bank, available_gl, ai_mode, progress, ai_stats, deadline)
+    )
+    try:
+        async for item in drain_progress(ai_task, progress):
+            yield {"type": "progress", "stage": "ai", **item}
+    finally:
+        if not ai_task.done():
+            ai_task.cancel()
+    ai_matches, pending_ai = await ai_task
+    for match in ai_matches:
+        matched_bank_ids.add(match.bank_transaction_id)
+        matched_gl_ids.add(match.gl_transaction_id)
+        reconciliation_counter.labels(match_quality=match.match_type).inc()
+        yield {"type": "match", "stage": "ai", "match": match}
+    stage_timings["ai"] = (time.perf_counter() - started) * 1000
+    ai_complete = {
+        "type": "stage_complete", "stage": "ai", "duration_ms": stage_timings["ai"], "matches": len(ai_matches),
+        "candidates": ai_stats.candidates, "lines": ai_stats.lines,
+    }
+    observe_stage(ai_complete)
+    yield ai_complete
+
+    yield {
+        "type": "summary",
+        "unmatched_bank": [txn.transaction_id for txn in bank_txns if txn.transaction_id not in matched_bank_ids],
+        "unmatched_gl": [entry_id for entry_id in gl_ids if entry_id not in matched_gl_ids],
+        "stage_timings_ms": stage_timings,
+        "pending_ai": pending_ai,
+    }
+
+
+async def reconcile_transactions(
+    bank_txns: List[BankTransaction],
+    gl_txns: List[GLTransaction],
+    on_event: Optional[Callable[[dict], None]] = None,
+    **options,
+) -> tuple:
+    """Run all reconciliation stages and collect the results"""
+    matches = []
+    group_matches = []
+    summary: dict = {}
+
+    async for event in reconcile_stages(bank_txns, gl_txns, **options):
+        if on_event is not None:
+            on_event(event)
+        if event["type"] == "match":
+            matches.append(event["match"])
+        elif event["type"] == "group_match":
+            group_matches.append(event["group_match"])
+        elif event["type"] == "summary":
+            summary = event
+
+    return (
+        matches,
+        group_matches,
+        summary["unmatched_bank"],
+        summary["unmatched_gl"],
+        summary["stage_timings_ms"],
+        summary["pending_ai"],
+    )
@@ -0,0 +1,458 @@
+"""
+AIRP v2.0 - Bank Statement Ingestion
+Streaming CSV / MT940 / CAMT.053 parsers that build a compact columnar statement
+
+Parsers are push-based: feed() accepts byte chunks as they arrive (e.g. from
+an HTTP request body) and only the current partial record is buffered, so
+memory grows with the number of lines, not with the size of the raw file.
+This module only uses the standard library so client scripts can reuse it.
+"""
+import codecs
+import csv
+import re
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+SUPPORTED_FORMATS = ("csv", "mt940", "camt053")
+
+CSV_DATE_FORMATS = ("%Y-%m-%d", "%d-%b-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%Y%m%d")
+
+# Header aliases (lowercased) for bank CSV exports
+CSV_DATE_COLUMNS = ("transaction date", "date", "booking date", "posting date", "value date")
+CSV_DESCRIPTION_COLUMNS = ("description", "narrative", "details", "transaction details", "particulars")
+CSV_REFERENCE_COLUMNS = ("reference", "ref", "reference number", "cheque number")
+CSV_DEBIT_COLUMNS = ("debit", "withdrawal", "withdrawals", "debit amount")
+CSV_CREDIT_COLUMNS = ("credit", "deposit", "deposits", "credit amount")
+CSV_AMOUNT_COLUMNS = ("amount", "transaction amount")
+
+
+class StatementRow(NamedTuple):
+    """One bank line, field-compatible with the BankTransaction model"""
+    transaction_id: str
+    transaction_date: str
+    description: str
+    amount: float
+    transaction_type: str
+    reference_number: Optional[str]
+
+
+class StatementColumns:
+    """
+    Columnar in-memory bank statement.
+
+    Amounts are absolute values in integer fils, dates are day ordinals
+    (0 when the date could not be parsed, with the raw text kept aside),
+    the debit/credit flag is one byte per line and repeated descriptions
+    share a single string. Transaction IDs are derived from the line number.
+    Indexing and iteration build StatementRow objects on demand, so the
+    statement can stand in for a list of bank lines without materializing it.
+    """
+
+    def __init__(self, id_prefix: str = "BANK"):
+        self.id_prefix = id_prefix
+        self.amounts_fils = array("q")
+        self.day_ordinals = array("l")
+        self.is_debit = bytearray()
+        self.descriptions: List[str] = []
+        self.references: List[Optional[str]] = []
+        self.raw_dates: Dict[int, str] = {}
+        self._strings: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.amounts_fils)
+
+    def __getitem__(self, row: int) -> StatementRow:
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return self.row(row % len(self))
+
+    def __iter__(self) -> Iterator[StatementRow]:
+        return self.rows()
+
+    def _share(self, value: str) -> str:
+        return self._strings.setdefault(value, value)
+
+    def append(
+        self,
+        amount: float,
+        is_debit: bool,
+        transaction_date: Optional[date],
+        description: str,
+        reference: Optional[str],
+        raw_date: str = "",
+    ) -> None:
+        row = len(self.amounts_fils)
+        self.amounts_fils.append(int(round(abs(amount) * 100)))
+        self.is_debit.append(1 if is_debit else 0)
+        if transaction_date is None:
+            self.day_ordinals.append(0)
+            self.raw_dates[row] = raw_date
+        else:
+            self.day_ordinals.append(transaction_date.toordinal())
+        self.descriptions.append(self._share(description.strip()))
+        self.references.append(reference)
+
+    def transaction_id(self, row: int) -> str:
+        return f"{self.id_prefix}-{row + 1:04d}"
+
+    def transaction_date(self, row: int) -> str:
+        ordinal = self.day_ordinals[row]
+        if ordinal == 0:
+            return self.raw_dates.get(row, "")
+        return date.fromordinal(ordinal).isoformat()
+
+    def transaction_dates(self) -> List[str]:
+        """transaction_date() of every row, formatting each distinct day once"""
+        formatted: Dict[int, str] = {}
+        return [
+            self.raw_dates.get(row, "") if ordinal == 0
+            else formatted.get(ordinal) or formatted.setdefault(ordinal, date.fromordinal(ordinal).isoformat())
+            for row, ordinal in enumerate(self.day_ordinals)
+        ]
+
+    def row(self, row: int) -> StatementRow:
+        return StatementRow(
+            transaction_id=self.transaction_id(row),
+            transaction_date=self.transaction_date(row),
+            description=self.descriptions[row],
+            amount=self.amounts_fils[row] / 100,
+            transaction_type="debit" if self.is_debit[row] else "credit",
+            reference_number=self.references[row],
+        )
+
+    def rows(self) -> Iterator[StatementRow]:
+        for row in range(len(self)):
+            yield self.row(row)
+
+    def to_dicts(self) -> List[dict]:
+        """Rows as BankTransaction-shaped dicts (for JSON payloads)"""
+        return [statement_row._asdict() for statement_row in self.rows()]
+
+    def approximate_bytes(self) -> int:
+        """Rough memory footprint of the columns and distinct strings"""
+        return (
+            self.amounts_fils.itemsize * len(self.amounts_fils)
+            + self.day_ordinals.itemsize * len(self.day_ordinals)
+            + len(self.is_debit)
+            + sys.getsizeof(self.descriptions)
+            + sys.getsizeof(self.references)
+            + sum(sys.getsizeof(value) for value in self._strings)
+        )
+
+
+def parse_amount(text: Optional[str], decimal_comma: bool = False) -> float:
+    """
+    Parse a statement amount ('' → 0.0).
+
+    With decimal_comma (MT940) ',' is the decimal mark. Otherwise, when both
+    ',' and '.' occur the last one is the decimal mark ('1,234.50',
+    '1.234,50'); a single ',' followed by one or two digits is a decimal
+    comma ('1234,50') and any other ',' separates thousands ('5,000',
+    '1,234,567'), as do repeated '.' ('1.234.567').
+    """
+    if not text:
+        return 0.0
+    text = text.strip().replace(" ", "")
+    if decimal_comma:
+        return float(text.replace(".", "").replace(",", ".") or 0)
+    if "," in text and "." in text:
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+    elif text.count(",") == 1 and re.search(r",\d{1,2}$", text):
+        text = text.replace(",", ".")
+    elif text.count(".") > 1:
+        text = text.replace(".", "")
+    return float(text.replace(",", "") or 0)
+
+
+def parse_date(text: str) -> Optional[date]:
+    text = text.strip()
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class CsvStatementParser:
+    """Incremental parser for bank CSV exports with a header row (e.g. Emirates NBD)"""
+
+    def __init__(self, columns: StatementColumns, encoding: str = "utf-8-sig"):
+        self.columns = columns
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._buffer = ""
+        self._record = ""
+        self._fields: Optional[Dict[str, int]] = None
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += self._decoder.decode(chunk)
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._feed_line(line + "\n")
+
+    def close(self) -> StatementColumns:
+        self._buffer += self._decoder.decode(b"", final=True)
+        if self._buffer:
+            self._feed_line(self._buffer + "\n")
+            self._buffer = ""
+        if self._record.strip():
+            self._parse_record(self._record)
+            self._record = ""
+        return self.columns
+
+    def _feed_line(self, line: str) -> None:
+        self._record += line
+        # A quoted field may contain newlines; wait until quotes are balanced
+        if self._record.count('"') % 2:
+            return
+        record, self._record = self._record, ""
+        if record.strip():
+            self._parse_record(record)
+
+    def _parse_record(self, record: str) -> None:
+        values = next(csv.reader([record]))
+        if self._fields is None:
+            self._fields = {name.strip().lower(): pos for pos, name in enumerate(values)}
+            return
+
+        def field(names) -> str:
+            for name in names:
+                pos = self._fields.get(name)
+                if pos is not None and pos < len(values):
+                    return values[pos].strip()
+            return ""
+
+        debit = parse_amount(field(CSV_DEBIT_COLUMNS))
+        credit = parse_amount(field(CSV_CREDIT_COLUMNS))
+        if not debit and not credit:
+            signed = parse_amount(field(CSV_AMOUNT_COLUMNS))
+            debit, credit = (-signed, 0.0) if signed < 0 else (0.0, signed)
+
+        raw_date = field(CSV_DATE_COLUMNS)
+        has_reference = any(name in self._fields for name in CSV_REFERENCE_COLUMNS)
+        self.columns.append(
+            amount=debit if debit > 0 else credit,
+            is_debit=debit > 0,
+            transaction_date=parse_date(raw_date),
+            description=field(CSV_DESCRIPTION_COLUMNS),
+            reference=field(CSV_REFERENCE_COLUMNS) if has_reference else None,
+            raw_date=raw_date,
+        )
+
+
+# :61: value date (YYMMDD), optional entry date (MMDD), [R]D/C mark, optional funds code,
+# amount (comma decimal), transaction type code, customer reference, optional //bank reference
+MT940_STATEMENT_LINE = re.compile(
+    r"^(?P<date>\d{6})(?:\d{4})?(?P<mark>R?[DC])[A-Z]?(?P<amount>[\d,]+)"
+    r"(?P<code>[A-Z]\w{3})(?P<reference>[^/\n]*)(?://(?P<bank_reference>[^\n]*))?"
+)
+
+
+class Mt940StatementParser:
+    """Incremental parser for SWIFT MT940 statements (:61: lines with their :86: details)"""
+
+    def __init__(self, columns: StatementColumns, encoding: str = "latin-1"):
+        self.columns = columns
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._buffer = ""
+        self._tag: Optional[str] = None
+        self._value: List[str] = []
+        self._pending: Optional[dict] = None
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += self._decoder.decode(chunk)
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._feed_line(line.rstrip("\r"))
+
+    def close(self) -> StatementColumns:
+        self._buffer += self._decoder.decode(b"", final=True)
+        if self._buffer:
+            self._feed_line(self._buffer.rstrip("\r"))
+            self._buffer = ""
+        self._end_field()
+        self._flush()
+        return self.columns
+
+    def _feed_line(self, line: str) -> None:
+        match = re.match(r"^:(\w{2,3}):(.*)$", line)
+        if match:
+            self._end_field()
+            self._tag, self._value = match.group(1), [match.group(2)]
+        elif line.startswith("-}") or line.startswith("{"):
+            self._end_field()
+            self._tag, self._value = None, []
+        elif self._tag is not None:
+            self._value.append(line)
+
+    def _end_field(self) -> None:
+        if self._tag == "61":
+            self._flush()
+            self._pending = self._parse_statement_line(self._value)
+        elif self._tag == "86" and self._pending is not None:
+            self._pending["description"] = " ".join(part.strip() for part in self._value if part.strip())
+            self._flush()
+        elif self._tag is not None and self._tag.startswith("62"):
+            self._flush()
+        self._tag, self._value = None, []
+
+    @staticmethod
+    def _parse_statement_line(value: List[str]) -> Optional[dict]:
+        match = MT940_STATEMENT_LINE.match(value[0])
+        if not match:
+            return None
+        raw_date = match.group("date")
+        try:
+            value_date = datetime.strptime(raw_date, "%y%m%d").date()
+        except ValueError:
+            value_date = None
+        mark = match.group("mark")
+        reference = match.group("reference").strip()
+        if reference == "NONREF":
+            reference = (match.group("bank_reference") or "").strip()
+        return {
+            "amount": parse_amount(match.group("amount"), decimal_comma=True),
+            # Reversals (RD/RC) flip the direction
+            "is_debit": mark in ("D", "RC"),
+            "transaction_date": value_date,
+            "raw_date": raw_date,
+            "reference": reference or None,
+            "description": " ".join(part.strip() for part in value[1:] if part.strip()) or reference,
+        }
+
+    def _flush(self) -> None:
+        if self._pending is not None:
+            self.columns.append(**self._pending)
+            self._pending = None
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class CamtStatementParser:
+    """Incremental parser for ISO 20022 CAMT.053 / CAMT.052 XML (one line per Ntry)"""
+
+    def __init__(self, columns: StatementColumns):
+        self.columns = columns
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._stack: List[ET.Element] = []
+
+    def feed(self, chunk: bytes) -> None:
+        self._parser.feed(chunk)
+        self._drain()
+
+    def close(self) -> StatementColumns:
+        self._parser.close()
+        self._drain()
+        return self.columns
+
+    def _drain(self) -> None:
+        for event, element in self._parser.read_events():
+            if event == "start":
+                self._stack.append(element)
+                continue
+            self._stack.pop()
+            if _local(element.tag) == "Ntry":
+                self._append_entry(element)
+                # Drop the processed entry so the tree never holds more than one Ntry
+                if self._stack:
+                    self._stack[-1].remove(element)
+                element.clear()
+
+    @staticmethod
+    def _find_text(element: ET.Element, *path: str) -> Optional[str]:
+        """Text of the first descendant matching a path of local names"""
+        candidates = [element]
+        for name in path:
+            candidates = [child for parent in candidates for child in parent.iter() if _local(child.tag) == name]
+            if not candidates:
+                return None
+        text = candidates[0].text
+        return text.strip() if text and text.strip() else None
+
+    def _append_entry(self, entry: ET.Element) -> None:
+        amount_element = next((child for child in entry if _local(child.tag) == "Amt"), None)
+        amount = parse_amount(amount_element.text if amount_element is not None else None)
+        raw_date = (
+            self._find_text(entry, "BookgDt", "Dt")
+            or self._find_text(entry, "BookgDt", "DtTm")
+            or self._find_text(entry, "ValDt", "Dt")
+            or ""
+        )
+        description = (
+            self._find_text(entry, "RmtInf", "Ustrd")
+            or self._find_text(entry, "AddtlNtryInf")
+            or self._find_text(entry, "AddtlTxInf")
+            or ""
+        )
+        reference = (
+            self._find_text(entry, "AcctSvcrRef")
+            or self._find_text(entry, "NtryRef")
+            or self._find_text(entry, "EndToEndId")
+        )
+        self.columns.append(
+            amount=amount,
+            is_debit=self._find_text(entry, "CdtDbtInd") == "DBIT",
+            transaction_date=parse_date(raw_date[:10]),
+            description=description,
+            reference=reference,
+            raw_date=raw_date,
+        )
+
+
+PARSERS = {
+    "csv": CsvStatementParser,
+    "mt940": Mt940StatementParser,
+    "camt053": CamtStatementParser,
+}
+
+
+def detect_format(head: bytes, filename: str = "") -> str:
+    """Guess the statement format from the first bytes (and file name)"""
+    name = filename.lower()
+    if name.endswith((".sta", ".mt940", ".940")):
+        return "mt940"
+    if name.endswith(".xml"):
+        return "camt053"
+    text = head.lstrip(b"\xef\xbb\xbf").lstrip()
+    if text.startswith(b"<"):
+        return "camt053"
+    if text.startswith(b"{1:") or b":20:" in text[:200] or b":61:" in text:
+        return "mt940"
+    return "csv"
+
+
+def create_parser(statement_format: str, columns: StatementColumns):
+    if statement_format not in PARSERS:
+        raise ValueError(f"Unsupported statement format: {statement_format} (expected one of {SUPPORTED_FORMATS})")
+    return PARSERS[statement_format](columns)
+
+
+def ingest_chunks(chunks: Iterable[bytes], statement_format: str, id_prefix: str = "BANK") -> StatementColumns:
+    """Parse an iterable of byte chunks into a StatementColumns"""
+    parser = create_parser(statement_format, StatementColumns(id_prefix=id_prefix))
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def ingest_file(path: str, statement_format: Optional[str] = None, chunk_size: int = 1 << 16) -> StatementColumns:
+    """Parse a statement file without loading it into memory at once"""
+    with open(path, "rb") as f:
+        head = f.read(chunk_size)
+        statement_format = statement_format or detect_format(head, path)
+
+        def chunks() -> Iterator[bytes]:
+            yield head
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        return ingest_chunks(chunks(), statement_format)
@@ -0,0 +1,368 @@
+"""
+AIRP v2.0 - Bank Reconciliation Stores
+Learned description aliases, uploaded statements and incremental reconciliation sessions
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime
+
+try:
+    from app.statement_ingest import StatementColumns
+    from app.models import BankTransaction, GLTransaction, GroupMatch, TransactionMatch
+except ImportError:  # Running from inside app/ (python main.py)
+    from statement_ingest import StatementColumns
+    from models import BankTransaction, GLTransaction, GroupMatch, TransactionMatch
+
+# Local store for learned description aliases and reconciliation sessions (stands in for Postgres)
+RECON_STORE_PATH = os.getenv("RECON_STORE_PATH", "/tmp/airp_ai_recon.sqlite3")
+ALIAS_CACHE_SIZE = int(os.getenv("ALIAS_CACHE_SIZE", "10000"))
+# Seconds a cached alias lookup (hit or miss) is trusted; bounds how long other workers miss a newly learned alias
+ALIAS_CACHE_TTL_SECONDS = float(os.getenv("ALIAS_CACHE_TTL_SECONDS", "30"))
+# Uploaded statements kept in memory for /reconcile (oldest evicted first)
+MAX_STORED_STATEMENTS = int(os.getenv("MAX_STORED_STATEMENTS", "20"))
+# Line IDs per "IN (...)" lookup, below SQLite's default limit of 999 bound variables
+SESSION_LINE_ID_CHUNK = 900
+
+
+# ============================================
+# DESCRIPTION ALIAS STORE
+# ============================================
+
+def normalize_description(description: str) -> str:
+    """Lowercase letters-only form of a description, used as the alias key ("FB ADS - 0423" → "fb ads")"""
+    return " ".join(re.sub(r"[^a-z]+", " ", description.lower()).split())
+
+
+class AliasStore:
+    """
+    Learned bank description → counterparty aliases per tenant.
+
+    Confirmed AI and manual matches teach the store that a normalized bank
+    description (e.g. "fb ads marketing campaign") refers to the same
+    counterparty as a GL description (e.g. "Meta advertising campaign spend").
+    Rows live in a local SQLite table; lookups go through an in-process LRU
+    that also remembers misses. learn() only updates the cache of the process
+    that handled it, so entries expire after ALIAS_CACHE_TTL_SECONDS and other
+    uvicorn workers and job worker processes re-read the table.
+    """
+
+    def __init__(self, path: str, cache_size: int = ALIAS_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS recon_description_aliases (
+                    tenant_id TEXT NOT NULL,
+                    description_key TEXT NOT NULL,
+                    alias TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 1,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (tenant_id, description_key)
+                )"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: Tuple[str, str], alias: Optional[str]) -> None:
+        self._cache[key] = (time.monotonic() + ALIAS_CACHE_TTL_SECONDS, alias)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def lookup(self, tenant_id: str, description: str) -> Optional[str]:
+        """Learned alias for a bank description, or None"""
+        key = (tenant_id, normalize_description(description))
+        if not key[1]:
+            return None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+            row = self._connection().execute(
+                "SELECT alias FROM recon_description_aliases WHERE tenant_id = ? AND description_key = ?",
+                key,
+            ).fetchone()
+            alias = row[0] if row else None
+            self._remember(key, alias)
+            return alias
+
+    def learn(self, tenant_id: str, bank_description: str, gl_description: str, source: str) -> Optional[str]:
+        """Store (or refresh) the alias for a confirmed match; returns the description key"""
+        key = (tenant_id, normalize_description(bank_description))
+        alias = " ".join(gl_description.split())
+        if not key[1] or not alias:
+            return None
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """INSERT INTO recon_description_aliases
+                       (tenant_id, description_key, alias, source, hits, updated_at)
+                   VALUES (?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (tenant_id, description_key) DO UPDATE SET
+                       alias = excluded.alias,
+                       source = excluded.source,
+                       hits = recon_description_aliases.hits + 1,
+                       updated_at = excluded.updated_at""",
+                (*key, alias, source, datetime.utcnow().isoformat()),
+            )
+            conn.commit()
+            self._remember(key, alias)
+        return key[1]
+
+    def list_aliases(self, tenant_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._connection().execute(
+                """SELECT description_key, alias, source, hits, updated_at
+                   FROM recon_description_aliases WHERE tenant_id = ? ORDER BY hits DESC""",
+                (tenant_id,),
+            ).fetchall()
+        return [
+            {"description_key": row[0], "alias": row[1], "source": row[2], "hits": row[3], "updated_at": row[4]}
+            for row in rows
+        ]
+
+
+alias_store = AliasStore(RECON_STORE_PATH)
+
+
+def alias_descriptions(tenant_id: str, bank_txns: list) -> Dict[int, str]:
+    """
+    Learned aliases to substitute for bank descriptions before fuzzy scoring.
+
+    Returns {bank line index: alias} for the lines that have one.
+    """
+    aliases = {}
+    for row, bank_txn in enumerate(bank_txns):
+        alias = alias_store.lookup(tenant_id, bank_txn.description)
+        if alias:
+            aliases[row] = alias
+    return aliases
+
+
+# ============================================
+# STATEMENT STORE
+# ============================================
+
+# statement_id → (tenant_id, account_id, columns); insertion ordered for eviction
+statement_store: "OrderedDict[str, Tuple[str, str, StatementColumns]]" = OrderedDict()
+
+
+def store_statement(tenant_id: str, account_id: str, columns: StatementColumns) -> str:
+    statement_id = str(uuid.uuid4())
+    statement_store[statement_id] = (tenant_id, account_id, columns)
+    while len(statement_store) > MAX_STORED_STATEMENTS:
+        statement_store.popitem(last=False)
+    return statement_id
+
+
+# ============================================
+# RECONCILIATION SESSION STORE
+# ============================================
+
+class SessionStore:
+    """
+    Incremental reconciliation sessions.
+
+    A session keeps every bank and GL line it has been given and the matches
+    accepted so far. Accepted matches are frozen: their lines are marked as
+    matched and never offered to the pipeline again, so later calls only
+    match new lines against what is still open. Rows live in local SQLite
+    tables (standing in for Postgres).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                """CREATE TABLE IF NOT EXISTS recon_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    tenant_id TEXT NOT NULL,
+                    account_id TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS recon_session_lines (
+                    session_id TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    line_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    matched INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (session_id, side, line_id)
+                );
+                CREATE TABLE IF NOT EXISTS recon_session_matches (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_recon_session_matches_session
+                    ON recon_session_matches (session_id, seq);"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    def create(self, tenant_id: str, account_id: str, options: dict) -> str:
+        session_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO recon_sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, tenant_id, account_id, json.dumps(options), now, now),
+            )
+            conn.commit()
+        return session_id
+
+    def get(self, session_id: str, tenant_id: str) -> Optional[dict]:
+        """Session header (account_id, options), or None if unknown for this tenant"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT account_id, options FROM recon_sessions WHERE session_id = ? AND tenant_id = ?",
+                (session_id, tenant_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"account_id": row[0], "options": json.loads(row[1])}
+
+    def existing_line_ids(self, session_id: str, side: str, line_ids: List[str]) -> List[str]:
+        """The line_ids already stored on one side of the session, in input order"""
+        found = set()
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(line_ids), SESSION_LINE_ID_CHUNK):
+                chunk = line_ids[start:start + SESSION_LINE_ID_CHUNK]
+                found.update(row[0] for row in conn.execute(
+                    f"""SELECT line_id FROM recon_session_lines
+                        WHERE session_id = ? AND side = ? AND line_id IN ({", ".join("?" * len(chunk))})""",
+                    (session_id, side, *chunk),
+                ))
+        return [line_id for line_id in line_ids if line_id in found]
+
+    def add_lines(self, session_id: str, bank_txns: List[BankTransaction], gl_txns: List[GLTransaction]) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT INTO recon_session_lines (session_id, side, line_id, payload) VALUES (?, ?, ?, ?)",
+                [(session_id, "bank", txn.transaction_id, txn.model_dump_json()) for txn in bank_txns]
+                + [(session_id, "gl", txn.entry_id, txn.model_dump_json()) for txn in gl_txns],
+            )
+            conn.execute(
+                "UPDATE recon_sessions SET updated_at = ? WHERE session_id = ?",
+                (datetime.utcnow().isoformat(), session_id),
+            )
+            conn.commit()
+
+    def open_lines(self, session_id: str) -> Tuple[List[BankTransaction], List[GLTransaction]]:
+        """Unmatched bank and GL lines, in the order they were added"""
+        with self._lock:
+            rows = self._connection().execute(
+                """SELECT side, payload FROM recon_session_lines
+                   WHERE session_id = ? AND matched = 0 ORDER BY rowid""",
+                (session_id,),
+            ).fetchall()
+        bank = [BankTransaction.model_validate_json(payload) for side, payload in rows if side == "bank"]
+        gl = [GLTransaction.model_validate_json(payload) for side, payload in rows if side == "gl"]
+        return bank, gl
+
+    def accept(self, session_id: str, matches: List[TransactionMatch], group_matches: List[GroupMatch]) -> None:
+        """Freeze matches: store them and mark their lines as matched"""
+        if not matches and not group_matches:
+            return
+        now = datetime.utcnow().isoformat()
+        bank_ids = [m.bank_transaction_id for m in matches]
+        gl_ids = [m.gl_transaction_id for m in matches]
+        for group_match in group_matches:
+            bank_ids.extend(group_match.bank_transaction_ids)
+            gl_ids.extend(group_match.gl_transaction_ids)
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT INTO recon_session_matches (session_id, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                [(session_id, "match", m.model_dump_json(), now) for m in matches]
+                + [(session_id, "group", g.model_dump_json(), now) for g in group_matches],
+            )
+            conn.executemany(
+                "UPDATE recon_session_lines SET matched = 1 WHERE session_id = ? AND side = ? AND line_id = ?",
+                [(session_id, "bank", line_id) for line_id in bank_ids]
+                + [(session_id, "gl", line_id) for line_id in gl_ids],
+            )
+            conn.execute("UPDATE recon_sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+            conn.commit()
+
+    def state(self, session_id: str) -> dict:
+        """Accepted matches, unmatched line IDs and the bank line count"""
+        with self._lock:
+            conn = self._connection()
+            match_rows = conn.execute(
+                "SELECT kind, payload FROM recon_session_matches WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+            line_rows = conn.execute(
+                "SELECT side, line_id, matched FROM recon_session_lines WHERE session_id = ? ORDER BY rowid",
+                (session_id,),
+            ).fetchall()
+        return {
+            "matches": [TransactionMatch.model_validate_json(p) for kind, p in match_rows if kind == "match"],
+            "group_matches": [GroupMatch.model_validate_json(p) for kind, p in match_rows if kind == "group"],
+            "unmatched_bank": [line_id for side, line_id, matched in line_rows if side == "bank" and not matched],
+            "unmatched_gl": [line_id for side, line_id, matched in line_rows if side == "gl" and not matched],
+            "bank_count": sum(1 for side, _, _ in line_rows if side == "bank"),
+        }
+
+
+class SessionLocks:
+    """
+    Serializes updates to one session so concurrent calls cannot match the same open line twice.
+
+    A session's lock only exists while a call holds or waits for it, so the
+    registry does not grow with every session ever touched.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        lock, users = self._locks.get(session_id, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[session_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session_id]
+            if users == 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+session_store = SessionStore(RECON_STORE_PATH)
+session_locks = SessionLocks()
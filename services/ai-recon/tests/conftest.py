@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Import the service as the container does (uvicorn app.main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the module-level alias and session stores away from the service's default SQLite file
+os.environ.setdefault("RECON_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="ai-recon-tests-"), "store.sqlite3"))
+# Unit tests never call the model; AI stage tests install a fake client
+os.environ["ANTHROPIC_API_KEY"] = ""
@@ -0,0 +1,231 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app import ai_matching
+from app.ai_matching import AICandidateRanker, ai_match_batch, ai_match_stage, plan_ai_batches, resolve_ai_conflicts
+from app.models import BankTransaction, GLTransaction, TransactionMatch
+
+
+class FakeAIClient:
+    """Stand-in for anthropic.AsyncAnthropic: answers prompts with respond(prompt) and records them"""
+
+    def __init__(self, respond, latency: float = 0.0):
+        self.respond = respond
+        self.latency = latency
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def create(self, model, max_tokens, temperature, messages):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(self.respond(prompt)))], usage=None)
+        finally:
+            self.in_flight -= 1
+
+
+def bank_line(transaction_id, description, amount, transaction_date="2025-06-10", reference_number=None):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+        reference_number=reference_number,
+    )
+
+
+def gl_entry(entry_id, description, amount, entry_date="2025-06-10"):
+    return GLTransaction(
+        entry_id=entry_id,
+        entry_date=entry_date,
+        description=description,
+        amount=amount,
+        account_code="5000",
+        account_name="Expenses",
+    )
+
+
+def claim(bank_id, gl_id, confidence):
+    return TransactionMatch(
+        bank_transaction_id=bank_id,
+        gl_transaction_id=gl_id,
+        confidence_score=confidence,
+        match_reasoning="AI Match: test",
+        match_type="ai",
+    )
+
+
+def match_same_id(prompt: str) -> dict:
+    """Single-prompt answer pairing bank line Bn with GL entry Gn"""
+    bank_id = prompt.split("- ID: ", 1)[1].split("\n", 1)[0]
+    return {"matched_gl_id": "G" + bank_id[1:], "confidence": 0.9, "reasoning": "Same vendor"}
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    """Install a fake AI client and a fresh semaphore bound to the test's event loop"""
+
+    def install(client, concurrency: int = ai_matching.AI_MAX_CONCURRENCY):
+        monkeypatch.setattr(ai_matching, "ai_client", client)
+        monkeypatch.setattr(ai_matching, "ai_semaphore", asyncio.Semaphore(concurrency))
+        return client
+
+    return install
+
+
+def test_ai_stage_runs_lines_concurrently_within_the_limit(use_client):
+    client = use_client(FakeAIClient(match_same_id, latency=0.02), concurrency=2)
+    bank_txns = [bank_line(f"B{i}", f"VENDOR{i} INVOICE", 100.0 + i) for i in range(6)]
+    gl_txns = [gl_entry(f"G{i}", f"Vendor{i} invoice", 100.0 + i) for i in range(6)]
+
+    matches, pending = asyncio.run(ai_match_stage(bank_txns, gl_txns, ai_mode="single"))
+
+    assert [(match.bank_transaction_id, match.gl_transaction_id) for match in matches] == [
+        (f"B{i}", f"G{i}") for i in range(6)
+    ]
+    assert pending == []
+    assert len(client.prompts) == 6
+    assert client.max_in_flight == 2
+
+
+def test_ai_stage_without_client_matches_nothing(use_client):
+    use_client(None)
+
+    assert asyncio.run(ai_match_stage([bank_line("B1", "X", 1.0)], [gl_entry("G1", "X", 1.0)])) == ([], [])
+
+
+def test_ai_stage_drops_claims_on_entries_that_were_not_offered(use_client):
+    use_client(FakeAIClient(lambda prompt: {"matched_gl_id": "G-UNKNOWN", "confidence": 0.99, "reasoning": "?"}))
+
+    matches, _ = asyncio.run(ai_match_stage(
+        [bank_line("B1", "DEWA BILL", 450.0)], [gl_entry("G1", "DEWA bill", 450.0)], ai_mode="single"
+    ))
+
+    assert matches == []
+
+
+def test_conflicts_go_to_the_most_confident_claim():
+    results = [
+        claim("B1", "G1", 0.85),
+        claim("B2", "G1", 0.95),
+        None,
+        claim("B4", "G2", 0.9),
+        claim("B5", "G2", 0.9),
+        claim("B6", "G9", 0.99),
+    ]
+
+    accepted = resolve_ai_conflicts(results, {"G1", "G2"})
+
+    assert [(match.bank_transaction_id, match.gl_transaction_id) for match in accepted] == [
+        ("B2", "G1"),
+        ("B4", "G2"),  # ties go to the earlier bank line
+    ]
+
+
+def match_all_same_id(prompt: str) -> list:
+    """Batched answer pairing every bank line Bn in the prompt with GL entry Gn"""
+    bank_section = prompt.split("Bank Transactions:\n", 1)[1].split("\n\n", 1)[0]
+    bank_ids = [line.split("- ID: ", 1)[1].split(",", 1)[0] for line in bank_section.splitlines()]
+    return [
+        {"bank_id": bank_id, "matched_gl_id": "G" + bank_id[1:], "confidence": 0.9, "reasoning": "Same vendor"}
+        for bank_id in bank_ids
+    ]
+
+
+def test_batches_close_at_the_line_and_candidate_limits(monkeypatch):
+    monkeypatch.setattr(ai_matching, "AI_BATCH_SIZE", 3)
+    monkeypatch.setattr(ai_matching, "AI_BATCH_MAX_CANDIDATES", 4)
+    bank_txns = [bank_line(f"B{i}", "PAYMENT", 100.0) for i in range(5)]
+    shared = [gl_entry("G0", "Payment", 100.0), gl_entry("G1", "Payment", 100.0)]
+    candidates = {f"B{i}": shared for i in range(4)}
+    candidates["B4"] = [gl_entry(f"X{i}", "Other", 100.0) for i in range(3)]
+
+    batches = plan_ai_batches(bank_txns, candidates)
+
+    assert [[txn.transaction_id for txn in batch] for batch, _ in batches] == [["B0", "B1", "B2"], ["B3"], ["B4"]]
+    assert [[gl.entry_id for gl in batch_candidates] for _, batch_candidates in batches] == [
+        ["G0", "G1"], ["G0", "G1"], ["X0", "X1", "X2"]
+    ]
+
+
+def test_batches_close_at_the_token_budget(monkeypatch):
+    monkeypatch.setattr(ai_matching, "AI_BATCH_TOKEN_BUDGET", 300)
+    bank_txns = [bank_line(f"B{i}", "PAYMENT " + "X" * 2000, 100.0) for i in range(4)]
+
+    batches = plan_ai_batches(bank_txns, {txn.transaction_id: [] for txn in bank_txns})
+
+    # A line over the budget still gets a prompt of its own
+    assert [len(batch) for batch, _ in batches] == [1, 1, 1, 1]
+
+
+def test_batched_answers_skip_unknown_low_confidence_and_malformed_entries(use_client):
+    use_client(FakeAIClient(lambda prompt: [
+        {"bank_id": "B1", "matched_gl_id": "G1", "confidence": 0.92, "reasoning": "Rent"},
+        {"bank_id": "B2", "matched_gl_id": "G2", "confidence": 0.5, "reasoning": "Weak"},
+        {"bank_id": "B9", "matched_gl_id": "G3", "confidence": 0.99, "reasoning": "Not asked"},
+        {"bank_id": "B3", "matched_gl_id": "G3", "confidence": "high", "reasoning": "Malformed"},
+        "not an object",
+    ]))
+    bank_txns = [bank_line(f"B{i}", "X", 1.0) for i in range(1, 4)]
+
+    results = asyncio.run(ai_match_batch(bank_txns, [gl_entry(f"G{i}", "X", 1.0) for i in range(1, 4)]))
+
+    assert [result.gl_transaction_id if result else None for result in results] == ["G1", None, None]
+
+
+def test_batched_mode_needs_fewer_calls(use_client, monkeypatch):
+    monkeypatch.setattr(ai_matching, "AI_BATCH_SIZE", 4)
+    client = use_client(FakeAIClient(match_all_same_id))
+    bank_txns = [bank_line(f"B{i}", f"VENDOR{i} INVOICE", 100.0 + i) for i in range(8)]
+    gl_txns = [gl_entry(f"G{i}", f"Vendor{i} invoice", 100.0 + i) for i in range(8)]
+
+    matches, pending = asyncio.run(ai_match_stage(bank_txns, gl_txns, ai_mode="batched"))
+
+    assert len(matches) == 8 and pending == []
+    assert all(match.gl_transaction_id == "G" + match.bank_transaction_id[1:] for match in matches)
+    assert len(client.prompts) < 8
+
+
+def test_ranker_puts_reference_and_vendor_hits_first():
+    ranker = AICandidateRanker([
+        gl_entry("G1", "Office supplies", 980.0),
+        gl_entry("G2", "Invoice INV-7781 Emirates Logistics", 1010.0, entry_date="2025-06-20"),
+        gl_entry("G3", "Emirates Logistics freight", 400.0),
+        gl_entry("G4", "Staff lunch", 20.0, entry_date="2025-01-01"),
+    ])
+
+    ranked = ranker.rank(bank_line("B1", "EMIRATES LOGISTICS", 1000.0, reference_number="INV-7781"), top_k=3)
+
+    assert [gl.entry_id for _, gl in ranked] == ["G2", "G1", "G3"]
+    assert [score for score, _ in ranked] == sorted((score for score, _ in ranked), reverse=True)
+
+
+def test_ranker_has_no_plausible_candidates_for_unrelated_lines(monkeypatch):
+    monkeypatch.setattr(ai_matching, "AI_MIN_CANDIDATE_SCORE", 0.35)
+    ranker = AICandidateRanker([gl_entry("G1", "Staff lunch", 20.0, entry_date="2025-01-01")])
+
+    assert ranker.plausible_candidates(bank_line("B1", "DEWA BILL", 9000.0)) == []
+    assert [gl.entry_id for gl in ranker.plausible_candidates(bank_line("B2", "STAFF LUNCH", 20.0))] == ["G1"]
+
+
+def test_ai_stage_only_sends_top_candidates_and_skips_implausible_lines(use_client, monkeypatch):
+    monkeypatch.setattr(ai_matching, "AI_CANDIDATES_TOP_K", 2)
+    client = use_client(FakeAIClient(match_same_id))
+    bank_txns = [bank_line("B1", "VENDOR1 INVOICE", 101.0), bank_line("B7", "UNKNOWN", 99999.0, "2024-01-01")]
+    gl_txns = [gl_entry(f"G{i}", f"Vendor{i} invoice", 100.0 + i) for i in range(6)]
+
+    matches, _ = asyncio.run(ai_match_stage(bank_txns, gl_txns, ai_mode="single"))
+
+    assert [(match.bank_transaction_id, match.gl_transaction_id) for match in matches] == [("B1", "G1")]
+    [prompt] = client.prompts
+    assert prompt.count("- ID: G") == 2
+
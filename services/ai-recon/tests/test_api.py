@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from app import pipeline
+from app.main import app
+from app.pipeline import reconcile_stages
+
+client = TestClient(app)
+
+BANK_LINES = [
+    {"transaction_id": "B1", "transaction_date": "2025-01-15", "description": "Office rent payment",
+     "amount": 5000.0, "transaction_type": "debit"},
+    {"transaction_id": "B2", "transaction_date": "2025-01-17", "description": "DEWA electricity bill",
+     "amount": 450.0, "transaction_type": "debit"},
+    {"transaction_id": "B3", "transaction_date": "2025-01-19", "description": "Unknown transfer",
+     "amount": 77.0, "transaction_type": "credit"},
+]
+GL_LINES = [
+    {"entry_id": "G1", "entry_date": "2025-01-15", "description": "Monthly office rent",
+     "amount": 5000.0, "account_code": "6100", "account_name": "Rent Expense"},
+    {"entry_id": "G2", "entry_date": "2025-01-18", "description": "DEWA electricity bill January",
+     "amount": 450.0, "account_code": "6200", "account_name": "Utilities Expense"},
+    {"entry_id": "G3", "entry_date": "2025-01-20", "description": "Bank charges",
+     "amount": 12.0, "account_code": "6900", "account_name": "Bank Charges"},
+]
+
+
+def reconcile_body(**options) -> dict:
+    return {
+        "tenant_id": "00000000-0000-0000-0000-000000000001",
+        "account_id": "BANK-001",
+        "bank_transactions": BANK_LINES,
+        "gl_transactions": GL_LINES,
+        **options,
+    }
+
+
+def stream_records(**options) -> list:
+    response = client.post("/reconcile/stream", json=reconcile_body(**options))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_sends_matches_per_stage_then_one_summary():
+    records = stream_records()
+
+    assert [record["type"] for record in records] == [
+        "match", "stage_complete",  # exact
+        "stage_complete",  # reference
+        "match", "stage_complete",  # fuzzy
+        "stage_complete",  # ai
+        "summary",
+    ]
+    assert [(record["match"]["bank_transaction_id"], record["match"]["match_type"])
+            for record in records if record["type"] == "match"] == [("B1", "exact"), ("B2", "fuzzy")]
+    summary = records[-1]
+    assert summary["unmatched_bank"] == ["B3"]
+    assert summary["unmatched_gl"] == ["G3"]
+    assert summary["account_id"] == "BANK-001"
+    assert round(summary["reconciliation_rate"], 1) == 66.7
+    assert set(summary["stage_timings_ms"]) == {"exact", "reference", "fuzzy", "ai"}
+
+
+def test_stream_and_reconcile_agree():
+    records = stream_records(assignment="optimal")
+    response = client.post("/reconcile", json=reconcile_body(assignment="optimal"))
+
+    assert response.status_code == 200
+    streamed = [record["match"] for record in records if record["type"] == "match"]
+    assert streamed == response.json()["matches"]
+    assert records[-1]["unmatched_bank"] == response.json()["unmatched_bank"]
+
+
+def test_stream_reports_failures_as_an_error_record(monkeypatch):
+    def failing_stages(*args, **kwargs):
+        raise RuntimeError("boom")
+        yield
+
+    monkeypatch.setattr(pipeline, "deterministic_stages", failing_stages)
+
+    records = stream_records()
+
+    assert records == [{"type": "error", "detail": "Reconciliation failed: boom"}]
+
+
+def test_deterministic_stages_do_not_block_the_event_loop(monkeypatch):
+    def slow_stages(bank_txns, gl_txns, **options):
+        time.sleep(0.3)  # stands in for the CPU-bound stages of a large statement
+        yield {"type": "stage_complete", "stage": "exact", "duration_ms": 300.0, "matches": 0}
+
+    monkeypatch.setattr(pipeline, "deterministic_stages", slow_stages)
+
+    async def run():
+        ticks = 0
+        reconciling = asyncio.ensure_future(pipeline_events())
+        while not reconciling.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks, reconciling.result()
+
+    async def pipeline_events():
+        return [event["type"] async for event in reconcile_stages([], [])]
+
+    ticks, events = asyncio.run(run())
+
+    assert events == ["stage_complete", "stage_complete", "summary"]
+    assert ticks >= 10
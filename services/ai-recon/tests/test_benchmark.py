@@ -0,0 +1,86 @@
+import asyncio
+import importlib.util
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from app import ai_matching
+from app.models import BankTransaction, GLTransaction
+from app.pipeline import reconcile_transactions
+
+BENCHMARK_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "benchmark-reconciliation.py"
+)
+
+
+@pytest.fixture(scope="module")
+def benchmark():
+    """The repository-level benchmark script, loaded as a module"""
+    spec = importlib.util.spec_from_file_location("benchmark_reconciliation", BENCHMARK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_statements_are_reproducible_per_size_and_seed(benchmark):
+    assert benchmark.generate_statement(200, seed=7) == benchmark.generate_statement(200, seed=7)
+    assert benchmark.generate_statement(200, seed=7) != benchmark.generate_statement(200, seed=8)
+
+
+def test_ground_truth_covers_every_noise_category(benchmark):
+    bank_txns, gl_txns, truth = benchmark.generate_statement(2000, seed=42)
+    bank_ids = {txn["transaction_id"] for txn in bank_txns}
+    gl_ids = {gl["entry_id"] for gl in gl_txns}
+
+    assert len(bank_txns) == 2000
+    assert all(bank_id in bank_ids and gl_id in gl_ids for bank_id, gl_id in truth)
+    assert set(truth.values()) == {"clean", "date_shift", "reworded", "split"}
+    # Missing GL entries leave bank lines out of the truth; GL-only entries are in no pair
+    matched_bank = {bank_id for bank_id, _ in truth}
+    assert 0.02 < 1 - len(matched_bank) / len(bank_txns) < 0.08
+    assert len(gl_ids - {gl_id for _, gl_id in truth}) == int(2000 * benchmark.GL_ONLY_RATE)
+
+
+def test_split_parts_sum_to_the_bank_amount(benchmark):
+    bank_txns, gl_txns, truth = benchmark.generate_statement(2000, seed=42)
+    amounts = {txn["transaction_id"]: txn["amount"] for txn in bank_txns}
+    amounts.update({gl["entry_id"]: gl["amount"] for gl in gl_txns})
+    parts = Counter()
+    for (bank_id, gl_id), category in truth.items():
+        if category == "split":
+            parts[bank_id] += round(amounts[gl_id] * 100)
+
+    assert parts
+    assert all(total == round(amounts[bank_id] * 100) for bank_id, total in parts.items())
+
+
+def test_score_matches_counts_group_pairs(benchmark):
+    truth = {("B1", "G1"): "clean", ("B2", "G2"): "split", ("B2", "G3"): "split"}
+    matches = [
+        SimpleNamespace(bank_transaction_id="B1", gl_transaction_id="G1"),
+        SimpleNamespace(bank_transaction_id="B3", gl_transaction_id="G9"),
+    ]
+    groups = [SimpleNamespace(bank_transaction_ids=["B2"], gl_transaction_ids=["G2", "G3"])]
+
+    score = benchmark.score_matches(truth, matches, groups)
+
+    assert (score["predicted_pairs"], score["correct_pairs"]) == (4, 3)
+    assert score["precision"] == 0.75 and score["recall"] == 1.0
+    assert score["recall_by_noise"] == {"clean": 1.0, "split": 1.0}
+
+
+def test_stub_client_answers_from_the_ground_truth(benchmark, monkeypatch):
+    bank_dicts, gl_dicts, truth = benchmark.generate_statement(300, seed=3)
+    stub = benchmark.StubAIClient(truth)
+    monkeypatch.setattr(ai_matching, "ai_client", stub)
+    monkeypatch.setattr(ai_matching, "ai_semaphore", asyncio.Semaphore(ai_matching.AI_MAX_CONCURRENCY))
+
+    matches, group_matches, *_ = asyncio.run(reconcile_transactions(
+        [BankTransaction(**txn) for txn in bank_dicts], [GLTransaction(**gl) for gl in gl_dicts], split_matching=True
+    ))
+    score = benchmark.score_matches(truth, matches, group_matches)
+
+    assert stub.calls > 0
+    assert score["precision"] > 0.9 and score["recall"] > 0.8
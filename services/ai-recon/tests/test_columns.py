@@ -0,0 +1,122 @@
+from datetime import date
+
+import numpy as np
+
+from app.columns import RunVocabulary, TransactionColumns, amounts_to_fils, expand_ranges, to_day_ordinal
+from app.models import BankTransaction, GLTransaction
+from app.statement_ingest import StatementColumns
+
+
+def bank_line(transaction_id, transaction_date, description, amount):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+    )
+
+
+def gl_entry(entry_id, entry_date, description, amount):
+    return GLTransaction(
+        entry_id=entry_id,
+        entry_date=entry_date,
+        description=description,
+        amount=amount,
+        account_code="5000",
+        account_name="Expenses",
+    )
+
+
+def row_tokens(columns, row):
+    return columns.token_ids[columns.token_offsets[row]:columns.token_offsets[row + 1]].tolist()
+
+
+def test_amounts_are_rounded_to_fils():
+    assert amounts_to_fils([450.25, 0.1 + 0.2, 1e-3]).tolist() == [45025, 30, 0]
+
+
+def test_expand_ranges_concatenates_aranges():
+    assert expand_ranges(np.array([5, 0, 10]), np.array([2, 0, 3])).tolist() == [5, 6, 10, 11, 12]
+
+
+def test_unparseable_dates_get_day_minus_one_and_their_own_key():
+    vocabulary = RunVocabulary()
+    columns = TransactionColumns.from_bank(
+        [
+            bank_line("B1", "2025-01-15", "x", 1.0),
+            bank_line("B2", "15/01/2025", "x", 1.0),
+            bank_line("B3", "2025-01-15T10:00:00", "x", 1.0),
+        ],
+        vocabulary,
+    )
+
+    assert columns.days.tolist() == [to_day_ordinal("2025-01-15"), -1, date(2025, 1, 15).toordinal()]
+    # Date keys intern the raw string: the exact stage only pairs identical date strings
+    assert len(set(columns.date_keys.tolist())) == 3
+
+
+def test_bank_and_gl_columns_share_one_vocabulary():
+    vocabulary = RunVocabulary()
+    bank = TransactionColumns.from_bank([bank_line("B1", "2025-01-15", "DEWA electricity bill", 450.0)], vocabulary)
+    gl = TransactionColumns.from_gl([gl_entry("G1", "2025-01-15", "Electricity bill DEWA dewa", 450.0)], vocabulary)
+
+    assert row_tokens(bank, 0) == row_tokens(gl, 0)
+    assert row_tokens(bank, 0) == sorted(row_tokens(bank, 0))
+    assert bank.date_keys[0] == gl.date_keys[0]
+    assert sorted(vocabulary.words) == ["bill", "dewa", "electricity"]
+
+
+def test_tokens_are_stored_as_csr_rows():
+    vocabulary = RunVocabulary()
+    columns = TransactionColumns.from_gl(
+        [gl_entry("G1", "2025-01-15", "rent", 1.0), gl_entry("G2", "2025-01-15", "", 1.0),
+         gl_entry("G3", "2025-01-15", "rent office", 1.0)],
+        vocabulary,
+    )
+
+    assert columns.token_offsets.tolist() == [0, 1, 1, 3]
+    positions, tokens = columns.gather_tokens(np.array([2, 0]))
+    assert positions.tolist() == [0, 0, 1]
+    assert tokens.tolist() == row_tokens(columns, 2) + row_tokens(columns, 0)
+
+
+def test_counterparty_mask_skips_short_and_numeric_words():
+    vocabulary = RunVocabulary()
+    vocabulary.tokenize(["TRF to ACME 00123 co"])
+
+    mask = vocabulary.counterparty_mask()
+
+    assert {word for word, token in vocabulary.words.items() if mask[token]} == {"trf", "acme"}
+
+
+def test_statement_columns_give_the_same_columns_as_their_rows():
+    statement = StatementColumns()
+    statement.append(450.25, True, date(2025, 1, 15), "DEWA BILL", "REF-1")
+    statement.append(1200.0, False, None, "Salary", None, raw_date="15/13/2025")
+
+    from_statement = TransactionColumns.from_bank(statement, RunVocabulary())
+    from_rows = TransactionColumns.from_bank(
+        [BankTransaction(**row._asdict()) for row in statement], RunVocabulary()
+    )
+
+    assert from_statement.transactions is statement
+    assert from_statement.ids == from_rows.ids == ["BANK-0001", "BANK-0002"]
+    assert from_statement.references == ["REF-1", None]
+    for name in ("amounts_fils", "date_keys", "days", "token_offsets", "token_ids"):
+        assert np.array_equal(getattr(from_statement, name), getattr(from_rows, name)), name
+
+
+def test_with_descriptions_retokenizes_only_the_copy():
+    vocabulary = RunVocabulary()
+    columns = TransactionColumns.from_bank(
+        [bank_line("B1", "2025-01-15", "FB ADS", 10.0), bank_line("B2", "2025-01-15", "rent", 20.0)], vocabulary
+    )
+
+    replaced = columns.with_descriptions({0: "meta platforms"}, vocabulary)
+
+    assert replaced.descriptions == ["meta platforms", "rent"]
+    assert columns.descriptions == ["FB ADS", "rent"]
+    assert replaced.amounts_fils is columns.amounts_fils
+    assert sorted(vocabulary.words[word] for word in ("meta", "platforms")) == sorted(row_tokens(replaced, 0))
+    assert row_tokens(replaced, 1) == row_tokens(columns, 1)
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import ai_matching
+from app.ai_matching import ai_match_stage, gather_until
+from app.jobs import run_pending_ai_job
+from app.main import app
+from app.models import BankTransaction, GLTransaction, ReconciliationJob, ReconciliationRequest
+from app.pipeline import reconcile_transactions
+
+TENANT_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def bank_line(transaction_id, description, amount, transaction_date="2025-06-10"):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+    )
+
+
+def gl_entry(entry_id, description, amount, entry_date="2025-06-10"):
+    return GLTransaction(
+        entry_id=entry_id,
+        entry_date=entry_date,
+        description=description,
+        amount=amount,
+        account_code="5000",
+        account_name="Expenses",
+    )
+
+
+class SlowLineClient:
+    """Fake AI client pairing bank line Bn with GL entry Gn; prompts mentioning SLOW take `slow_latency` seconds"""
+
+    def __init__(self, slow_latency: float):
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def create(self, model, max_tokens, temperature, messages):
+        self.calls += 1
+        prompt = messages[0]["content"]
+        await asyncio.sleep(self.slow_latency if "SLOW" in prompt else 0)
+        bank_id = re.split(r"[,\n]", prompt.split("- ID: ", 1)[1], 1)[0]
+        answer = {"bank_id": bank_id, "matched_gl_id": "G" + bank_id[1:], "confidence": 0.9, "reasoning": "Paid"}
+        if "Bank Transactions:" in prompt:
+            answer = [answer]
+        return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(answer))], usage=None)
+
+
+@pytest.fixture
+def slow_client(monkeypatch):
+    def install(slow_latency):
+        client = SlowLineClient(slow_latency)
+        monkeypatch.setattr(ai_matching, "ai_client", client)
+        monkeypatch.setattr(ai_matching, "ai_semaphore", asyncio.Semaphore(ai_matching.AI_MAX_CONCURRENCY))
+        return client
+
+    return install
+
+
+# Two lines only the AI stage can match (no shared words, dates apart): B1 answers at once, B2 is slow
+AI_BANK = [bank_line("B1", "IBFT 88213", 101.0), bank_line("B2", "IBFT SLOW 90417", 102.0)]
+AI_GL = [gl_entry("G1", "Consulting fee", 101.0, "2025-06-12"), gl_entry("G2", "Catering June", 102.0, "2025-06-12")]
+
+
+def test_gather_until_without_deadline_waits_for_everything():
+    async def value(v, delay):
+        await asyncio.sleep(delay)
+        return v
+
+    assert asyncio.run(gather_until(None, [value(1, 0.02), value(2, 0)])) == ([1, 2], [])
+    assert asyncio.run(gather_until(None, [])) == ([], [])
+
+
+def test_gather_until_cancels_what_is_still_running_at_the_deadline():
+    cancelled = []
+
+    async def value(v, delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(v)
+            raise
+        return v
+
+    async def run():
+        return await gather_until(time.monotonic() + 0.05, [value(1, 0), value(2, 5), value(3, 0.01)])
+
+    started = time.monotonic()
+    results, unfinished = asyncio.run(run())
+
+    assert time.monotonic() - started < 1
+    assert results == [1, None, 3]
+    assert unfinished == [1]
+    assert cancelled == [2]
+
+
+def test_expired_deadline_leaves_every_ai_line_pending(slow_client):
+    client = slow_client(0)
+
+    matches, pending = asyncio.run(ai_match_stage(AI_BANK, AI_GL, ai_mode="single", deadline=time.monotonic() - 1))
+
+    assert (matches, pending) == ([], ["B1", "B2"])
+    assert client.calls == 0
+
+
+@pytest.mark.parametrize("ai_mode", ["single", "batched"])
+def test_deadline_returns_finished_ai_matches_and_the_pending_lines(slow_client, monkeypatch, ai_mode):
+    monkeypatch.setattr(ai_matching, "AI_BATCH_SIZE", 1)
+    slow_client(5)
+
+    async def run():
+        return await ai_match_stage(AI_BANK, AI_GL, ai_mode=ai_mode, deadline=time.monotonic() + 0.1)
+
+    matches, pending = asyncio.run(run())
+
+    assert [(m.bank_transaction_id, m.gl_transaction_id) for m in matches] == [("B1", "G1")]
+    assert pending == ["B2"]
+
+
+def test_deterministic_stages_finish_even_after_the_deadline(slow_client):
+    slow_client(0)
+    bank_txns = [bank_line("B0", "Office rent", 5000.0)] + AI_BANK
+    gl_txns = [gl_entry("G0", "Office rent", 5000.0)] + AI_GL
+
+    matches, _, unmatched_bank, _, _, pending = asyncio.run(
+        reconcile_transactions(bank_txns, gl_txns, deadline=time.monotonic() - 1)
+    )
+
+    assert [m.bank_transaction_id for m in matches] == ["B0"]
+    assert unmatched_bank == ["B1", "B2"]
+    assert pending == ["B1", "B2"]
+
+
+def test_pending_ai_job_covers_only_the_pending_lines(slow_client):
+    slow_client(0)
+    job = ReconciliationJob(job_id="pending-1", status="queued", total_accounts=1, created_at="2025-06-10")
+    request = ReconciliationRequest(tenant_id=TENANT_ID, account_id="BANK-001", ai_mode="single")
+
+    asyncio.run(run_pending_ai_job(job, request, AI_BANK[1:], AI_GL[1:] + [gl_entry("G9", "Other", 7.0)]))
+
+    assert job.status == "completed" and job.completed_accounts == 1
+    [result] = job.results
+    assert [(m.bank_transaction_id, m.gl_transaction_id) for m in result.result.matches] == [("B2", "G2")]
+    assert result.result.unmatched_bank == []
+    assert result.result.unmatched_gl == ["G9"]
+
+
+def test_reconcile_with_deadline_hands_pending_lines_to_a_job(slow_client):
+    slow_client(0.5)
+    body = {
+        "tenant_id": TENANT_ID,
+        "account_id": "BANK-001",
+        "bank_transactions": [txn.model_dump() for txn in AI_BANK],
+        "gl_transactions": [gl.model_dump() for gl in AI_GL],
+        "ai_mode": "single",
+        "deadline_ms": 150,
+    }
+
+    with TestClient(app) as client:
+        result = client.post("/reconcile", json=body).json()
+
+        assert [m["bank_transaction_id"] for m in result["matches"]] == ["B1"]
+        assert result["pending_ai"] == ["B2"]
+        assert result["unmatched_gl"] == ["G2"]
+
+        for _ in range(300):
+            job = client.get(f"/jobs/{result['pending_ai_job_id']}").json()
+            if job["status"] == "completed":
+                break
+            time.sleep(0.01)
+
+    [account] = job["results"]
+    assert [(m["bank_transaction_id"], m["gl_transaction_id"]) for m in account["result"]["matches"]] == [("B2", "G2")]
+
+
+def test_reconcile_without_pending_lines_starts_no_job(slow_client):
+    slow_client(0)
+    body = {
+        "tenant_id": TENANT_ID,
+        "account_id": "BANK-001",
+        "bank_transactions": [txn.model_dump() for txn in AI_BANK],
+        "gl_transactions": [gl.model_dump() for gl in AI_GL],
+        "ai_mode": "single",
+        "deadline_ms": 5000,
+    }
+
+    with TestClient(app) as client:
+        result = client.post("/reconcile", json=body).json()
+
+    assert result["pending_ai"] == [] and result["pending_ai_job_id"] is None
+    assert len(result["matches"]) == 2
@@ -0,0 +1,221 @@
+import asyncio
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import psycopg2
+import pytest
+from fastapi import HTTPException
+
+from app import gl_source
+from app.columns import GLColumns, RunVocabulary, TransactionColumns
+from app.gl_source import gl_date_range, load_open_gl_lines, resolve_gl_transactions
+from app.models import BankTransaction, GLTransaction, ReconciliationRequest
+from app.pipeline import reconcile_transactions
+
+TENANT_ID = "00000000-0000-0000-0000-000000000001"
+ACCOUNT_ID = "00000000-0000-0000-0000-0000000000a1"
+
+GL_ROWS = [
+    ("L1", "2025-03-01", "Office rent March", Decimal("5000.0000"), "1010", "Bank - ENBD"),
+    ("L2", "2025-03-02", "DEWA electricity bill", Decimal("450.2500"), "1010", "Bank - ENBD"),
+    ("L3", "2025-03-02", "DEWA electricity bill", Decimal("12.5000"), "1010", "Bank - ENBD"),
+    ("L4", "2025-03-05", "Bank charges", Decimal("25.0000"), "1010", "Bank - ENBD"),
+    ("L5", "2025-03-09", "Staff lunch", Decimal("310.0000"), "1010", "Bank - ENBD"),
+]
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetch_sizes = []
+        self.params = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        self.params = params
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def __iter__(self):
+        raise AssertionError("rows must be fetched in batches")
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.closed = 0
+        self.rolled_back = False
+
+    def cursor(self, name=None):
+        assert name, "expected a named (server-side) cursor"
+        return self._cursor
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = False
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned = True
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    cursor = FakeCursor(GL_ROWS)
+    pool = FakePool(FakeConnection(cursor))
+    monkeypatch.setattr(gl_source, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(gl_source, "GL_FETCH_BATCH_SIZE", 2)
+    return cursor, pool
+
+
+def gl_list():
+    return [
+        GLTransaction(
+            entry_id=line_id,
+            entry_date=entry_date,
+            description=description,
+            amount=float(amount),
+            account_code=account_code,
+            account_name=account_name,
+        )
+        for line_id, entry_date, description, amount, account_code, account_name in GL_ROWS
+    ]
+
+
+def gl_columns():
+    gl_lines = GLColumns()
+    gl_lines.extend(GL_ROWS)
+    return gl_lines
+
+
+def bank_line(transaction_id, transaction_date, description, amount):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+    )
+
+
+def database_request(**fields):
+    return ReconciliationRequest(tenant_id=TENANT_ID, account_id=ACCOUNT_ID, gl_source="database", **fields)
+
+
+def test_cursor_batches_go_straight_into_gl_columns(fake_db):
+    cursor, pool = fake_db
+
+    gl_lines = load_open_gl_lines(TENANT_ID, ACCOUNT_ID, date(2025, 2, 1), date(2025, 4, 1))
+
+    assert isinstance(gl_lines, GLColumns)
+    assert cursor.fetch_sizes == [2, 2, 2, 2]
+    assert cursor.params["bank_account_id"] == ACCOUNT_ID
+    assert gl_lines.ids == ["L1", "L2", "L3", "L4", "L5"]
+    assert list(gl_lines.amounts_fils) == [500000, 45025, 1250, 2500, 31000]
+    # Repeated strings are stored once
+    assert gl_lines.descriptions[1] is gl_lines.descriptions[2]
+    assert pool.conn.rolled_back and pool.returned
+
+
+def test_gl_columns_rows_match_the_model():
+    gl_lines = gl_columns()
+
+    assert len(gl_lines) == 5
+    assert [gl.model_dump() for gl in gl_lines] == [gl.model_dump() for gl in gl_list()]
+    assert gl_lines[-1].entry_id == "L5"
+    with pytest.raises(IndexError):
+        gl_lines[5]
+
+
+def test_transaction_columns_from_gl_columns_equal_the_row_path():
+    from_columns = TransactionColumns.from_gl(gl_columns(), RunVocabulary())
+    from_rows = TransactionColumns.from_gl(gl_list(), RunVocabulary())
+
+    assert from_columns.ids == from_rows.ids
+    assert np.array_equal(from_columns.amounts_fils, from_rows.amounts_fils)
+    assert np.array_equal(from_columns.date_keys, from_rows.date_keys)
+    assert np.array_equal(from_columns.token_ids, from_rows.token_ids)
+
+
+def test_reconciliation_over_gl_columns_matches_the_list_path():
+    bank_txns = [
+        bank_line("B1", "2025-03-01", "RENT MARCH", 5000.0),
+        bank_line("B2", "2025-03-03", "DEWA ELECTRICITY", 450.25),
+        bank_line("B3", "2025-03-20", "UNKNOWN", 9.99),
+    ]
+
+    def run(gl_txns):
+        matches, _, unmatched_bank, unmatched_gl, _, _ = asyncio.run(reconcile_transactions(bank_txns, gl_txns))
+        return [(m.bank_transaction_id, m.gl_transaction_id, m.match_type) for m in matches], unmatched_bank, unmatched_gl
+
+    assert run(gl_columns()) == run(gl_list())
+    matches, _, unmatched_gl = run(gl_columns())
+    assert [(bank_id, gl_id) for bank_id, gl_id, _ in matches] == [("B1", "L1"), ("B2", "L2")]
+    assert unmatched_gl == ["L3", "L4", "L5"]
+
+
+def test_gl_date_range_pads_the_bank_dates(monkeypatch):
+    monkeypatch.setattr(gl_source, "GL_DB_DATE_PADDING_DAYS", 10)
+    bank_txns = [bank_line("B1", "2025-03-05", "X", 1.0), bank_line("B2", "2025-03-20", "X", 1.0)]
+
+    assert gl_date_range(database_request(), bank_txns) == (date(2025, 2, 23), date(2025, 3, 30))
+    assert gl_date_range(database_request(gl_date_from="2025-01-01"), bank_txns) == (
+        date(2025, 1, 1), date(2025, 3, 30)
+    )
+
+
+def test_gl_date_range_needs_bounds_without_bank_dates():
+    with pytest.raises(HTTPException) as error:
+        gl_date_range(database_request(), [bank_line("B1", "15/03/2025", "X", 1.0)])
+    assert error.value.status_code == 400
+
+
+def test_request_source_returns_the_body_lines():
+    request = ReconciliationRequest(tenant_id="t", account_id="a", gl_transactions=gl_list())
+
+    assert asyncio.run(resolve_gl_transactions(request, [])) == request.gl_transactions
+
+
+def test_database_source_requires_uuids():
+    request = ReconciliationRequest(tenant_id=TENANT_ID, account_id="BANK-001", gl_source="database")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(resolve_gl_transactions(request, [bank_line("B1", "2025-03-01", "X", 1.0)]))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("exception, status_code", [
+    (psycopg2.OperationalError("connection refused"), 503),
+    (psycopg2.ProgrammingError("bad query"), 500),
+])
+def test_database_errors_map_to_http_status(monkeypatch, exception, status_code):
+    def fail(*args):
+        raise exception
+
+    monkeypatch.setattr(gl_source, "load_open_gl_lines", fail)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(resolve_gl_transactions(database_request(), [bank_line("B1", "2025-03-01", "X", 1.0)]))
+    assert error.value.status_code == status_code
+
+
+def test_database_source_returns_the_loaded_columns(fake_db):
+    gl_lines = asyncio.run(resolve_gl_transactions(database_request(), [bank_line("B1", "2025-03-01", "X", 1.0)]))
+
+    assert isinstance(gl_lines, GLColumns) and gl_lines.ids == ["L1", "L2", "L3", "L4", "L5"]
@@ -0,0 +1,137 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import jobs
+from app.jobs import run_reconciliation_job, store_job
+from app.main import app
+from app.models import ReconciliationJob, ReconciliationRequest
+from app.pipeline import reconcile_transactions
+
+TENANT_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def account_request(account_id, **fields):
+    return ReconciliationRequest(
+        tenant_id=TENANT_ID,
+        account_id=account_id,
+        bank_transactions=[
+            {"transaction_id": f"{account_id}-B1", "transaction_date": "2025-01-15",
+             "description": "Office rent payment", "amount": 5000.0, "transaction_type": "debit"},
+            {"transaction_id": f"{account_id}-B2", "transaction_date": "2025-01-19",
+             "description": "Unknown transfer", "amount": 77.0, "transaction_type": "credit"},
+        ],
+        gl_transactions=[
+            {"entry_id": f"{account_id}-G1", "entry_date": "2025-01-15", "description": "Monthly office rent",
+             "amount": 5000.0, "account_code": "6100", "account_name": "Rent Expense"},
+        ],
+        **fields,
+    )
+
+
+def new_job(job_id="job-1", total_accounts=1, status="queued"):
+    return ReconciliationJob(job_id=job_id, status=status, total_accounts=total_accounts, created_at="2025-01-01")
+
+
+@pytest.fixture
+def thread_executor(monkeypatch):
+    """Run job accounts' deterministic stages in threads instead of a spawned process pool"""
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(jobs, "get_job_executor", lambda: executor)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_job_reconciles_every_account_and_reports_failures(thread_executor):
+    job = new_job(total_accounts=3)
+    accounts = [
+        account_request("ACC-1"),
+        account_request("ACC-2"),
+        account_request("ACC-3", statement_id="missing"),
+    ]
+
+    asyncio.run(run_reconciliation_job(job, accounts))
+
+    assert job.status == "completed" and job.finished_at
+    assert (job.completed_accounts, job.failed_accounts) == (2, 1)
+    assert job.running == {}
+    results = {result.account_id: result for result in job.results}
+    assert results["ACC-3"].status == "failed" and "not found" in results["ACC-3"].error
+    for account_id in ("ACC-1", "ACC-2"):
+        response = results[account_id].result
+        assert [(m.bank_transaction_id, m.gl_transaction_id) for m in response.matches] == [
+            (f"{account_id}-B1", f"{account_id}-G1")
+        ]
+        assert response.unmatched_bank == [f"{account_id}-B2"]
+
+
+def test_job_limits_concurrent_accounts(monkeypatch, thread_executor):
+    monkeypatch.setattr(jobs, "RECON_JOB_MAX_CONCURRENT_ACCOUNTS", 2)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def slow_reconcile(request, executor=None, on_event=None):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(jobs, "reconcile_request", slow_reconcile)
+    job = new_job(total_accounts=5)
+
+    asyncio.run(run_reconciliation_job(job, [account_request(f"ACC-{i}") for i in range(5)]))
+
+    assert max_in_flight == 2
+    assert job.failed_accounts == 5 and all(result.error == "boom" for result in job.results)
+
+
+def test_store_job_evicts_the_oldest_finished_jobs_only(monkeypatch):
+    monkeypatch.setattr(jobs, "reconciliation_jobs", type(jobs.reconciliation_jobs)())
+    monkeypatch.setattr(jobs, "MAX_STORED_JOBS", 2)
+
+    store_job(new_job("running", status="running"))
+    store_job(new_job("done-1", status="completed"))
+    store_job(new_job("done-2", status="completed"))
+    store_job(new_job("done-3", status="completed"))
+
+    assert list(jobs.reconciliation_jobs) == ["running", "done-3"]
+
+
+def test_jobs_endpoints_run_and_page_results(thread_executor):
+    body = {"accounts": [account_request(f"ACC-{i}").model_dump(mode="json") for i in range(3)]}
+
+    with TestClient(app) as client:
+        created = client.post("/jobs/reconcile", json=body)
+        assert created.status_code == 202
+        job_id = created.json()["job_id"]
+
+        for _ in range(200):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] == "completed":
+                break
+            time.sleep(0.01)
+
+        assert job["completed_accounts"] == 3 and len(job["results"]) == 3
+        assert len(client.get(f"/jobs/{job_id}", params={"since": 2}).json()["results"]) == 1
+        assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_process_pool_stages_match_the_in_process_run():
+    request = account_request("ACC-1")
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        in_pool = asyncio.run(reconcile_transactions(
+            request.bank_transactions, request.gl_transactions, executor=executor
+        ))
+    finally:
+        executor.shutdown(wait=True)
+    in_process = asyncio.run(reconcile_transactions(request.bank_transactions, request.gl_transactions))
+
+    assert in_pool[0] == in_process[0]
+    assert in_pool[2:4] == in_process[2:4]
@@ -0,0 +1,472 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.columns import NgramIndex, RunVocabulary, TransactionColumns
+from app import matching
+from app.matching import (
+    FUZZY_AMOUNT_WEIGHT,
+    FUZZY_DESCRIPTION_WEIGHT,
+    FUZZY_MAX_AMOUNT_DIFF,
+    FUZZY_SCORE_THRESHOLD,
+    StageStats,
+    ReferenceIndex,
+    exact_stage,
+    fuzzy_stage,
+    normalize_reference,
+    optimal_assignment,
+    reference_match_stage,
+    split_match_stage,
+    subset_sum,
+)
+from app.models import BankTransaction, GLTransaction
+from app.pipeline import deterministic_stages
+
+
+def bank_line(transaction_id, transaction_date, description, amount, reference_number=None):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+        reference_number=reference_number,
+    )
+
+
+def gl_entry(entry_id, entry_date, description, amount):
+    return GLTransaction(
+        entry_id=entry_id,
+        entry_date=entry_date,
+        description=description,
+        amount=amount,
+        account_code="5000",
+        account_name="Expenses",
+    )
+
+
+def build_columns(bank_txns, gl_txns):
+    vocabulary = RunVocabulary()
+    bank = TransactionColumns.from_bank(bank_txns, vocabulary)
+    gl = TransactionColumns.from_gl(gl_txns, vocabulary)
+    return vocabulary, bank, gl
+
+
+def run_stage(stage, bank_txns, gl_txns, *args):
+    """(bank ID, GL ID, match) for every match of a row-level stage over all lines"""
+    _, bank, gl = build_columns(bank_txns, gl_txns)
+    matches = stage(bank, np.arange(len(bank)), gl, np.arange(len(gl)), *args)
+    return [(bank_txns[bank_row].transaction_id, gl_txns[gl_row].entry_id, match) for bank_row, gl_row, match in matches]
+
+
+def pairs(matches):
+    return {(bank_id, gl_id) for bank_id, gl_id, _ in matches}
+
+
+# ============================================
+# EXACT STAGE
+# ============================================
+
+def test_exact_stage_pairs_same_amount_and_date():
+    bank_txns = [bank_line("B1", "2025-01-15", "DEWA BILL", 450.25)]
+    gl_txns = [
+        gl_entry("G1", "2025-01-16", "Electricity bill", 450.25),
+        gl_entry("G2", "2025-01-15", "Electricity bill", 450.25),
+    ]
+
+    matches = run_stage(exact_stage, bank_txns, gl_txns)
+
+    assert pairs(matches) == {("B1", "G2")}
+    assert matches[0][2].match_type == "exact"
+    assert matches[0][2].confidence_score == 1.0
+
+
+def test_exact_stage_pairs_repeated_keys_in_input_order():
+    bank_txns = [bank_line(f"B{i}", "2025-01-15", "SALARY", 1000.0) for i in range(1, 4)]
+    gl_txns = [gl_entry(f"G{i}", "2025-01-15", "Staff wages", 1000.0) for i in range(1, 3)]
+
+    matches = run_stage(exact_stage, bank_txns, gl_txns)
+
+    assert [(bank_id, gl_id) for bank_id, gl_id, _ in matches] == [("B1", "G1"), ("B2", "G2")]
+
+
+def test_exact_stage_records_stats():
+    bank_txns = [bank_line("B1", "2025-01-15", "RENT", 100.0), bank_line("B2", "2025-01-15", "RENT", 200.0)]
+    gl_txns = [gl_entry("G1", "2025-01-15", "Rent", 100.0)]
+    stats = StageStats()
+
+    run_stage(exact_stage, bank_txns, gl_txns, stats)
+
+    assert stats.lines == 2
+    assert stats.candidates == 1
+
+
+def test_exact_stage_agrees_with_greedy_scan():
+    rng = np.random.default_rng(7)
+    bank_txns = [
+        bank_line(f"B{i}", f"2025-01-{rng.integers(1, 4):02d}", "PAYMENT", float(rng.integers(1, 6) * 100))
+        for i in range(60)
+    ]
+    gl_txns = [
+        gl_entry(f"G{i}", f"2025-01-{rng.integers(1, 4):02d}", "Payment", float(rng.integers(1, 6) * 100))
+        for i in range(50)
+    ]
+
+    expected, taken = [], set()
+    for bank_txn in bank_txns:
+        for gl_txn in gl_txns:
+            if (gl_txn.entry_id not in taken and gl_txn.amount == bank_txn.amount
+                    and gl_txn.entry_date == bank_txn.transaction_date):
+                taken.add(gl_txn.entry_id)
+                expected.append((bank_txn.transaction_id, gl_txn.entry_id))
+                break
+
+    matches = run_stage(exact_stage, bank_txns, gl_txns)
+
+    assert sorted((bank_id, gl_id) for bank_id, gl_id, _ in matches) == sorted(expected)
+
+
+# ============================================
+# REFERENCE STAGE
+# ============================================
+
+def test_normalize_reference_keeps_letters_and_digits():
+    assert normalize_reference("inv-2024/001") == "INV2024001"
+
+
+def test_reference_index_keys_on_entry_ids_and_numbered_words():
+    gl_txns = [
+        gl_entry("JE-5512", "2025-02-01", "Payment to supplier", 100.0),
+        gl_entry("G2", "2025-02-01", "Invoice INV-7781 freight", 200.0),
+        gl_entry("G3", "2025-02-01", "Cheque 12 rent", 300.0),
+    ]
+    _, _, gl = build_columns([], gl_txns)
+
+    index = ReferenceIndex(gl, np.arange(len(gl)))
+
+    assert index.lookup("je 5512") == [0]
+    assert index.lookup("INV/7781") == [1]
+    assert index.lookup("12") == []  # shorter than MIN_KEY_LENGTH
+    assert index.lookup(None) == []
+
+
+def test_reference_stage_matches_across_dates_and_descriptions():
+    bank_txns = [bank_line("B1", "2025-02-20", "TRF 000912", 1000.0, reference_number="INV-7781")]
+    gl_txns = [
+        gl_entry("G1", "2025-02-02", "Emirates Logistics INV7781", 1000.0),
+        gl_entry("G2", "2025-02-20", "Emirates Logistics", 1000.0),
+    ]
+
+    matches = run_stage(reference_match_stage, bank_txns, gl_txns)
+
+    assert pairs(matches) == {("B1", "G1")}
+    assert matches[0][2].match_type == "reference"
+    assert matches[0][2].confidence_score == 0.99
+
+
+def test_reference_stage_prefers_closest_amount_then_date():
+    bank_txns = [
+        bank_line("B1", "2025-02-10", "PAYMENT", 1000.0, reference_number="PO-4410"),
+        bank_line("B2", "2025-02-10", "PAYMENT", 1000.0, reference_number="PO-4410"),
+    ]
+    gl_txns = [
+        gl_entry("G1", "2025-02-01", "PO-4410 part", 1005.0),
+        gl_entry("G2", "2025-02-01", "PO-4410 part", 1000.0),
+        gl_entry("G3", "2025-02-09", "PO-4410 part", 1000.0),
+    ]
+
+    matches = run_stage(reference_match_stage, bank_txns, gl_txns)
+
+    assert [(bank_id, gl_id) for bank_id, gl_id, _ in matches] == [("B1", "G3"), ("B2", "G2")]
+
+
+def test_reference_stage_rejects_amounts_outside_tolerance():
+    bank_txns = [
+        bank_line("B1", "2025-02-10", "PAYMENT", 1000.0, reference_number="PO-4410"),
+        bank_line("B2", "2025-02-10", "PAYMENT", 2000.0, reference_number="PO-9000"),
+    ]
+    gl_txns = [
+        gl_entry("G1", "2025-02-10", "PO-4410", 1015.0),
+        gl_entry("G2", "2025-02-10", "PO-9000", 2500.0),
+    ]
+    stats = StageStats()
+
+    matches = run_stage(reference_match_stage, bank_txns, gl_txns, stats)
+
+    assert pairs(matches) == {("B1", "G1")}
+    assert matches[0][2].confidence_score == 0.95
+    assert (stats.candidates, stats.lines) == (2, 2)
+
+
+# ============================================
+# FUZZY STAGE
+# ============================================
+
+def test_fuzzy_stage_matches_shifted_date_with_shared_words():
+    bank_txns = [bank_line("B1", "2025-03-01", "TRF DUBAI PROPERTIES OFFICE RENT", 25000.0)]
+    gl_txns = [
+        gl_entry("G1", "2025-03-03", "Office rent payment - Dubai Properties", 25000.0),
+        gl_entry("G2", "2025-03-03", "Fleet maintenance", 25000.0),
+    ]
+
+    matches = run_stage(fuzzy_stage, bank_txns, gl_txns)
+
+    assert pairs(matches) == {("B1", "G1")}
+    match = matches[0][2]
+    assert match.match_type == "fuzzy"
+    assert match.confidence_score >= 0.75
+
+
+def test_fuzzy_stage_skips_unrelated_descriptions():
+    bank_txns = [bank_line("B1", "2025-03-01", "ETISALAT TELECOM BILL", 830.0)]
+    gl_txns = [gl_entry("G1", "2025-03-02", "Vehicle fuel expenses", 830.0)]
+
+    assert run_stage(fuzzy_stage, bank_txns, gl_txns) == []
+
+
+def test_fuzzy_stage_respects_date_window():
+    bank_txns = [bank_line("B1", "2025-03-01", "AWS CLOUD HOSTING", 1200.0)]
+    gl_txns = [gl_entry("G1", "2025-03-20", "AWS cloud hosting", 1200.0)]
+
+    assert pairs(run_stage(fuzzy_stage, bank_txns, gl_txns, 0)) == {("B1", "G1")}
+    assert run_stage(fuzzy_stage, bank_txns, gl_txns, 7) == []
+
+
+def test_fuzzy_stage_gives_each_gl_entry_to_one_bank_line():
+    bank_txns = [
+        bank_line("B1", "2025-03-01", "DEWA ELECTRICITY PAYMENT", 500.0),
+        bank_line("B2", "2025-03-01", "DEWA ELECTRICITY PAYMENT", 500.0),
+    ]
+    gl_txns = [gl_entry("G1", "2025-03-02", "DEWA electricity payment", 500.0)]
+
+    assert pairs(run_stage(fuzzy_stage, bank_txns, gl_txns)) == {("B1", "G1")}
+
+
+def test_fuzzy_candidates_are_limited_to_the_amount_window():
+    bank_txns = [bank_line("B1", "2025-03-01", "GOOGLE WORKSPACE", 1000.0)]
+    near = 1000.0 * (1 - FUZZY_MAX_AMOUNT_DIFF) + 10
+    far = 1000.0 * (1 - FUZZY_MAX_AMOUNT_DIFF) - 10
+    gl_txns = [
+        gl_entry("G1", "2025-03-01", "Google workspace", far),
+        gl_entry("G2", "2025-03-01", "Google workspace", near),
+    ]
+    stats = StageStats()
+
+    matches = run_stage(fuzzy_stage, bank_txns, gl_txns, 0, stats)
+
+    assert pairs(matches) == {("B1", "G2")}
+    assert stats.candidates == 1  # G1 is outside the window and never scored
+
+
+def random_statement(size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    words = ["dewa", "rent", "office", "salary", "google", "fuel", "enoc", "parking", "visa", "fees"]
+    bank_txns, gl_txns = [], []
+    for i in range(size):
+        amount = float(rng.integers(50, 60) * 10)
+        description = " ".join(rng.choice(words, 3, replace=False))
+        bank_txns.append(bank_line(f"B{i}", f"2025-02-{rng.integers(1, 28):02d}", description.upper(), amount))
+        gl_txns.append(gl_entry(
+            f"G{i}", f"2025-02-{rng.integers(1, 28):02d}",
+            " ".join(rng.choice(words, 3, replace=False)), amount + float(rng.integers(-40, 40)),
+        ))
+    return bank_txns, gl_txns
+
+
+def test_vectorized_scores_match_the_scalar_formula(monkeypatch):
+    monkeypatch.setattr(matching, "FUZZY_NGRAM_SIZE", 0)  # word overlap only
+    bank_txns, gl_txns = random_statement(40, seed=3)
+    matches = run_stage(fuzzy_stage, bank_txns, gl_txns)
+
+    assert matches
+    for bank_id, gl_id, match in matches:
+        bank_txn = next(txn for txn in bank_txns if txn.transaction_id == bank_id)
+        gl_txn = next(txn for txn in gl_txns if txn.entry_id == gl_id)
+        bank_words = set(bank_txn.description.lower().split())
+        shared = len(bank_words & set(gl_txn.description.lower().split()))
+        amount_diff = abs(bank_txn.amount - gl_txn.amount) / abs(bank_txn.amount)
+        expected = (1 - min(amount_diff, 1)) * FUZZY_AMOUNT_WEIGHT + shared / len(bank_words) * FUZZY_DESCRIPTION_WEIGHT
+
+        assert match.confidence_score == pytest.approx(expected)
+        assert match.confidence_score > FUZZY_SCORE_THRESHOLD
+
+
+def test_fuzzy_result_does_not_depend_on_block_size(monkeypatch):
+    bank_txns, gl_txns = random_statement(60, seed=5)
+    expected = pairs(run_stage(fuzzy_stage, bank_txns, gl_txns))
+
+    monkeypatch.setattr(matching, "VECTORIZED_FUZZY_BLOCK_SIZE", 7)
+
+    assert expected
+    assert pairs(run_stage(fuzzy_stage, bank_txns, gl_txns)) == expected
+
+
+# ============================================
+# N-GRAM FALLBACK
+# ============================================
+
+def test_ngram_fallback_matches_spacing_variants(monkeypatch):
+    bank_txns = [bank_line("B1", "2025-04-02", "AMAZONWEBSERVICES", 1250.0)]
+    gl_txns = [
+        gl_entry("G1", "2025-04-01", "Amazon Web Services", 1250.0),
+        gl_entry("G2", "2025-04-01", "Office cleaning", 1250.0),
+    ]
+
+    matches = run_stage(fuzzy_stage, bank_txns, gl_txns, 3)
+
+    assert pairs(matches) == {("B1", "G1")}
+    assert matches[0][2].confidence_score > FUZZY_SCORE_THRESHOLD
+
+    monkeypatch.setattr(matching, "FUZZY_NGRAM_SIZE", 0)
+    assert run_stage(fuzzy_stage, bank_txns, gl_txns, 3) == []
+
+
+def test_ngram_index_needs_descriptions():
+    assert NgramIndex.build([]) is None
+    assert NgramIndex.build(["", " "]) is None
+
+
+def test_ngram_cosine_of_identical_descriptions_is_one():
+    index = NgramIndex.build(["Etisalat UAE", "Dubai Electricity"])
+    vectors = index.vectors(["Etisalat UAE"])
+
+    assert index.cosine(vectors, np.array([0, 0]), np.array([0, 1])) == pytest.approx([1.0, 0.0], abs=1e-6)
+
+
+def test_lines_with_a_passing_word_candidate_skip_the_ngram_lookup():
+    # B2's only passing word candidate (G1) goes to B1; B2 never gets the n-gram
+    # candidate G2 and is left for the AI stage (see fuzzy_candidate_pairs)
+    bank_txns = [
+        bank_line("B1", "2025-04-02", "ACME TRADING", 800.0),
+        bank_line("B2", "2025-04-02", "ACME TRADING", 800.0),
+    ]
+    gl_txns = [
+        gl_entry("G1", "2025-04-01", "Acme Trading", 800.0),
+        gl_entry("G2", "2025-04-01", "AcmeTrading", 800.0),
+    ]
+
+    assert pairs(run_stage(fuzzy_stage, bank_txns, gl_txns, 3)) == {("B1", "G1")}
+    assert pairs(run_stage(fuzzy_stage, bank_txns[1:], gl_txns[1:], 3)) == {("B2", "G2")}
+
+
+# ============================================
+# OPTIMAL ASSIGNMENT
+# ============================================
+
+def test_optimal_assignment_beats_greedy_order():
+    # B1 prefers G1, but G1 is B2's only candidate; B1 can still take G2
+    bank_txns = [
+        bank_line("B1", "2025-04-10", "ACME DEWA PAYMENT", 100.0),
+        bank_line("B2", "2025-04-10", "DEWA PAYMENT", 100.0),
+    ]
+    gl_txns = [
+        gl_entry("G1", "2025-04-12", "ACME DEWA payment", 100.0),
+        gl_entry("G2", "2025-04-12", "ACME invoice", 100.0),
+    ]
+
+    assert pairs(run_stage(fuzzy_stage, bank_txns, gl_txns)) == {("B1", "G1")}
+    assert pairs(run_stage(optimal_assignment, bank_txns, gl_txns)) == {("B1", "G2"), ("B2", "G1")}
+
+
+def test_optimal_assignment_includes_exact_pairs():
+    bank_txns = [bank_line("B1", "2025-04-10", "CHQ 001234", 75.5)]
+    gl_txns = [gl_entry("G1", "2025-04-10", "Stationery", 75.5)]
+
+    matches = run_stage(optimal_assignment, bank_txns, gl_txns)
+
+    assert pairs(matches) == {("B1", "G1")}
+    assert matches[0][2].match_type == "exact"
+
+
+def test_optimal_assignment_caps_exact_edges_of_repeated_keys(monkeypatch):
+    monkeypatch.setattr(matching, "OPTIMAL_MAX_CANDIDATES_PER_LINE", 3)
+    monkeypatch.setattr(matching, "FUZZY_NGRAM_SIZE", 0)
+    bank_txns = [bank_line(f"B{i}", "2025-04-30", "PAYROLL TRANSFER", 5000.0) for i in range(30)]
+    gl_txns = [gl_entry(f"G{i}", "2025-04-30", "Staff wages", 5000.0) for i in range(30)]
+    stats = StageStats()
+
+    matches = run_stage(optimal_assignment, bank_txns, gl_txns, 0, stats)
+
+    assert stats.candidates == 30 * 3
+    assert len(matches) == 30
+    assert {match.match_type for _, _, match in matches} == {"exact"}
+    assert len({gl_id for _, gl_id, _ in matches}) == 30
+
+
+# ============================================
+# SPLIT STAGE
+# ============================================
+
+def run_split(bank_txns, gl_txns):
+    vocabulary, bank, gl = build_columns(bank_txns, gl_txns)
+    groups = split_match_stage(
+        bank, np.arange(len(bank)), gl, np.arange(len(gl)), vocabulary.counterparty_mask()
+    )
+    return [group_match for _, _, group_match in groups]
+
+
+def test_subset_sum_finds_parts():
+    amounts = [10000, 25000, 35000, 50000]
+    positions = subset_sum(70000, amounts, max_parts=3, deadline=time.perf_counter() + 1)
+
+    assert len(set(positions)) == len(positions) >= 2
+    assert sum(amounts[pos] for pos in positions) == 70000
+
+
+def test_subset_sum_needs_two_parts():
+    assert subset_sum(50000, [50000, 7000], max_parts=3, deadline=time.perf_counter() + 1) is None
+
+
+def test_split_stage_groups_gl_parts_of_one_payment():
+    bank_txns = [bank_line("B1", "2025-05-10", "TRF AL FUTTAIM MOTORS VEHICLE SERVICE", 3000.0)]
+    gl_txns = [
+        gl_entry("G1", "2025-05-09", "Al Futtaim Motors part payment", 1200.0),
+        gl_entry("G2", "2025-05-11", "Al Futtaim Motors part payment", 1800.0),
+        gl_entry("G3", "2025-05-10", "Office supplies", 1800.0),
+    ]
+
+    groups = run_split(bank_txns, gl_txns)
+
+    assert len(groups) == 1
+    assert groups[0].match_type == "split_bank"
+    assert groups[0].bank_transaction_ids == ["B1"]
+    assert sorted(groups[0].gl_transaction_ids) == ["G1", "G2"]
+
+
+def test_split_stage_groups_bank_lines_of_one_gl_entry():
+    bank_txns = [
+        bank_line("B1", "2025-05-10", "ENOC FUEL CARD TOPUP", 400.0),
+        bank_line("B2", "2025-05-12", "ENOC FUEL CARD TOPUP", 600.0),
+    ]
+    gl_txns = [gl_entry("G1", "2025-05-11", "ENOC fuel card top-up", 1000.0)]
+
+    groups = run_split(bank_txns, gl_txns)
+
+    assert len(groups) == 1
+    assert groups[0].match_type == "split_gl"
+    assert sorted(groups[0].bank_transaction_ids) == ["B1", "B2"]
+
+
+def test_split_stage_ignores_unrelated_lines_that_happen_to_sum():
+    bank_txns = [bank_line("B1", "2025-05-10", "TRF EMIRATES FLIGHT TICKETS", 3000.0)]
+    gl_txns = [
+        gl_entry("G1", "2025-05-09", "Medical cover instalment", 1200.0),
+        gl_entry("G2", "2025-05-11", "Server infrastructure costs", 1800.0),
+    ]
+
+    assert run_split(bank_txns, gl_txns) == []
+
+
+def test_split_matching_is_opt_in():
+    bank_txns = [bank_line("B1", "2025-05-10", "TRF AL FUTTAIM MOTORS VEHICLE SERVICE", 3000.0)]
+    gl_txns = [
+        gl_entry("G1", "2025-05-09", "Al Futtaim Motors part payment", 1200.0),
+        gl_entry("G2", "2025-05-11", "Al Futtaim Motors part payment", 1800.0),
+    ]
+
+    default_events = list(deterministic_stages(bank_txns, gl_txns))
+    split_events = list(deterministic_stages(bank_txns, gl_txns, split_matching=True))
+
+    assert not any(event["type"] == "group_match" for event in default_events)
+    assert [event["type"] for event in split_events].count("group_match") == 1
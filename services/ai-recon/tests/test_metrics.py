@@ -0,0 +1,146 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app import ai_matching
+from app.main import app, server_timing
+from app.matching import StageStats
+from app.models import BankTransaction, GLTransaction
+from app.pipeline import observe_stage, reconcile_stages
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def bank_line(transaction_id, description, amount, transaction_date="2025-01-15"):
+    return BankTransaction(
+        transaction_id=transaction_id,
+        transaction_date=transaction_date,
+        description=description,
+        amount=amount,
+        transaction_type="debit",
+    )
+
+
+def gl_entry(entry_id, description, amount, entry_date="2025-01-15"):
+    return GLTransaction(
+        entry_id=entry_id,
+        entry_date=entry_date,
+        description=description,
+        amount=amount,
+        account_code="5000",
+        account_name="Expenses",
+    )
+
+
+class UsageClient:
+    """Fake AI client that reports token usage, or fails when told to"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def create(self, model, max_tokens, temperature, messages):
+        if self.fail:
+            raise RuntimeError("overloaded")
+        answer = {"matched_gl_id": None, "confidence": 0.0, "reasoning": "No confident match found"}
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=json.dumps(answer))],
+            usage=SimpleNamespace(input_tokens=120, output_tokens=15),
+        )
+
+
+def test_server_timing_lists_every_stage_and_the_total():
+    assert server_timing({"exact": 1.234, "ai": 20.0}, 25.55) == "exact;dur=1.2, ai;dur=20.0, total;dur=25.6"
+
+
+def test_reconcile_sets_server_timing_header():
+    body = {
+        "tenant_id": "00000000-0000-0000-0000-000000000001",
+        "account_id": "BANK-001",
+        "bank_transactions": [bank_line("B1", "Office rent", 5000.0).model_dump()],
+        "gl_transactions": [gl_entry("G1", "Office rent", 5000.0).model_dump()],
+    }
+
+    response = client.post("/reconcile", json=body)
+
+    metrics = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert metrics == list(response.json()["stage_timings_ms"]) + ["total"]
+
+
+def test_observe_stage_records_duration_and_candidates():
+    before = (
+        sample("airp_ai_recon_stage_duration_seconds_count", stage="test"),
+        sample("airp_ai_recon_candidates_examined_total", stage="test"),
+        sample("airp_ai_recon_bank_lines_examined_total", stage="test"),
+    )
+
+    observe_stage({"stage": "test", "duration_ms": 40.0, "candidates": 12, "lines": 4})
+
+    assert sample("airp_ai_recon_stage_duration_seconds_count", stage="test") == before[0] + 1
+    assert sample("airp_ai_recon_candidates_examined_total", stage="test") == before[1] + 12
+    assert sample("airp_ai_recon_bank_lines_examined_total", stage="test") == before[2] + 4
+
+
+def test_stage_events_carry_candidate_counts():
+    bank_txns = [bank_line("B1", "Office rent", 5000.0), bank_line("B2", "DEWA bill", 450.0, "2025-01-16")]
+    gl_txns = [gl_entry("G1", "Office rent", 5000.0), gl_entry("G2", "DEWA electricity bill", 450.0)]
+
+    async def collect():
+        return [event async for event in reconcile_stages(bank_txns, gl_txns)]
+
+    completed = {event["stage"]: event for event in asyncio.run(collect()) if event["type"] == "stage_complete"}
+
+    assert list(completed) == ["exact", "reference", "fuzzy", "ai"]
+    assert (completed["exact"]["lines"], completed["exact"]["matches"]) == (2, 1)
+    assert completed["fuzzy"]["lines"] == 1 and completed["fuzzy"]["candidates"] >= 1
+
+
+def test_stage_stats_accumulate():
+    stats = StageStats()
+    stats.add(3, 1)
+    stats.add(2, 1)
+
+    assert (stats.candidates, stats.lines) == (5, 2)
+
+
+def run_ai_stage(monkeypatch, ai_client, bank_txns, gl_txns):
+    monkeypatch.setattr(ai_matching, "ai_client", ai_client)
+    monkeypatch.setattr(ai_matching, "ai_semaphore", asyncio.Semaphore(ai_matching.AI_MAX_CONCURRENCY))
+    return asyncio.run(ai_matching.ai_match_stage(bank_txns, gl_txns, ai_mode="single"))
+
+
+def test_ai_calls_and_tokens_are_counted(monkeypatch):
+    before = {
+        outcome: sample("airp_ai_recon_ai_calls_total", outcome=outcome) for outcome in ("made", "skipped", "failed")
+    }
+    input_before = sample("airp_ai_recon_ai_tokens_total", direction="input")
+    output_before = sample("airp_ai_recon_ai_tokens_total", direction="output")
+    gl_txns = [gl_entry("G1", "Emirates Logistics freight", 1000.0)]
+
+    run_ai_stage(monkeypatch, UsageClient(), [
+        bank_line("B1", "EMIRATES LOGISTICS", 1000.0),
+        bank_line("B2", "UNRELATED", 99999.0, "2024-01-01"),
+    ], gl_txns)
+    run_ai_stage(monkeypatch, UsageClient(fail=True), [bank_line("B3", "EMIRATES LOGISTICS", 1000.0)], gl_txns)
+
+    assert sample("airp_ai_recon_ai_calls_total", outcome="made") == before["made"] + 1
+    assert sample("airp_ai_recon_ai_calls_total", outcome="skipped") == before["skipped"] + 1
+    assert sample("airp_ai_recon_ai_calls_total", outcome="failed") == before["failed"] + 1
+    assert sample("airp_ai_recon_ai_tokens_total", direction="input") == input_before + 120
+    assert sample("airp_ai_recon_ai_tokens_total", direction="output") == output_before + 15
+
+
+def test_metrics_endpoint_exposes_stage_metrics():
+    observe_stage({"stage": "exact", "duration_ms": 1.0, "candidates": 1, "lines": 1})
+
+    text = client.get("/metrics").text
+
+    assert "airp_ai_recon_stage_duration_seconds_bucket" in text
+    assert "airp_ai_recon_candidates_examined_total" in text
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import stores
+from app.main import app
+from app.models import BankTransaction
+from app.stores import SessionLocks, SessionStore
+
+client = TestClient(app)
+TENANT_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def bank_line(transaction_id, amount, description="Office rent payment", transaction_date="2025-01-15"):
+    return {"transaction_id": transaction_id, "transaction_date": transaction_date, "description": description,
+            "amount": amount, "transaction_type": "debit"}
+
+
+def gl_entry(entry_id, amount, description="Monthly office rent", entry_date="2025-01-15"):
+    return {"entry_id": entry_id, "entry_date": entry_date, "description": description,
+            "amount": amount, "account_code": "6100", "account_name": "Rent Expense"}
+
+
+def create_session(bank_lines, gl_lines):
+    return client.post("/sessions", json={
+        "tenant_id": TENANT_ID, "account_id": "BANK-001",
+        "bank_transactions": bank_lines, "gl_transactions": gl_lines,
+    })
+
+
+def test_existing_line_ids_uses_one_query_per_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(stores, "SESSION_LINE_ID_CHUNK", 100)
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    session_id = store.create(TENANT_ID, "BANK-001", {})
+    store.add_lines(session_id, [
+        BankTransaction(**bank_line(f"B{i}", 10.0 + i)) for i in range(0, 250, 2)
+    ], [])
+    queries = []
+    store._connection().set_trace_callback(queries.append)
+
+    existing = store.existing_line_ids(session_id, "bank", [f"B{i}" for i in reversed(range(250))])
+
+    assert existing == [f"B{i}" for i in reversed(range(0, 250, 2))]
+    assert len([query for query in queries if query.lstrip().startswith("SELECT")]) == 3
+    assert store.existing_line_ids(session_id, "gl", ["B0"]) == []
+
+
+def test_session_matches_late_lines_against_open_lines_only():
+    created = create_session([bank_line("B1", 5000.0), bank_line("B2", 450.0, "DEWA bill")], [gl_entry("G1", 5000.0)])
+    assert created.status_code == 200
+    session = created.json()
+    assert [(m["bank_transaction_id"], m["gl_transaction_id"]) for m in session["matches"]] == [("B1", "G1")]
+    assert session["unmatched_bank"] == ["B2"]
+
+    added = client.post(f"/sessions/{session['session_id']}/lines", json={
+        "tenant_id": TENANT_ID, "gl_transactions": [gl_entry("G2", 450.0, "DEWA bill"), gl_entry("G3", 5000.0)],
+    })
+
+    assert added.status_code == 200
+    assert added.json()["new_matches"] == 1
+    assert [(m["bank_transaction_id"], m["gl_transaction_id"]) for m in added.json()["matches"]] == [
+        ("B1", "G1"), ("B2", "G2"),
+    ]
+    assert added.json()["unmatched_gl"] == ["G3"]
+    state = client.get(f"/sessions/{session['session_id']}", params={"tenant_id": TENANT_ID})
+    assert state.json()["matches"] == added.json()["matches"]
+
+
+def test_duplicate_lines_are_rejected_before_anything_is_stored():
+    duplicate_call = create_session([bank_line("B1", 5000.0), bank_line("B1", 450.0)], [])
+    assert duplicate_call.status_code == 409
+
+    session_id = create_session([bank_line("B1", 5000.0)], [gl_entry("G1", 10.0)]).json()["session_id"]
+    repeated = client.post(f"/sessions/{session_id}/lines", json={
+        "tenant_id": TENANT_ID, "bank_transactions": [bank_line("B1", 5000.0), bank_line("B5", 10.0)],
+    })
+
+    assert repeated.status_code == 409
+    assert "B1" in repeated.json()["detail"]
+    state = client.get(f"/sessions/{session_id}", params={"tenant_id": TENANT_ID}).json()
+    assert state["unmatched_bank"] == ["B1"]  # B5 was not added either
+
+
+def test_sessions_are_per_tenant():
+    session_id = create_session([bank_line("B1", 5000.0)], []).json()["session_id"]
+
+    response = client.get(f"/sessions/{session_id}", params={"tenant_id": "00000000-0000-0000-0000-000000000002"})
+
+    assert response.status_code == 404
+
+
+def test_session_locks_serialize_and_are_dropped_when_idle():
+    locks = SessionLocks()
+    order = []
+
+    async def update(session_id: str, name: str):
+        async with locks.hold(session_id):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(update("s1", "a"), update("s1", "b"), update("s2", "c"))
+        return len(locks)
+
+    assert asyncio.run(run()) == 0
+    s1_events = [event for event in order if event[0] in "ab"]
+    assert s1_events in (
+        ["a start", "a end", "b start", "b end"],
+        ["b start", "b end", "a start", "a end"],
+    )
+
+
+def test_session_lock_is_dropped_when_the_holder_fails():
+    locks = SessionLocks()
+
+    async def failing_update():
+        async with locks.hold("s1"):
+            raise RuntimeError("matching failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing_update())
+    assert len(locks) == 0
@@ -0,0 +1,174 @@
+import pytest
+
+from app.statement_ingest import StatementColumns, create_parser, detect_format, ingest_chunks, parse_amount
+
+CSV_STATEMENT = b"""Transaction Date,Value Date,Description,Reference,Debit,Credit,Balance
+15-Jan-2025,15-Jan-2025,"RENT PMT DUBAI PROPERTIES, LLC",CHQ-001234,25000.00,,75000.00
+18-Jan-2025,18-Jan-2025,"CUSTOMER RECEIPT
+INV-2025-0042",TRF-778,,"12,500.50",87500.50
+not a date,20-Jan-2025,BANK CHARGES,,35.00,,87465.50
+"""
+
+MT940_STATEMENT = b"""{1:F01EBILAEADXXXX}{4:
+:20:STMT250131
+:25:AE070331234567890123456
+:28C:1/1
+:60F:C250101AED100000,00
+:61:2501150115D5000,00NTRFCHQ-001234//BR1
+:86:RENT PMT DUBAI PROPERTIES
+LLC
+:61:250118C1200,00NTRFNONREF//DD-DEWA-8765
+:86:DEWA REFUND
+:61:250120RD300,00NTRFREV-1
+:86:REVERSED CHARGE
+:62F:C250131AED75900,00
+-}"""
+
+CAMT_STATEMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><BkToCstmrStmt><Stmt>
+<Ntry><Amt Ccy="AED">5000.00</Amt><CdtDbtInd>DBIT</CdtDbtInd><BookgDt><Dt>2025-01-15</Dt></BookgDt>
+<AcctSvcrRef>CHQ-1</AcctSvcrRef><NtryDtls><TxDtls><RmtInf><Ustrd>RENT PMT</Ustrd></RmtInf></TxDtls></NtryDtls></Ntry>
+<Ntry><Amt Ccy="AED">1200.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><BookgDt><DtTm>2025-01-18T10:00:00</DtTm></BookgDt>
+<AddtlNtryInf>DEWA REFUND</AddtlNtryInf></Ntry>
+</Stmt></BkToCstmrStmt></Document>"""
+
+
+def chunked(data: bytes, size: int):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_csv_debit_credit_columns():
+    columns = ingest_chunks([CSV_STATEMENT], "csv")
+
+    assert columns.to_dicts() == [
+        {
+            "transaction_id": "BANK-0001",
+            "transaction_date": "2025-01-15",
+            "description": "RENT PMT DUBAI PROPERTIES, LLC",
+            "amount": 25000.0,
+            "transaction_type": "debit",
+            "reference_number": "CHQ-001234",
+        },
+        {
+            "transaction_id": "BANK-0002",
+            "transaction_date": "2025-01-18",
+            "description": "CUSTOMER RECEIPT\nINV-2025-0042",
+            "amount": 12500.5,
+            "transaction_type": "credit",
+            "reference_number": "TRF-778",
+        },
+        {
+            "transaction_id": "BANK-0003",
+            "transaction_date": "not a date",
+            "description": "BANK CHARGES",
+            "amount": 35.0,
+            "transaction_type": "debit",
+            "reference_number": "",
+        },
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_csv_chunk_boundaries_do_not_change_result(size):
+    assert ingest_chunks(chunked(CSV_STATEMENT, size), "csv").to_dicts() == ingest_chunks([CSV_STATEMENT], "csv").to_dicts()
+
+
+def test_csv_signed_amount_column():
+    statement = b"Date,Narrative,Amount\n2025-02-01,SALARY,-8000\n2025-02-02,REFUND,150.25\n"
+
+    rows = ingest_chunks([statement], "csv").to_dicts()
+
+    assert [(row["amount"], row["transaction_type"], row["reference_number"]) for row in rows] == [
+        (8000.0, "debit", None),
+        (150.25, "credit", None),
+    ]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5,000", 5000.0),
+    ("1,234,567", 1234567.0),
+    ("1,234.50", 1234.5),
+    ("1.234,50", 1234.5),
+    ("1.234.567", 1234567.0),
+    ("1234,5", 1234.5),
+    ("25000.00", 25000.0),
+    ("-8 000", -8000.0),
+    ("", 0.0),
+])
+def test_parse_amount_separators(text, expected):
+    assert parse_amount(text) == expected
+
+
+def test_csv_thousands_separators_without_decimals():
+    statement = (
+        b'Date,Description,Debit,Credit\n'
+        b'2025-02-01,RENT,"5,000",\n'
+        b'2025-02-02,PAYROLL,"1,234,567",\n'
+        b'2025-02-03,REFUND,,"1.234,50"\n'
+    )
+
+    rows = ingest_chunks([statement], "csv").to_dicts()
+
+    assert [(row["amount"], row["transaction_type"]) for row in rows] == [
+        (5000.0, "debit"),
+        (1234567.0, "debit"),
+        (1234.5, "credit"),
+    ]
+
+
+def test_mt940_amounts_always_use_a_decimal_comma():
+    assert parse_amount("5000,", decimal_comma=True) == 5000.0
+    assert parse_amount("1,5", decimal_comma=True) == 1.5
+    assert parse_amount("1,234", decimal_comma=True) == 1.234
+
+
+@pytest.mark.parametrize("size", [5, 4096])
+def test_mt940_statement_lines(size):
+    rows = ingest_chunks(chunked(MT940_STATEMENT, size), "mt940").to_dicts()
+
+    assert [(row["transaction_date"], row["amount"], row["transaction_type"]) for row in rows] == [
+        ("2025-01-15", 5000.0, "debit"),
+        ("2025-01-18", 1200.0, "credit"),
+        ("2025-01-20", 300.0, "credit"),  # RD reverses a debit
+    ]
+    assert rows[0]["description"] == "RENT PMT DUBAI PROPERTIES LLC"
+    assert rows[0]["reference_number"] == "CHQ-001234"
+    # NONREF falls back to the bank reference
+    assert rows[1]["reference_number"] == "DD-DEWA-8765"
+
+
+@pytest.mark.parametrize("size", [13, 4096])
+def test_camt053_entries(size):
+    rows = ingest_chunks(chunked(CAMT_STATEMENT, size), "camt053").to_dicts()
+
+    assert [
+        (row["transaction_date"], row["description"], row["amount"], row["transaction_type"], row["reference_number"])
+        for row in rows
+    ] == [
+        ("2025-01-15", "RENT PMT", 5000.0, "debit", "CHQ-1"),
+        ("2025-01-18", "DEWA REFUND", 1200.0, "credit", None),
+    ]
+
+
+def test_detect_format():
+    assert detect_format(CSV_STATEMENT) == "csv"
+    assert detect_format(MT940_STATEMENT) == "mt940"
+    assert detect_format(CAMT_STATEMENT) == "camt053"
+    assert detect_format(CSV_STATEMENT, "statement.sta") == "mt940"
+    assert detect_format(b"\xef\xbb\xbf<?xml version='1.0'?>") == "camt053"
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        create_parser("qif", StatementColumns())
+
+
+def test_statement_columns_behave_like_a_sequence():
+    columns = ingest_chunks([CSV_STATEMENT], "csv")
+
+    assert len(columns) == 3
+    assert columns[-1].description == "BANK CHARGES"
+    assert [row.transaction_id for row in columns] == ["BANK-0001", "BANK-0002", "BANK-0003"]
+    assert columns.transaction_dates() == [columns.transaction_date(row) for row in range(len(columns))]
+    with pytest.raises(IndexError):
+        columns[3]
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from app import stores
+from app.models import BankTransaction, GLTransaction
+from app.pipeline import deterministic_stages
+from app.stores import AliasStore, normalize_description
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "aliases.sqlite3")
+
+
+def test_normalize_description():
+    assert normalize_description("FB ADS - 0423 / Campaign#7") == "fb ads campaign"
+    assert normalize_description("12345") == ""
+
+
+def test_alias_lookup_ignores_numbers_and_case(store_path):
+    store = AliasStore(store_path)
+
+    key = store.learn("t1", "FB ADS MARKETING CAMPAIGN 0423", "Meta platforms invoice", "ai")
+
+    assert key == "fb ads marketing campaign"
+    assert store.lookup("t1", "fb ads marketing campaign - 0511") == "Meta platforms invoice"
+
+
+def test_aliases_are_per_tenant(store_path):
+    store = AliasStore(store_path)
+    store.learn("t1", "FB ADS", "Meta advertising", "manual")
+
+    assert store.lookup("t2", "FB ADS") is None
+
+
+def test_descriptions_without_letters_are_not_learned(store_path):
+    store = AliasStore(store_path)
+
+    assert store.learn("t1", "0423 / 17", "Meta advertising", "manual") is None
+    assert store.lookup("t1", "0423 / 17") is None
+
+
+def test_relearning_replaces_alias_and_counts_hits(store_path):
+    store = AliasStore(store_path)
+    store.learn("t1", "FB ADS", "Meta advertising", "ai")
+    store.learn("t1", "FB ADS", "Social media advertising", "manual")
+
+    assert store.lookup("t1", "FB ADS") == "Social media advertising"
+    [alias] = store.list_aliases("t1")
+    assert (alias["description_key"], alias["alias"], alias["source"], alias["hits"]) == (
+        "fb ads", "Social media advertising", "manual", 2
+    )
+
+
+def test_cached_miss_expires_so_other_processes_see_new_aliases(store_path, monkeypatch):
+    monkeypatch.setattr(stores, "ALIAS_CACHE_TTL_SECONDS", 0.05)
+    worker = AliasStore(store_path)
+    other_worker = AliasStore(store_path)
+    assert worker.lookup("t1", "FB ADS") is None
+
+    other_worker.learn("t1", "FB ADS", "Meta advertising", "manual")
+    # Still within the TTL: the worker serves its cached miss
+    assert worker.lookup("t1", "FB ADS") is None
+
+    time.sleep(0.1)
+    assert worker.lookup("t1", "FB ADS") == "Meta advertising"
+
+
+def test_alias_cache_is_bounded(store_path):
+    store = AliasStore(store_path, cache_size=2)
+    for description in ("alpha", "bravo", "charlie"):
+        store.learn("t1", description, description.upper(), "manual")
+
+    assert len(store._cache) == 2
+    assert store.lookup("t1", "alpha") == "ALPHA"
+
+
+def test_learned_alias_lets_fuzzy_stage_match(monkeypatch, store_path):
+    monkeypatch.setattr(stores, "alias_store", AliasStore(store_path))
+    bank_txns = [BankTransaction(
+        transaction_id="B1", transaction_date="2025-04-01", description="FB ADS 0423",
+        amount=1200.0, transaction_type="debit",
+    )]
+    gl_txns = [GLTransaction(
+        entry_id="G1", entry_date="2025-04-03", description="Meta platforms invoice",
+        amount=1200.0, account_code="6100", account_name="Marketing",
+    )]
+
+    def fuzzy_matches(tenant_id):
+        events = deterministic_stages(bank_txns, gl_txns, tenant_id=tenant_id)
+        return [event["match"] for event in events if event["type"] == "match"]
+
+    assert fuzzy_matches("t1") == []
+    stores.alias_store.learn("t1", "FB ADS 0511", "Meta platforms invoice", "manual")
+
+    [match] = fuzzy_matches("t1")
+    assert match.gl_transaction_id == "G1"
+    assert match.match_reasoning.endswith("via learned alias")
+    assert fuzzy_matches("t2") == []
+
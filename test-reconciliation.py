@@ -3,52 +3,22 @@
 AIRP v2.0 - Bank Reconciliation Test
 Tests reconciliation of bank statements with GL entries using real AI
 """
-import csv
 import json
+import os
+import sys
 import requests
-from datetime import datetime
 from typing import List, Dict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "services", "ai-recon", "app"))
+from statement_ingest import ingest_file
+
 RECON_API = "http://localhost:8002/reconcile"
 TENANT_ID = "00000000-0000-0000-0000-000000000001"
 BANK_ACCOUNT_ID = "00000000-0000-0000-0000-BA0000000001"
 
 def parse_bank_statement(csv_file: str) -> List[Dict]:
-    """Parse Emirates NBD bank statement CSV"""
-    bank_transactions = []
-
-    with open(csv_file, 'r') as f:
-        reader = csv.DictReader(f)
-        txn_id = 1
-
-        for row in reader:
-            # Determine if it's debit or credit
-            debit = float(row['Debit']) if row['Debit'] else 0
-            credit = float(row['Credit']) if row['Credit'] else 0
-
-            amount = -debit if debit > 0 else credit
-            txn_type = "debit" if debit > 0 else "credit"
-
-            # Convert date format from DD-Mon-YYYY to YYYY-MM-DD
-            date_str = row['Transaction Date']
-            try:
-                date_obj = datetime.strptime(date_str, '%d-%b-%Y')
-                formatted_date = date_obj.strftime('%Y-%m-%d')
-            except:
-                formatted_date = date_str
-
-            bank_transactions.append({
-                "transaction_id": f"BANK-{txn_id:04d}",
-                "transaction_date": formatted_date,
-                "description": row['Description'],
-                "amount": abs(amount),
-                "transaction_type": txn_type,
-                "reference_number": row['Reference']
-            })
-
-            txn_id += 1
-
-    return bank_transactions
+    """Parse Emirates NBD bank statement CSV (shared streaming ingestion used by ai-recon)"""
+    return ingest_file(csv_file, "csv").to_dicts()
 
 
 def create_mock_gl_transactions() -> List[Dict]:
@@ -170,6 +140,19 @@ def display_results(result: Dict):
         print(f"  Confidence: {match['confidence_score']:.1%}")
         print(f"  Reasoning: {match['match_reasoning']}")
 
+    # Split (one-to-many / many-to-one) matches
+    group_matches = result.get('group_matches', [])
+    if group_matches:
+        print()
+        print(f"\nSPLIT MATCHES ({len(group_matches)})")
+        print("-" * 80)
+
+        for group in group_matches:
+            print(f"\nBank: {', '.join(group['bank_transaction_ids'])}")
+            print(f"  -> GL: {', '.join(group['gl_transaction_ids'])}")
+            print(f"  Confidence: {group['confidence_score']:.1%}")
+            print(f"  Reasoning: {group['match_reasoning']}")
+
     print()
     print("=" * 80)
 
@@ -198,8 +181,8 @@ def display_results(result: Dict):
 
     # Summary
     total_bank = len(bank_transactions)
-    matched = len(result['matches'])
     unmatched_bank_count = len(result['unmatched_bank'])
+    matched = total_bank - unmatched_bank_count
 
     print("\nSUMMARY:")
     print(f"  Total Bank Transactions: {total_bank}")
@@ -209,13 +192,16 @@ def display_results(result: Dict):
 
     # Match type breakdown
     exact_matches = sum(1 for m in result['matches'] if m['match_type'] == 'exact')
+    reference_matches = sum(1 for m in result['matches'] if m['match_type'] == 'reference')
     fuzzy_matches = sum(1 for m in result['matches'] if m['match_type'] == 'fuzzy')
     ai_matches = sum(1 for m in result['matches'] if m['match_type'] == 'ai')
 
     print("MATCH TYPE BREAKDOWN:")
     print(f"  Exact Matches: {exact_matches}")
+    print(f"  Reference Matches: {reference_matches}")
     print(f"  Fuzzy Matches: {fuzzy_matches}")
     print(f"  AI Matches: {ai_matches}")
+    print(f"  Split Matches: {len(group_matches)}")
     print()
 
     # Status